@@ -0,0 +1,75 @@
+"""
+Compare DataFrame.to_sql appends with tushare/db_utils.py bulk_upsert on a synthetic ts_a_stock_eod_price batch.
+
+Needs a running MySQL compatible server (e.g. dolt sql-server), e.g.
+    python3 benchmark/bench_bulk_insert.py --rows=200000
+The benchmark creates and drops its own table, the real tables are not touched.
+"""
+import os
+import sys
+
+import fire
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from bench_utils import REPO_DIR, measure, print_report
+
+sys.path.append(os.path.join(REPO_DIR, "tushare"))
+from db_utils import bulk_upsert
+
+TABLE = "bench_ts_a_stock_eod_price"
+
+
+def _make_price_df(rows, symbol_count=5000):
+    rng = np.random.default_rng(0)
+    day_count = (rows + symbol_count - 1) // symbol_count
+    dates = pd.bdate_range("2020-01-01", periods=day_count).strftime("%Y-%m-%d")
+    symbols = [f"{i:06d}.SZ" for i in range(symbol_count)]
+    index = pd.MultiIndex.from_product([dates, symbols], names=["tradedate", "symbol"])[:rows]
+    df = index.to_frame(index=False)
+    close = rng.uniform(1, 100, rows).round(2)
+    for name in ["high", "low", "open", "close", "adjclose"]:
+        df[name] = close
+    df["volume"] = rng.integers(1, 10 ** 6, rows).astype(float)
+    df["amount"] = (df["volume"] * close).round(2)
+    return df
+
+
+def _reset_table(sqlEngine):
+    with sqlEngine.begin() as connection:
+        connection.execute(text(f"drop table if exists {TABLE}"))
+        connection.execute(text(f"""
+            create table {TABLE} (
+                tradedate date not null, symbol varchar(16) not null,
+                high double, low double, open double, close double, adjclose double, volume double, amount double,
+                primary key (tradedate, symbol))"""))
+
+
+def _measure(name, func, rows):
+    result = measure(name, func)
+    print(f"[BENCH] {name}: {rows / result['seconds']:,.0f} rows/sec")
+    return result
+
+
+def bench_bulk_insert(rows=100000, dsn="mysql+pymysql://root:@127.0.0.1/investment_data", chunk_rows=5000):
+    sqlEngine = create_engine(dsn, pool_recycle=3600)
+    df = _make_price_df(rows)
+    results = []
+
+    _reset_table(sqlEngine)
+    results.append(_measure("to_sql append", lambda: df.to_sql(TABLE, sqlEngine, if_exists="append", index=False), rows))
+
+    _reset_table(sqlEngine)
+    results.append(_measure("bulk_upsert", lambda: bulk_upsert(sqlEngine, TABLE, df, chunk_rows), rows))
+    # 再写一次相同数据：to_sql 会主键冲突，bulk_upsert 应该成功且行数不变
+    results.append(_measure("bulk_upsert rerun", lambda: bulk_upsert(sqlEngine, TABLE, df, chunk_rows), rows))
+    with sqlEngine.connect() as connection:
+        count = connection.execute(text(f"select count(*) from {TABLE}")).scalar()
+        connection.execute(text(f"drop table {TABLE}"))
+    print(f"{count} rows in table after rerun, expected {rows}")
+    print_report(results)
+
+
+if __name__ == "__main__":
+    fire.Fire(bench_bulk_insert)
@@ -0,0 +1,71 @@
+"""
+Startup cost of the tushare scripts, measured with `python -X importtime`.
+
+    python benchmark/bench_import_time.py --budget_ms=1500
+
+Every module is imported in a fresh interpreter with a dummy TUSHARE token, so neither the
+Tushare client nor the akshare / yahooquery fallbacks should show up in the import tree.
+Exits with an error when a module is over the budget or imports one of the deferred packages.
+"""
+import os
+import subprocess
+import sys
+
+import fire
+
+from bench_utils import REPO_DIR
+
+MODULES = [
+    "dump_index_weight",
+    "dump_index_eod_price",
+    "update_a_stock_eod_price_to_latest",
+    "dump_a_stock_eod_price",
+    "update_link_ratio",
+    "merge_final_price",
+    "update_final_stock_limit",
+    "daily_update",
+    "cli",
+]
+# 只在首次调用时才应导入的包
+DEFERRED_PACKAGES = ["tushare", "akshare", "yahooquery"]
+
+
+def import_time(module, cwd):
+    """Cumulative import time in ms of module, and the top level packages it pulled in."""
+    env = dict(os.environ, TUSHARE=os.environ.get("TUSHARE", "dummy"))
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=cwd, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+    cumulative_us = 0
+    packages = set()
+    # import time: self [us] | cumulative | imported package
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = [part.strip() for part in line[len("import time:"):].split("|")]
+        if not cumulative.isdigit():
+            continue
+        packages.add(name.split(".")[0])
+        if name == module:
+            cumulative_us = int(cumulative)
+    return cumulative_us / 1000, packages
+
+
+def bench_import_time(budget_ms=1500.0, modules=None):
+    cwd = os.path.join(REPO_DIR, "tushare")
+    modules = modules.split(",") if isinstance(modules, str) else (modules or MODULES)
+    failed = []
+    print(f"{'module':<40}{'import ms':>12}  deferred packages imported")
+    for module in modules:
+        ms, packages = import_time(module, cwd)
+        eager = sorted(p for p in DEFERRED_PACKAGES if p in packages)
+        print(f"{module:<40}{ms:>12.1f}  {', '.join(eager) or '-'}")
+        if ms > budget_ms or eager:
+            failed.append(module)
+    if failed:
+        raise SystemExit(f"over the {budget_ms:.0f} ms budget or importing deferred packages: {failed}")
+
+
+if __name__ == "__main__":
+    fire.Fire(bench_import_time)
@@ -0,0 +1,83 @@
+"""
+Compare size and pandas load time of the qlib_bin.tar.gz release with the parquet dataset from qlib/dump_parquet.py.
+
+Run after dump_qlib_bin.sh, e.g.
+    python3 benchmark/bench_parquet_release.py --qlib_bin_tar ./qlib_bin.tar.gz --parquet_dir /tmp/qlib_parquet
+"""
+import glob
+import os
+import shutil
+import sys
+import tarfile
+
+import fire
+import numpy as np
+import pandas as pd
+
+from bench_utils import REPO_DIR, measure, print_report
+
+sys.path.append(os.path.join(REPO_DIR, "qlib"))
+import qlib_bin_utils
+
+FIELDS = ["open", "high", "low", "close", "volume"]
+
+
+def _size_mb(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path) / 1024 / 1024
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files) / 1024 / 1024
+
+
+def _extract(qlib_bin_tar, work_dir):
+    shutil.rmtree(work_dir, ignore_errors=True)
+    with tarfile.open(qlib_bin_tar) as tar:
+        tar.extractall(work_dir)
+    # tar keeps the absolute path of qlib_bin, find it by its calendar
+    return os.path.dirname(os.path.dirname(glob.glob(f"{work_dir}/**/calendars/day.txt", recursive=True)[0]))
+
+
+def _load_bin(qlib_dir, symbols):
+    calendar = np.array(qlib_bin_utils.read_calendar(qlib_dir), dtype="datetime64[ns]")
+    frames = []
+    for symbol in symbols:
+        feature_dir = qlib_bin_utils.get_feature_dir(qlib_dir, symbol)
+        columns = {}
+        for field in FIELDS:
+            start_index, values = qlib_bin_utils.read_bin(qlib_bin_utils.get_bin_path(feature_dir, field))
+            columns[field] = values
+        df = pd.DataFrame(columns)
+        df.insert(0, "tradedate", calendar[start_index:start_index + len(df)])
+        df.insert(0, "symbol", symbol)
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True)
+
+
+def _load_parquet(parquet_dir, symbols=None):
+    filters = [("symbol", "in", list(symbols))] if symbols is not None else None
+    return pd.read_parquet(f"{parquet_dir}/prices", columns=["tradedate", "symbol"] + FIELDS, filters=filters)
+
+
+def bench_parquet_release(qlib_bin_tar, parquet_dir, work_dir="/tmp/bench_parquet_release", sample_size=50):
+    qlib_dir = _extract(qlib_bin_tar, work_dir)
+    all_symbols = sorted(qlib_bin_utils.read_instruments(qlib_dir))
+    sample_symbols = all_symbols[::max(1, len(all_symbols) // sample_size)][:sample_size]
+
+    results = [
+        measure("qlib_bin extract tar.gz", lambda: _extract(qlib_bin_tar, work_dir)),
+        measure(f"qlib_bin load {len(sample_symbols)} symbols", lambda: _load_bin(qlib_dir, sample_symbols)),
+        measure(f"parquet load {len(sample_symbols)} symbols", lambda: _load_parquet(parquet_dir, sample_symbols)),
+        measure(f"qlib_bin load all {len(all_symbols)} symbols", lambda: _load_bin(qlib_dir, all_symbols)),
+        measure("parquet load all symbols", lambda: _load_parquet(parquet_dir)),
+    ]
+    for result in results[1:]:
+        print(f"{result['name']}: {len(result['result'])} rows")
+    print_report(results)
+
+    print(f"{'artifact':<40}{'size MB':>12}")
+    print(f"{'qlib_bin.tar.gz':<40}{_size_mb(qlib_bin_tar):>12.1f}")
+    print(f"{'qlib_bin extracted':<40}{_size_mb(qlib_dir):>12.1f}")
+    print(f"{'parquet dataset':<40}{_size_mb(parquet_dir):>12.1f}")
+
+
+if __name__ == "__main__":
+    fire.Fire(bench_parquet_release)
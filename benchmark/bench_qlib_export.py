@@ -0,0 +1,87 @@
+"""
+Compare the three-stage qlib export (csv -> normalized csv -> dump_bin.py) with qlib/dump_qlib_bin_direct.py,
+and the batch normalizer with qlib's per-symbol normalizer.
+
+Needs a running sql server with final_a_stock_eod_price and qlib's scripts directory, e.g.
+    python3 benchmark/bench_qlib_export.py --qlib_scripts_dir ~/qlib/scripts
+"""
+import filecmp
+import os
+import shutil
+import sys
+
+import fire
+import numpy as np
+
+from bench_utils import run_measured, python_cmd, print_report
+
+
+def _compare_bins(expected_dir, actual_dir):
+    mismatch = 0
+    total = 0
+    for root, _, files in os.walk(os.path.join(expected_dir, "features")):
+        for file in files:
+            total += 1
+            expected_path = os.path.join(root, file)
+            actual_path = os.path.join(actual_dir, os.path.relpath(expected_path, expected_dir))
+            if not os.path.exists(actual_path):
+                mismatch += 1
+                continue
+            expected = np.fromfile(expected_path, dtype="<f")
+            actual = np.fromfile(actual_path, dtype="<f")
+            if not np.array_equal(expected, actual, equal_nan=True):
+                mismatch += 1
+    return total, mismatch
+
+
+def _compare_csvs(expected_dir, actual_dir):
+    names = sorted(os.listdir(expected_dir))
+    mismatch = 0
+    for name in names:
+        actual_path = os.path.join(actual_dir, name)
+        if not os.path.exists(actual_path) or not filecmp.cmp(os.path.join(expected_dir, name), actual_path, shallow=False):
+            mismatch += 1
+    return len(names), mismatch
+
+
+def bench_qlib_export(qlib_scripts_dir, work_dir="/tmp/bench_qlib_export", max_workers=16, compare=True):
+    shutil.rmtree(work_dir, ignore_errors=True)
+    source_dir = os.path.join(work_dir, "qlib_source")
+    normalize_dir = os.path.join(work_dir, "qlib_normalize")
+    per_symbol_normalize_dir = os.path.join(work_dir, "qlib_normalize_per_symbol")
+    csv_bin_dir = os.path.join(work_dir, "qlib_bin_csv")
+    direct_bin_dir = os.path.join(work_dir, "qlib_bin_direct")
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [os.environ.get("PYTHONPATH"), qlib_scripts_dir])))
+
+    results = [
+        run_measured("dump_all_to_qlib_source", python_cmd(
+            "qlib/dump_all_to_qlib_source.py", "--skip_exists=False", f"--max_workers={max_workers}", f"--output_dir={source_dir}"), env=env),
+        run_measured("normalize", python_cmd(
+            "qlib/normalize.py", "normalize_data", f"--source_dir={source_dir}", f"--normalize_dir={normalize_dir}",
+            f"--max_workers={max_workers}", "--date_field_name=tradedate"), env=env),
+        run_measured("dump_bin dump_all", [
+            sys.executable, os.path.join(qlib_scripts_dir, "dump_bin.py"), "dump_all", f"--data_path={normalize_dir}",
+            f"--qlib_dir={csv_bin_dir}", "--date_field_name=tradedate", "--exclude_fields=tradedate,symbol",
+            f"--max_workers={max_workers}"], env=env),
+    ]
+    results.append({
+        "name": "three stage total",
+        "seconds": sum(r["seconds"] for r in results),
+        "peak_rss_mb": max(r["peak_rss_mb"] for r in results),
+    })
+    results.append(run_measured("dump_qlib_bin_direct", python_cmd(
+        "qlib/dump_qlib_bin_direct.py", f"--qlib_dir={direct_bin_dir}", f"--max_workers={max_workers}"), env=env))
+    results.append(run_measured("normalize per symbol", python_cmd(
+        "qlib/normalize.py", "normalize_data_per_symbol", f"--source_dir={source_dir}",
+        f"--normalize_dir={per_symbol_normalize_dir}", f"--max_workers={max_workers}", "--date_field_name=tradedate"), env=env))
+    print_report(results)
+
+    if compare:
+        total, mismatch = _compare_csvs(per_symbol_normalize_dir, normalize_dir)
+        print(f"{total - mismatch} of {total} normalized csv files are identical")
+        total, mismatch = _compare_bins(csv_bin_dir, direct_bin_dir)
+        print(f"{total - mismatch} of {total} feature bins are identical")
+
+
+if __name__ == "__main__":
+    fire.Fire(bench_qlib_export)
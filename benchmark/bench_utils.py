@@ -0,0 +1,41 @@
+import os
+import resource
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def run_measured(name, cmd, cwd=REPO_DIR, env=None):
+    """Run a command and return its wall time and peak RSS, including the worker processes it waited for."""
+    print(f"[BENCH] {name}: {' '.join(cmd)}")
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=cwd, env=env, stdout=subprocess.DEVNULL)
+    _, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"{name} failed with exit code {proc.returncode}")
+    # ru_maxrss is reported in KB on Linux
+    return {"name": name, "seconds": elapsed, "peak_rss_mb": rusage.ru_maxrss / 1024}
+
+
+def measure(name, func):
+    """Time func() in this process; peak RSS is the high-water mark of this process so far."""
+    print(f"[BENCH] {name}")
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {"name": name, "seconds": elapsed, "peak_rss_mb": peak_rss_mb, "result": result}
+
+
+def python_cmd(script, *args):
+    return [sys.executable, os.path.join(REPO_DIR, script), *args]
+
+
+def print_report(results):
+    print(f"{'stage':<40}{'seconds':>12}{'peak RSS MB':>14}")
+    for result in results:
+        print(f"{result['name']:<40}{result['seconds']:>12.2f}{result['peak_rss_mb']:>14.1f}")
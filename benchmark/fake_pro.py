@@ -0,0 +1,147 @@
+"""
+Local stand-in for the Tushare pro client, serving a synthetic market (see synthetic_market.py).
+
+The scripts pick it up through the TUSHARE_PRO_FACTORY hook of tushare/timeout_utils.py:
+    PYTHONPATH=benchmark TUSHARE_PRO_FACTORY=fake_pro:create_fake_pro BENCH_MARKET_DIR=/tmp/bench_market \
+        python3 tushare/update_a_stock_eod_price_to_latest.py
+
+FAKE_PRO_LATENCY_SEC / FAKE_PRO_JITTER_SEC add a delay to every call, FAKE_PRO_FAILURE_RATE makes that share
+of the calls raise, and FAKE_PRO_RATE_PER_MIN rejects calls over a per-minute quota like the real API does.
+"""
+import collections
+import os
+import random
+import threading
+import time
+
+from synthetic_market import load_market
+
+# 与 Tushare 接口单次返回的最大行数一致
+ROW_LIMITS = {"daily": 6000, "adj_factor": 6000, "index_daily": 8000, "index_weight": 6000}
+
+
+class FakeProError(Exception):
+    pass
+
+
+class FakePro:
+    def __init__(self, market, latency=0.0, jitter=0.0, failure_rate=0.0, rate_per_min=None, seed=0):
+        self.market = market
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.rate_per_min = rate_per_min
+        self.calls = collections.Counter()
+        self.failures = collections.Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._call_times = collections.deque()
+        # 按交易日查询是最常见的调用，预先分组
+        self._by_date = {name: dict(tuple(market[name].groupby("trade_date"))) for name in ["daily", "adj_factor"]}
+
+    def _enter(self, api_name):
+        with self._lock:
+            self.calls[api_name] += 1
+            now = time.monotonic()
+            while self._call_times and now - self._call_times[0] > 60:
+                self._call_times.popleft()
+            over_quota = self.rate_per_min is not None and len(self._call_times) >= self.rate_per_min
+            if not over_quota:
+                self._call_times.append(now)
+            fail = self._random.random() < self.failure_rate
+            delay = self.latency + self._random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if over_quota:
+            self.failures[api_name] += 1
+            raise FakeProError(f"抱歉，您每分钟最多访问该接口{self.rate_per_min}次")
+        if fail:
+            self.failures[api_name] += 1
+            raise FakeProError(f"injected failure of {api_name}")
+
+    @staticmethod
+    def _filter(df, date_column="trade_date", start_date=None, end_date=None, **equals):
+        for column, value in equals.items():
+            if value is not None:
+                df = df[df[column].isin(str(value).split(","))]
+        if start_date is not None:
+            df = df[df[date_column] >= str(start_date)]
+        if end_date is not None:
+            df = df[df[date_column] <= str(end_date)]
+        return df
+
+    @staticmethod
+    def _finish(api_name, df, fields=None, ascending=False):
+        if fields:
+            df = df[fields.split(",") if isinstance(fields, str) else list(fields)]
+        if "trade_date" in df.columns:
+            df = df.sort_values("trade_date", ascending=ascending, kind="stable")
+        limit = ROW_LIMITS.get(api_name)
+        if limit is not None:
+            df = df.head(limit)
+        return df.reset_index(drop=True)
+
+    def _price(self, api_name, ts_code=None, trade_date=None, start_date=None, end_date=None, fields=None):
+        self._enter(api_name)
+        if trade_date is not None and ts_code is None:
+            df = self._by_date[api_name].get(str(trade_date), self.market[api_name].head(0))
+        else:
+            df = self._filter(self.market[api_name], start_date=start_date, end_date=end_date,
+                              ts_code=ts_code, trade_date=trade_date)
+        return self._finish(api_name, df, fields)
+
+    def daily(self, ts_code=None, trade_date=None, start_date=None, end_date=None, fields=None, **kwargs):
+        return self._price("daily", ts_code, trade_date, start_date, end_date, fields)
+
+    def adj_factor(self, ts_code=None, trade_date=None, start_date=None, end_date=None, fields=None, **kwargs):
+        return self._price("adj_factor", ts_code, trade_date, start_date, end_date, fields)
+
+    def trade_cal(self, exchange="SSE", start_date=None, end_date=None, is_open=None, fields=None, **kwargs):
+        self._enter("trade_cal")
+        df = self._filter(self.market["trade_cal"], "cal_date", start_date, end_date)
+        if is_open is not None:
+            df = df[df["is_open"] == int(is_open)]
+        return self._finish("trade_cal", df, fields)
+
+    def index_daily(self, ts_code=None, trade_date=None, start_date=None, end_date=None, fields=None, **kwargs):
+        self._enter("index_daily")
+        df = self._filter(self.market["index_daily"], start_date=start_date, end_date=end_date,
+                          ts_code=ts_code, trade_date=trade_date)
+        return self._finish("index_daily", df, fields)
+
+    def index_weight(self, index_code=None, trade_date=None, start_date=None, end_date=None, fields=None, **kwargs):
+        self._enter("index_weight")
+        df = self._filter(self.market["index_weight"], start_date=start_date, end_date=end_date,
+                          index_code=index_code, trade_date=trade_date)
+        return self._finish("index_weight", df, fields)
+
+    def index_basic(self, ts_code=None, market=None, fields=None, **kwargs):
+        self._enter("index_basic")
+        df = self._filter(self.market["index_basic"], ts_code=ts_code, market=market)
+        return self._finish("index_basic", df, fields)
+
+    def stock_basic(self, ts_code=None, list_status="L", exchange=None, fields=None, **kwargs):
+        self._enter("stock_basic")
+        df = self._filter(self.market["stock_basic"], ts_code=ts_code, list_status=list_status)
+        if exchange:
+            df = df[df["exchange"] == exchange]
+        return self._finish("stock_basic", df, fields)
+
+    def query(self, api_name, fields=None, **kwargs):
+        return getattr(self, api_name)(fields=fields, **kwargs)
+
+
+def _env_float(name, default):
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+def create_fake_pro():
+    """Factory for TUSHARE_PRO_FACTORY=fake_pro:create_fake_pro."""
+    rate_per_min = os.environ.get("FAKE_PRO_RATE_PER_MIN")
+    return FakePro(load_market(os.environ.get("BENCH_MARKET_DIR", "/tmp/bench_market")),
+                   latency=_env_float("FAKE_PRO_LATENCY_SEC", 0.0),
+                   jitter=_env_float("FAKE_PRO_JITTER_SEC", 0.0),
+                   failure_rate=_env_float("FAKE_PRO_FAILURE_RATE", 0.0),
+                   rate_per_min=int(rate_per_min) if rate_per_min else None,
+                   seed=int(os.environ.get("FAKE_PRO_SEED", "0")))
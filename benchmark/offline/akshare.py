@@ -0,0 +1,10 @@
+"""Offline akshare for benchmarks: every api fails like a network outage, so fallbacks never reach the internet."""
+
+
+def __getattr__(name):
+    if name.startswith("__"):
+        raise AttributeError(name)
+
+    def _offline(*args, **kwargs):
+        raise ConnectionError(f"akshare.{name} is offline in benchmarks")
+    return _offline
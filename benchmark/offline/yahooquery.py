@@ -0,0 +1,6 @@
+"""Offline yahooquery for benchmarks: every request fails like a network outage."""
+
+
+class Ticker:
+    def __init__(self, *args, **kwargs):
+        raise ConnectionError("yahooquery is offline in benchmarks")
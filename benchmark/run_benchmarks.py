@@ -0,0 +1,143 @@
+"""
+Offline benchmark of the daily pipeline on a synthetic market, without Tushare, AKShare or a Dolt remote.
+
+Needs a MySQL compatible server (e.g. `dolt sql-server` in an empty directory); the investment_data_bench
+database is dropped and recreated, the real tables are not touched. For example
+    python3 benchmark/run_benchmarks.py run --symbols=5000 --days=500 --report=/tmp/bench.json
+    python3 benchmark/run_benchmarks.py run --baseline=/tmp/bench.json --fake_latency=0.05 --fake_failure_rate=0.02
+
+Scripts run with benchmark/fake_pro.py as Tushare client (TUSHARE_PRO_FACTORY) and with the offline
+akshare / yahooquery of benchmark/offline, so failed calls exercise the fallback paths without network access.
+The pipeline mirrors tushare/daily_update.py: update_link_ratio, then merge_final_price (or regular_update.sql with
+--merge=sql, to compare both on the same database), then update_final_stock_limit. The limit table is first
+filled by a `--full` run over the loaded history, which is measured as a stage of its own.
+normalize only runs with --qlib_scripts_dir, qlib's calendar is still downloaded by qlib itself.
+dump_index_weight writes its csv files to tushare/index_weight like a normal run.
+Every stage reports wall time and peak RSS; with --baseline a stage that got slower or bigger than
+--tolerance fails the run.
+"""
+import json
+import os
+import shutil
+import sys
+
+import fire
+
+from bench_utils import REPO_DIR, measure, run_measured, python_cmd, print_report
+from synthetic_market import BENCH_DSN, generate_market, save_market, load_database
+
+sys.path.append(os.path.join(REPO_DIR, "tushare"))
+from db_utils import get_connection
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+def run_sql_file(path):
+    """Run every statement of a sql file in one transaction on INVESTMENT_DATA_DSN, like `dolt sql < file`."""
+    with open(path) as f:
+        statements = [s.strip() for s in f.read().split(";")]
+    connection = get_connection()
+    try:
+        cursor = connection.cursor()
+        for statement in statements:
+            if statement:
+                cursor.execute(statement)
+        cursor.close()
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def _bench_env(dsn, work_dir, market_dir, fake_latency, fake_failure_rate, qlib_scripts_dir):
+    python_path = [BENCH_DIR, os.path.join(BENCH_DIR, "offline"), qlib_scripts_dir, os.environ.get("PYTHONPATH")]
+    return dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join(filter(None, python_path)),
+        INVESTMENT_DATA_DSN=dsn,
+        # 数据库每次重建，水位也随 work_dir 清空
+        INVESTMENT_DATA_STATE=os.path.join(work_dir, "watermarks.json"),
+        TUSHARE="bench",
+        TUSHARE_PRO_FACTORY="fake_pro:create_fake_pro",
+        BENCH_MARKET_DIR=market_dir,
+        FAKE_PRO_LATENCY_SEC=str(fake_latency),
+        FAKE_PRO_FAILURE_RATE=str(fake_failure_rate),
+        # 每次都请求 fake_pro，不读磁盘缓存，也不受线上限流约束
+        TS_CACHE="0",
+        TS_RATE_PER_MIN=os.environ.get("TS_RATE_PER_MIN", "1000000"),
+    )
+
+
+def _compare_baseline(results, baseline, tolerance):
+    with open(baseline) as f:
+        previous = {result["name"]: result for result in json.load(f)}
+    regressions = []
+    for result in results:
+        base = previous.get(result["name"])
+        if base is None:
+            continue
+        for key in ["seconds", "peak_rss_mb"]:
+            # 不足 0.5 秒的阶段抖动太大，只比较内存
+            if key == "seconds" and base[key] < 0.5:
+                continue
+            if result[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{result['name']} {key}: {base[key]:.2f} -> {result[key]:.2f}")
+    for regression in regressions:
+        print("[REGRESSION]", regression)
+    return regressions
+
+
+def run_benchmarks(symbols=2000, days=250, fetch_days=5, seed=0, dsn=BENCH_DSN, work_dir="/tmp/bench_pipeline",
+                   fake_latency=0.0, fake_failure_rate=0.0, max_workers=4, qlib_scripts_dir=None,
+                   report=None, baseline=None, tolerance=0.2, merge="python"):
+    """
+    symbols should stay above 1000, the scripts only treat a day with more than 1000 symbols as complete.
+    merge: "python" for tushare/merge_final_price.py, "sql" for tushare/regular_update.sql.
+    """
+    if merge not in ("python", "sql"):
+        raise ValueError(f"unknown merge {merge}, expected python or sql")
+    shutil.rmtree(work_dir, ignore_errors=True)
+    market_dir = os.path.join(work_dir, "market")
+    source_dir = os.path.join(work_dir, "qlib_source")
+    env = _bench_env(dsn, work_dir, market_dir, fake_latency, fake_failure_rate, qlib_scripts_dir)
+
+    market = generate_market(symbols, days, seed)
+    results = [measure("generate market", lambda: save_market(market, market_dir))]
+    start_date = market["trade_cal"]["cal_date"].iloc[0]
+    results.append(measure("load database", lambda: load_database(market, dsn, fetch_days)))
+    del market
+
+    results.append(run_measured("update_final_stock_limit --full", python_cmd(
+        "tushare/update_final_stock_limit.py", "--full"), env=env))
+    results.append(run_measured("update_a_stock_eod_price_to_latest", python_cmd(
+        "tushare/update_a_stock_eod_price_to_latest.py"), env=env))
+    results.append(run_measured("update_link_ratio", python_cmd("tushare/update_link_ratio.py"), env=env))
+    if merge == "python":
+        results.append(run_measured("merge_final_price", python_cmd("tushare/merge_final_price.py"), env=env))
+    else:
+        results.append(run_measured("regular_update.sql", python_cmd(
+            "benchmark/run_benchmarks.py", "run_sql_file", f"--path={os.path.join(REPO_DIR, 'tushare', 'regular_update.sql')}"),
+            env=env))
+    results.append(run_measured("update_final_stock_limit", python_cmd("tushare/update_final_stock_limit.py"), env=env))
+    results.append(run_measured("dump_all_to_qlib_source", python_cmd(
+        "qlib/dump_all_to_qlib_source.py", "--skip_exists=False", f"--max_workers={max_workers}",
+        f"--output_dir={source_dir}"), env=env))
+    if qlib_scripts_dir is not None:
+        results.append(run_measured("normalize", python_cmd(
+            "qlib/normalize.py", "normalize_data", f"--source_dir={source_dir}",
+            f"--normalize_dir={os.path.join(work_dir, 'qlib_normalize')}", f"--max_workers={max_workers}",
+            "--date_field_name=tradedate"), env=env))
+    results.append(run_measured("dump_index_weight", python_cmd(
+        "tushare/dump_index_weight.py", f"--start_date={start_date}", f"--max_workers={max_workers}"), env=env))
+    print_report(results)
+
+    for result in results:
+        result.pop("result", None)
+    if report is not None:
+        with open(report, "w") as f:
+            json.dump(results, f, indent=1)
+    if baseline is not None and _compare_baseline(results, baseline, tolerance):
+        raise SystemExit(f"performance regression over {tolerance:.0%} against {baseline}")
+
+
+if __name__ == "__main__":
+    fire.Fire({"run": run_benchmarks, "run_sql_file": run_sql_file})
@@ -0,0 +1,273 @@
+"""
+Synthetic A share market for offline benchmarks: N symbols x M trading days of OHLCV, adj factors,
+index prices and monthly index constituents, in Tushare's column format.
+
+    python3 benchmark/synthetic_market.py generate --symbols=2000 --days=250 --market_dir=/tmp/bench_market
+    python3 benchmark/synthetic_market.py load --market_dir=/tmp/bench_market --fetch_days=5
+
+`load` fills a MySQL compatible database with everything before the last fetch_days trading days,
+so the update scripts have those days left to fetch from benchmark/fake_pro.py.
+"""
+import os
+import sys
+
+import fire
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from bench_utils import REPO_DIR
+
+sys.path.append(os.path.join(REPO_DIR, "tushare"))
+from db_utils import bulk_upsert
+
+BENCH_DSN = "mysql+pymysql://root:@127.0.0.1/investment_data_bench"
+TABLES = ["stock_basic", "trade_cal", "daily", "adj_factor", "index_basic", "index_daily", "index_weight"]
+# 与 tushare/dump_index_eod_price.py、dump_index_weight.py 中的指数一致
+INDEX_CONSTITUENTS = {
+    "399300.SZ": 300,
+    "000300.SH": 300,
+    "000905.SH": 500,
+    "000906.SH": 800,
+    "000852.SH": 1000,
+    "000985.SH": 5500,
+}
+# 板块起始代码、交易所、涨跌幅：沪市主板、深市主板、创业板、科创板
+BOARDS = [(600000, "SH", 0.10), (1, "SZ", 0.10), (300001, "SZ", 0.20), (688001, "SH", 0.20)]
+
+SCHEMA_SQL = {
+    "ts_a_stock_eod_price": """
+        create table ts_a_stock_eod_price (
+            tradedate date not null, symbol varchar(16) not null,
+            high double, low double, open double, close double, volume double, adjclose double, amount double,
+            primary key (tradedate, symbol))""",
+    "final_a_stock_eod_price": """
+        create table final_a_stock_eod_price (
+            tradedate date not null, symbol varchar(16) not null,
+            high double, low double, open double, close double, volume double, adjclose double, amount double,
+            primary key (tradedate, symbol))""",
+    "ts_link_table": """
+        create table ts_link_table (
+            w_symbol varchar(16) not null, link_symbol varchar(16), link_date date, adj_ratio double,
+            primary key (w_symbol))""",
+    "ts_a_stock_list": """
+        create table ts_a_stock_list (
+            ts_code varchar(16) not null, symbol varchar(16), exchange varchar(8), list_date date, delist_date date,
+            primary key (ts_code))""",
+    "ts_index_weight": """
+        create table ts_index_weight (
+            index_code varchar(16) not null, stock_code varchar(16) not null, trade_date date not null, weight double,
+            primary key (index_code, stock_code, trade_date))""",
+    "final_a_stock_limit": """
+        create table final_a_stock_limit (
+            tradedate date not null, symbol varchar(16) not null, pre_close double, up_limit double, down_limit double,
+            primary key (tradedate, symbol))""",
+    # 合成市场没有 ST 股票，表为空即全部按非 ST 计算
+    "bao_a_stock_eod_info": """
+        create table bao_a_stock_eod_info (
+            tradedate date not null, symbol varchar(16) not null, isST int,
+            primary key (tradedate, symbol))""",
+}
+
+
+def _ts_codes(symbols):
+    codes = []
+    for i in range(symbols):
+        start, exchange, _ = BOARDS[i % len(BOARDS)]
+        codes.append(f"{start + i // len(BOARDS):06d}.{exchange}")
+    return codes
+
+
+def generate_market(symbols=2000, days=250, seed=0, end_date=None):
+    """
+    DataFrames keyed by Tushare api name. Prices follow a random walk clipped at the board's daily limit,
+    about 1% of symbol days are suspended, 5% of symbols list during the period
+    and 2% of symbols get an adj_factor change (dividend) on a random day.
+    """
+    rng = np.random.default_rng(seed)
+    end_dt = pd.Timestamp(str(end_date)) if end_date is not None else pd.Timestamp.now().normalize()
+    calendar = pd.bdate_range(end=end_dt, periods=days)
+    codes = _ts_codes(symbols)
+    limit = np.array([BOARDS[i % len(BOARDS)][2] for i in range(symbols)])
+
+    # 日收益率：市场因子 + 个股噪声，按涨跌幅限制截断
+    market_return = rng.normal(0.0003, 0.012, days)
+    returns = market_return[:, None] * rng.uniform(0.5, 1.5, symbols) + rng.normal(0, 0.02, (days, symbols))
+    returns = np.clip(returns, -limit, limit)
+    returns[0] = 0
+    close = np.round(rng.uniform(3, 80, symbols) * np.exp(np.cumsum(np.log1p(returns), axis=0)), 2)
+    close = np.maximum(close, 0.01)
+    pre_close = np.vstack([close[:1], close[:-1]])
+    open_ = np.round(pre_close * (1 + np.clip(rng.normal(0, 0.005, (days, symbols)), -limit, limit)), 2)
+    high = np.round(np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.008, (days, symbols)))), 2)
+    low = np.round(np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.008, (days, symbols)))), 2)
+    high = np.minimum(high, np.round(pre_close * (1 + limit), 2)).clip(min=np.maximum(open_, close))
+    low = np.maximum(low, np.round(pre_close * (1 - limit), 2)).clip(max=np.minimum(open_, close))
+    # vol 单位为手，amount 单位为千元
+    vol = np.round(rng.lognormal(10, 1, (days, symbols)), 2)
+    amount = np.round(vol * 100 * (high + low + close) / 3 / 1000, 3)
+
+    list_day = np.where(rng.random(symbols) < 0.05, rng.integers(0, days, symbols), 0)
+    traded = (np.arange(days)[:, None] >= list_day) & (rng.random((days, symbols)) > 0.01)
+    traded[-1] |= np.arange(days)[-1] >= list_day
+
+    adj_factor = np.ones((days, symbols))
+    dividend = rng.random(symbols) < 0.02
+    dividend_day = rng.integers(1, days, symbols)
+    adj_factor[(np.arange(days)[:, None] >= dividend_day) & dividend] = 1.03
+    adj_factor = np.round(adj_factor * rng.uniform(1, 20, symbols), 4)
+
+    day_idx, sym_idx = np.nonzero(traded)
+    trade_date = calendar.strftime("%Y%m%d").to_numpy()
+    code_array = np.array(codes)
+    daily = pd.DataFrame({
+        "ts_code": code_array[sym_idx],
+        "trade_date": trade_date[day_idx],
+        "open": open_[day_idx, sym_idx],
+        "high": high[day_idx, sym_idx],
+        "low": low[day_idx, sym_idx],
+        "close": close[day_idx, sym_idx],
+        "pre_close": pre_close[day_idx, sym_idx],
+        "vol": vol[day_idx, sym_idx],
+        "amount": amount[day_idx, sym_idx],
+    })
+    daily["change"] = np.round(daily["close"] - daily["pre_close"], 2)
+    daily["pct_chg"] = np.round(daily["change"] / daily["pre_close"] * 100, 4)
+    factor = pd.DataFrame({"ts_code": daily["ts_code"], "trade_date": daily["trade_date"],
+                           "adj_factor": adj_factor[day_idx, sym_idx]})
+
+    stock_basic = pd.DataFrame({
+        "ts_code": codes,
+        "symbol": [code[:6] for code in codes],
+        "name": [f"BENCH{i}" for i in range(symbols)],
+        "exchange": ["SSE" if code.endswith(".SH") else "SZSE" for code in codes],
+        "list_date": trade_date[list_day],
+        "delist_date": None,
+        "list_status": "L",
+    })
+    trade_cal = pd.DataFrame({"exchange": "SSE", "cal_date": trade_date, "is_open": 1,
+                              "pretrade_date": np.concatenate([[None], trade_date[:-1]])})
+
+    index_basic, index_daily, index_weight = [], [], []
+    month_start = pd.Series(calendar).groupby(calendar.to_period("M")).first()
+    for index_code, count in INDEX_CONSTITUENTS.items():
+        members = rng.choice(symbols, size=min(count, symbols), replace=False)
+        level = 1000 * np.exp(np.cumsum(np.log1p(returns[:, members].mean(axis=1))))
+        index_close = np.round(level, 4)
+        index_pre_close = np.concatenate([index_close[:1], index_close[:-1]])
+        index_open = np.round(index_pre_close * (1 + rng.normal(0, 0.002, days)), 4)
+        index_daily.append(pd.DataFrame({
+            "ts_code": index_code,
+            "trade_date": trade_date,
+            "close": index_close,
+            "open": index_open,
+            "high": np.round(np.maximum(index_open, index_close) * 1.003, 4),
+            "low": np.round(np.minimum(index_open, index_close) * 0.997, 4),
+            "pre_close": index_pre_close,
+            "change": np.round(index_close - index_pre_close, 4),
+            "pct_chg": np.round((index_close / index_pre_close - 1) * 100, 4),
+            "vol": vol[:, members].sum(axis=1),
+            "amount": amount[:, members].sum(axis=1),
+        }))
+        weight = rng.lognormal(0, 1, len(members))
+        for snapshot in month_start:
+            index_weight.append(pd.DataFrame({
+                "index_code": index_code,
+                "con_code": code_array[members],
+                "trade_date": snapshot.strftime("%Y%m%d"),
+                "weight": np.round(weight / weight.sum() * 100, 4),
+            }))
+        index_basic.append({"ts_code": index_code, "name": index_code, "market": "CSI",
+                            "list_date": "20050408", "base_date": "20041231", "base_point": 1000.0})
+
+    return {
+        "stock_basic": stock_basic,
+        "trade_cal": trade_cal,
+        "daily": daily,
+        "adj_factor": factor,
+        "index_basic": pd.DataFrame(index_basic),
+        "index_daily": pd.concat(index_daily, ignore_index=True),
+        "index_weight": pd.concat(index_weight, ignore_index=True),
+    }
+
+
+def save_market(market, market_dir):
+    os.makedirs(market_dir, exist_ok=True)
+    for name, df in market.items():
+        df.to_parquet(os.path.join(market_dir, f"{name}.parquet"), index=False)
+
+
+def load_market(market_dir):
+    return {name: pd.read_parquet(os.path.join(market_dir, f"{name}.parquet")) for name in TABLES}
+
+
+def _to_w_symbol(ts_code: pd.Series) -> pd.Series:
+    # 600000.SH -> SH600000
+    return ts_code.str[7:9] + ts_code.str[:6]
+
+
+def _to_price_rows(daily, factor, cutoff):
+    df = daily[daily["trade_date"] <= cutoff]
+    if factor is not None:
+        df = df.merge(factor, on=["ts_code", "trade_date"])
+        adjclose = df["close"] * df["adj_factor"]
+    else:
+        adjclose = df["close"]
+    return pd.DataFrame({
+        "tradedate": pd.to_datetime(df["trade_date"]).dt.strftime("%Y-%m-%d"),
+        "symbol": df["ts_code"],
+        "high": df["high"], "low": df["low"], "open": df["open"], "close": df["close"],
+        "volume": df["vol"], "adjclose": adjclose, "amount": df["amount"],
+    })
+
+
+def load_database(market, dsn=BENCH_DSN, fetch_days=5):
+    """Recreate the benchmark database with every trading day except the last fetch_days."""
+    database = dsn.rsplit("/", 1)[1]
+    server_engine = create_engine(dsn.rsplit("/", 1)[0])
+    with server_engine.begin() as connection:
+        connection.execute(text(f"drop database if exists `{database}`"))
+        connection.execute(text(f"create database `{database}`"))
+    server_engine.dispose()
+
+    sqlEngine = create_engine(dsn, pool_recycle=3600)
+    with sqlEngine.begin() as connection:
+        for sql in SCHEMA_SQL.values():
+            connection.execute(text(sql))
+
+    cutoff = market["trade_cal"]["cal_date"].iloc[-fetch_days - 1]
+    ts_df = pd.concat([_to_price_rows(market["daily"], market["adj_factor"], cutoff),
+                       _to_price_rows(market["index_daily"], None, cutoff)], ignore_index=True)
+    first_date = ts_df.groupby("symbol")["tradedate"].min()
+    link_df = pd.DataFrame({"w_symbol": _to_w_symbol(first_date.index.to_series()).to_numpy(),
+                            "link_symbol": first_date.index, "link_date": first_date.to_numpy(), "adj_ratio": 1.0})
+    final_df = ts_df.assign(symbol=_to_w_symbol(ts_df["symbol"]), adjclose=ts_df["adjclose"].round(2))
+
+    stock_list = market["stock_basic"][["ts_code", "symbol", "exchange", "list_date"]].assign(
+        list_date=lambda df: pd.to_datetime(df["list_date"]).dt.strftime("%Y-%m-%d"), delist_date=None)
+    weight = market["index_weight"][market["index_weight"]["trade_date"] <= cutoff]
+    weight = pd.DataFrame({"index_code": weight["index_code"], "stock_code": weight["con_code"],
+                           "trade_date": pd.to_datetime(weight["trade_date"]).dt.strftime("%Y-%m-%d"),
+                           "weight": weight["weight"]})
+
+    for table, df in [("ts_a_stock_eod_price", ts_df), ("final_a_stock_eod_price", final_df),
+                      ("ts_link_table", link_df), ("ts_a_stock_list", stock_list), ("ts_index_weight", weight)]:
+        record_num = bulk_upsert(sqlEngine, table, df)
+        print(f"[INFO] {record_num} rows into {table}")
+    sqlEngine.dispose()
+    return cutoff
+
+
+def generate(symbols=2000, days=250, seed=0, market_dir="/tmp/bench_market"):
+    market = generate_market(symbols, days, seed)
+    save_market(market, market_dir)
+    print(f"{symbols} symbols x {days} days, {len(market['daily'])} daily rows -> {market_dir}")
+
+
+def load(market_dir="/tmp/bench_market", dsn=BENCH_DSN, fetch_days=5):
+    cutoff = load_database(load_market(market_dir), dsn, fetch_days)
+    print(f"database {dsn} loaded up to {cutoff}")
+
+
+if __name__ == "__main__":
+    fire.Fire({"generate": generate, "load": load})
@@ -19,29 +19,11 @@ set +e
 dolt push || echo "[WARN] dolt push failed; changes remain local"
 set -e
 
-echo "Updating index weight (with Tushare→AKShare fallback)"
-# 动态设置最近两周起始日，避免历史全量扫描
-startdate=$(date -d "14 days ago" +%Y%m%d)
-python3 /investment_data/tushare/dump_index_weight.py --start_date=$startdate || echo "[WARN] index_weight fallback engaged"
-for file in $(ls /investment_data/tushare/index_weight/); 
-do  
-  dolt table import -u ts_index_weight /investment_data/tushare/index_weight/$file; 
-done
-
-echo "Updating index price (with Tushare→AKShare→Yahoo fallback)"
-# 若未显式传参，脚本默认区间为最近两周
-python3 /investment_data/tushare/dump_index_eod_price.py || echo "[WARN] index_eod_price fallback engaged"
-for file in $(ls /investment_data/tushare/index/); 
-do   
-  dolt table import -u ts_a_stock_eod_price /investment_data/tushare/index/$file; 
-done
-
-echo "Updating stock price (with Tushare→AKShare fallback)"
-dolt sql-server &
-sleep 5 && python3 /investment_data/tushare/update_a_stock_eod_price_to_latest.py
-killall dolt
-
-dolt sql --file /investment_data/tushare/regular_update.sql
+# 增量水位保存在 dolt 卷上、仓库目录之外，不随 dolt add -A 发布
+export INVESTMENT_DATA_STATE=${INVESTMENT_DATA_STATE:-/dolt/state/watermarks.json}
+
+# 指数权重、指数价格与个股价格按依赖图并行更新，sql-server 就绪后批量导入，并输出各阶段耗时
+python3 /investment_data/tushare/daily_update.py --dolt_dir=/dolt/investment_data --start_date=$(date -d "14 days ago" +%Y%m%d)
 
 dolt add -A
 
@@ -21,26 +21,54 @@ dolt sql-server &
 sleep 5s
 
 cd $WORKING_DIR/investment_data
-mkdir -p ./qlib/qlib_source
-python3 ./qlib/dump_all_to_qlib_source.py
-
 export PYTHONPATH=$PYTHONPATH:$WORKING_DIR/qlib/scripts
-python3 ./qlib/normalize.py normalize_data --source_dir ./qlib/qlib_source/ --normalize_dir ./qlib/qlib_normalize --max_workers=16 --date_field_name="tradedate" 
-python3 $WORKING_DIR/qlib/scripts/dump_bin.py dump_all --data_path ./qlib/qlib_normalize/ --qlib_dir $WORKING_DIR/qlib_bin --date_field_name=tradedate --exclude_fields=tradedate,symbol
+
+# Append only the days after the existing qlib_bin calendar, set FULL_REBUILD=1 to re-export all history
+if [ "${FULL_REBUILD:-0}" != "1" ] && [ -f "$WORKING_DIR/qlib_bin/calendars/day.txt" ]; then
+    python3 ./qlib/update_qlib_bin.py --qlib_dir $WORKING_DIR/qlib_bin
+else
+    mkdir -p ./qlib/qlib_source
+    python3 ./qlib/dump_all_to_qlib_source.py --max_workers=16
+    python3 ./qlib/normalize.py normalize_data --source_dir ./qlib/qlib_source/ --normalize_dir ./qlib/qlib_normalize --max_workers=16 --date_field_name="tradedate" 
+    python3 $WORKING_DIR/qlib/scripts/dump_bin.py dump_all --data_path ./qlib/qlib_normalize/ --qlib_dir $WORKING_DIR/qlib_bin --date_field_name=tradedate --exclude_fields=tradedate,symbol
+fi
 
 mkdir -p ./qlib/qlib_index/
 python3 ./qlib/dump_index_weight.py 
 python3 ./tushare/dump_day_calendar.py $WORKING_DIR/qlib_bin/
+python3 ./qlib/dump_parquet.py --output_dir $WORKING_DIR/qlib_parquet
 killall dolt
 
 cp qlib/qlib_index/csi* $WORKING_DIR/qlib_bin/instruments/
 
-tar -czvf ./qlib_bin.tar.gz $WORKING_DIR/qlib_bin/
-ls -lh ./qlib_bin.tar.gz
 OUTPUT_DIR=${OUTPUT_DIR:-/output}
+# Delta of the files changed since the previous release, and its manifest for the next run
+PREVIOUS_MANIFEST=${PREVIOUS_MANIFEST:-${OUTPUT_DIR}/qlib_bin.manifest.json}
+python3 ./qlib/delta_release.py make_delta $WORKING_DIR/qlib_bin --output_dir . --previous_manifest "$PREVIOUS_MANIFEST"
+# Full snapshot once a week (Sunday), on the first run, or with FULL_SNAPSHOT=1
+if [ "${FULL_SNAPSHOT:-0}" = "1" ] || [ "$(date +%u)" = "7" ] || [ ! -f "$PREVIOUS_MANIFEST" ]; then
+    # ship the manifest inside the snapshot, so deltas can be applied on top of it
+    cp ./qlib_bin.manifest.json $WORKING_DIR/qlib_bin/.release_manifest.json
+    # gzip stays the default for compatibility, RELEASE_COMPRESSION=zstd writes qlib_bin.tar.zst
+    if [ "${RELEASE_COMPRESSION:-gzip}" = "zstd" ]; then
+        python3 ./qlib/pack_release.py $WORKING_DIR/qlib_bin ./qlib_bin.tar.zst --compression=zstd
+    else
+        python3 ./qlib/pack_release.py $WORKING_DIR/qlib_bin ./qlib_bin.tar.gz --compression=gzip
+    fi
+fi
+# parquet files are already zstd compressed
+python3 ./qlib/pack_release.py $WORKING_DIR/qlib_parquet ./qlib_parquet.tar --compression=none
+# the weekly snapshot is missing on most days, only list the files that exist (ls would fail under set -e)
+ARTIFACTS=""
+for f in qlib_bin.tar.gz qlib_bin.tar.zst qlib_bin_delta.tar.gz qlib_bin.manifest.json qlib_parquet.tar; do
+    if [ -f "$f" ]; then
+        ARTIFACTS="$ARTIFACTS $f"
+    fi
+done
+ls -lh $ARTIFACTS
 if [ -d "${OUTPUT_DIR}" ]; then
-    mv ./qlib_bin.tar.gz "${OUTPUT_DIR}/"
-    ls -lh "${OUTPUT_DIR}/qlib_bin.tar.gz"
+    mv $ARTIFACTS "${OUTPUT_DIR}/"
+    ls -lh "${OUTPUT_DIR}"
 else
-    echo "Generated tarball at $(pwd)/qlib_bin.tar.gz"
+    echo "Generated $ARTIFACTS at $(pwd)"
 fi
@@ -0,0 +1,133 @@
+import datetime
+import hashlib
+import json
+import os
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import fire
+
+from pack_release import write_archive, release_sort_key
+
+MANIFEST_NAME = "qlib_bin.manifest.json"
+# Manifest of the last applied release, kept inside the local qlib directory
+LOCAL_MANIFEST_NAME = ".release_manifest.json"
+ARCHIVE_ROOT = "qlib_bin"
+
+def _sha256(path):
+  digest = hashlib.sha256()
+  with open(path, "rb") as f:
+    for block in iter(lambda: f.read(1 << 20), b""):
+      digest.update(block)
+  return digest.hexdigest()
+
+def build_manifest(qlib_dir, max_workers=16):
+  """sha256 of every file under qlib_dir, keyed by path relative to qlib_dir."""
+  qlib_dir = Path(qlib_dir)
+  paths = sorted(p for p in qlib_dir.rglob("*") if p.is_file() and p.name != LOCAL_MANIFEST_NAME)
+  with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    hashes = list(executor.map(_sha256, paths))
+  return {p.relative_to(qlib_dir).as_posix(): h for p, h in zip(paths, hashes)}
+
+def _manifest_sha256(manifest):
+  return hashlib.sha256(json.dumps(manifest["files"], sort_keys=True).encode()).hexdigest()
+
+def _load_manifest(path):
+  if path is None or not os.path.exists(path):
+    return None
+  with open(path) as f:
+    return json.load(f)
+
+def _write_json(path, data):
+  with open(f"{path}.tmp", "w") as f:
+    json.dump(data, f, indent=1, sort_keys=True)
+  os.replace(f"{path}.tmp", path)
+
+def make_delta(qlib_dir, output_dir=".", previous_manifest=None, full=False, max_workers=16):
+  """
+  Package the files of qlib_dir that changed since previous_manifest into qlib_bin_delta.tar.gz,
+  and write the manifest of the whole directory next to it. Without a previous manifest,
+  or with --full, every file is packaged and the archive is a full snapshot.
+  """
+  os.makedirs(output_dir, exist_ok=True)
+  files = build_manifest(qlib_dir, max_workers)
+  previous = None if full else _load_manifest(previous_manifest)
+  previous_files = previous["files"] if previous is not None else {}
+
+  changed = sorted(path for path, digest in files.items() if previous_files.get(path) != digest)
+  deleted = sorted(path for path in previous_files if path not in files)
+  manifest = {
+    "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+    "full": previous is None,
+    "base_sha256": _manifest_sha256(previous) if previous is not None else None,
+    "changed": changed,
+    "deleted": deleted,
+    "files": files,
+  }
+  manifest["sha256"] = _manifest_sha256(manifest)
+
+  archive_name = "qlib_bin_delta.tar.gz"
+  archive_path = os.path.join(output_dir, archive_name)
+  manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+  _write_json(manifest_path, manifest)
+  members = [(os.path.join(qlib_dir, path), f"{ARCHIVE_ROOT}/{path}") for path in sorted(changed, key=release_sort_key)]
+  write_archive(archive_path, [(manifest_path, MANIFEST_NAME)] + members, compression="gzip")
+  print(f"{'full snapshot' if manifest['full'] else 'delta'}: {len(changed)} changed, {len(deleted)} deleted "
+        f"of {len(files)} files, {os.path.getsize(archive_path) / 1024 / 1024:.1f} MB -> {archive_path}")
+  return archive_path
+
+def verify(qlib_dir, manifest_path=None, max_workers=16):
+  """Compare qlib_dir against a manifest, by default the one of the last applied release."""
+  manifest = _load_manifest(manifest_path or os.path.join(qlib_dir, LOCAL_MANIFEST_NAME))
+  if manifest is None:
+    raise FileNotFoundError("No manifest to verify against")
+  files = build_manifest(qlib_dir, max_workers)
+  mismatch = sorted(path for path, digest in manifest["files"].items() if files.get(path) != digest)
+  extra = sorted(path for path in files if path not in manifest["files"])
+  for path in mismatch[:20]:
+    print("mismatch:", path)
+  for path in extra[:20]:
+    print("not in manifest:", path)
+  print(f"{len(manifest['files']) - len(mismatch)} of {len(manifest['files'])} files match, {len(extra)} extra files")
+  return len(mismatch) == 0 and len(extra) == 0
+
+def apply_delta(qlib_dir, delta_tar, force=False, max_workers=16):
+  """Patch a local qlib directory with a delta (or full snapshot) archive and verify it against its manifest."""
+  os.makedirs(qlib_dir, exist_ok=True)
+  with tarfile.open(delta_tar, "r:*") as tar:
+    manifest = json.load(tar.extractfile(MANIFEST_NAME))
+    local = _load_manifest(os.path.join(qlib_dir, LOCAL_MANIFEST_NAME))
+    if not manifest["full"] and not force:
+      local_sha256 = local.get("sha256") if local is not None else None
+      if local_sha256 != manifest["base_sha256"]:
+        raise ValueError(f"{delta_tar} is not based on the local release {local_sha256}, "
+                         "apply the missing deltas first or use --force")
+
+    root = os.path.realpath(qlib_dir)
+    for member in tar.getmembers():
+      if not member.isfile() or not member.name.startswith(f"{ARCHIVE_ROOT}/"):
+        continue
+      target = os.path.realpath(os.path.join(qlib_dir, member.name[len(ARCHIVE_ROOT) + 1:]))
+      if not target.startswith(root + os.sep):
+        raise ValueError(f"Unsafe path in archive: {member.name}")
+      os.makedirs(os.path.dirname(target), exist_ok=True)
+      with tar.extractfile(member) as src, open(f"{target}.tmp", "wb") as dst:
+        dst.write(src.read())
+      os.replace(f"{target}.tmp", target)
+
+  deleted = manifest["deleted"]
+  if manifest["full"]:
+    # A full snapshot replaces the directory: drop whatever it does not contain
+    deleted = [path for path in build_manifest(qlib_dir, max_workers) if path not in manifest["files"]]
+  for path in deleted:
+    if os.path.exists(os.path.join(qlib_dir, path)):
+      os.remove(os.path.join(qlib_dir, path))
+
+  _write_json(os.path.join(qlib_dir, LOCAL_MANIFEST_NAME), manifest)
+  print(f"applied {len(manifest['changed'])} changed and {len(deleted)} deleted files")
+  if not verify(qlib_dir, max_workers=max_workers):
+    raise RuntimeError(f"{qlib_dir} does not match the manifest of {delta_tar}")
+
+if __name__ == "__main__":
+  fire.Fire({"make_delta": make_delta, "apply_delta": apply_delta, "verify": verify})
@@ -1,24 +1,102 @@
-from sqlalchemy import create_engine
-import pymysql
+import numpy as np
 import pandas as pd
 import fire
 import os
+import sys
+import glob
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
-def dump_all_to_sqlib_source(skip_exists=True):
-  sqlEngine = create_engine('mysql+pymysql://root:@127.0.0.1/investment_data', pool_recycle=3600)
-  dbConnection = sqlEngine.raw_connection()
-  stock_df = pd.read_sql("select *, amount/volume*10 as vwap from final_a_stock_eod_price", dbConnection)
-  dbConnection.close()
-  sqlEngine.dispose()
-
-  script_path = os.path.dirname(os.path.realpath(__file__))
-
-  for symbol, df in stock_df.groupby("symbol"):
-    filename = f'{script_path}/qlib_source/{symbol}.csv'
-    print("Dumping to file: ", filename)
-    if skip_exists and os.path.isfile(filename):
-        continue
-    df.to_csv(filename, index=False)
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "tushare"))
+from db_utils import read_sql, stream_sql
+
+# Print progress every PROGRESS_EVERY symbols instead of once per file
+PROGRESS_EVERY = 500
+
+def _write_symbol(output_dir, symbol, df):
+  # Write to a temp file and rename, so an interrupted run never leaves a truncated csv behind
+  filename = f'{output_dir}/{symbol}.csv'
+  tmp_filename = f'{filename}.tmp'
+  df.to_csv(tmp_filename, index=False)
+  os.replace(tmp_filename, filename)
+  return symbol
+
+def add_vwap(df):
+  # Same as "amount/volume*10" in SQL, which yields NULL when volume is 0
+  volume = df["volume"].astype(float)
+  df["vwap"] = df["amount"].astype(float) / volume.where(volume != 0, np.nan) * 10
+  return df
+
+def _list_todo_symbols(output_dir, skip_exists):
+  all_symbols = read_sql("select distinct symbol from final_a_stock_eod_price")["symbol"].tolist()
+  if not skip_exists:
+    return all_symbols, all_symbols
+  done_symbols = set(os.path.basename(f)[:-len(".csv")] for f in glob.glob(f'{output_dir}/*.csv'))
+  return all_symbols, [symbol for symbol in all_symbols if symbol not in done_symbols]
+
+def iter_symbol_df(sql, chunk_size):
+  # Rows are ordered by symbol, so every symbol except the last one in a chunk is complete
+  # and can be yielded right away. The last symbol is carried over to the next chunk.
+  pending_df = None
+  for chunk_df in stream_sql(sql, chunk_size):
+    chunk_df = add_vwap(chunk_df)
+    if pending_df is not None:
+      chunk_df = pd.concat([pending_df, chunk_df], ignore_index=True)
+    last_symbol = chunk_df["symbol"].iloc[-1]
+    is_pending = chunk_df["symbol"] == last_symbol
+    pending_df = chunk_df[is_pending]
+    for symbol, df in chunk_df[~is_pending].groupby("symbol", sort=False):
+      yield symbol, df
+
+  if pending_df is not None and not pending_df.empty:
+    yield pending_df["symbol"].iloc[0], pending_df
+
+def _iter_todo_sql(all_symbols, todo_symbols, symbol_batch_size):
+  if len(todo_symbols) == len(all_symbols):
+    yield "select * from final_a_stock_eod_price order by symbol, tradedate"
+    return
+  for i in range(0, len(todo_symbols), symbol_batch_size):
+    symbol_list = ",".join(f"'{symbol}'" for symbol in todo_symbols[i:i+symbol_batch_size])
+    yield f"select * from final_a_stock_eod_price where symbol in ({symbol_list}) order by symbol, tradedate"
+
+def dump_all_to_sqlib_source(skip_exists=True, chunk_size=500000, max_workers=1, symbol_batch_size=500, output_dir=None):
+  if output_dir is None:
+    script_path = os.path.dirname(os.path.realpath(__file__))
+    output_dir = f'{script_path}/qlib_source'
+  os.makedirs(output_dir, exist_ok=True)
+  for tmp_filename in glob.glob(f'{output_dir}/*.csv.tmp'):
+    os.remove(tmp_filename)
+
+  all_symbols, todo_symbols = _list_todo_symbols(output_dir, skip_exists)
+  print(f"{len(todo_symbols)} of {len(all_symbols)} symbols to dump")
+
+  done_count = 0
+  def _progress():
+    if done_count % PROGRESS_EVERY == 0:
+      print(f"Dumped {done_count} of {len(todo_symbols)} symbols")
+
+  if max_workers <= 1:
+    for sql in _iter_todo_sql(all_symbols, todo_symbols, symbol_batch_size):
+      for symbol, df in iter_symbol_df(sql, chunk_size):
+        _write_symbol(output_dir, symbol, df)
+        done_count += 1
+        _progress()
+  else:
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+      # Limit the number of symbols in flight, so memory stays bounded when writers fall behind
+      futures = set()
+      for sql in _iter_todo_sql(all_symbols, todo_symbols, symbol_batch_size):
+        for symbol, df in iter_symbol_df(sql, chunk_size):
+          if len(futures) >= max_workers * 4:
+            done, futures = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+              future.result()
+              done_count += 1
+              _progress()
+          futures.add(executor.submit(_write_symbol, output_dir, symbol, df))
+      for future in futures:
+        future.result()
+        done_count += 1
+  print(f"Dumped {done_count} symbols to {output_dir}")
 
 if __name__ == "__main__":
   fire.Fire(dump_all_to_sqlib_source)
@@ -1,14 +1,34 @@
-from sqlalchemy import create_engine
-import pymysql
 import pandas as pd
 import fire
 import os
+import sys
 import datetime
 
-def dump_all_to_sqlib_source(skip_exists=False):
-  sqlEngine = create_engine('mysql+pymysql://root:@127.0.0.1/investment_data', pool_recycle=3600)
-  dbConnection = sqlEngine.raw_connection()
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "tushare"))
+from db_utils import read_sql
+
+def _build_index_intervals(weight_df, end_date):
+  """
+  Turn (trade_date, stock_code) constituent rows of one index into qlib instrument rows:
+  symbol, start_date, end_date for each period where the constituent set stays the same.
+  """
+  weight_df = weight_df.drop_duplicates(["trade_date", "stock_code"])
+  # Order independent signature of the constituent set of each trade_date
+  weight_df = weight_df.assign(stock_hash=pd.util.hash_pandas_object(weight_df["stock_code"], index=False).values)
+  signature_df = weight_df.groupby("trade_date")["stock_hash"].agg(["sum", "count"]).sort_index()
+  is_change = (signature_df != signature_df.shift()).any(axis=1)
+  change_dates = signature_df.index[is_change.values]
+
+  interval_df = pd.DataFrame({"trade_date": change_dates})
+  interval_df["start_date"] = interval_df["trade_date"].dt.strftime("%Y-%m-%d")
+  interval_df["end_date"] = (interval_df["trade_date"].shift(-1) - datetime.timedelta(days=1)).dt.strftime("%Y-%m-%d")
+  interval_df.loc[interval_df.index[-1], "end_date"] = end_date
+
+  result_df = weight_df.merge(interval_df, on="trade_date")
+  result_df["symbol"] = result_df["stock_code"].str[7:9] + result_df["stock_code"].str[0:6]
+  return result_df.sort_values(["trade_date", "symbol"])[["symbol", "start_date", "end_date"]]
 
+def dump_all_to_sqlib_source(skip_exists=False):
   index_map = {
     "csi300" : "399300.SZ",
     "csi500" : "000905.SH",
@@ -19,39 +39,29 @@ def dump_all_to_sqlib_source(skip_exists=False):
 
   script_path = os.path.dirname(os.path.realpath(__file__))
 
+  todo_map = {}
   for index_name, index_code in index_map.items():
     filename = f'{script_path}/qlib_index/{index_name}.txt'
     if skip_exists and os.path.isfile(filename):
         continue
+    todo_map[index_name] = index_code
+  if len(todo_map) == 0:
+    return
+
+  # One bulk fetch for all indexes, change points are detected in pandas
+  index_code_list = ",".join(f"'{index_code}'" for index_code in todo_map.values())
+  sql = f"select index_code, trade_date, stock_code from ts_index_weight where index_code in ({index_code_list})"
+  all_weight_df = read_sql(sql)
+  all_weight_df["trade_date"] = pd.to_datetime(all_weight_df["trade_date"])
 
+  end_date = datetime.datetime.today().strftime("%Y-%m-%d")
+  for index_name, index_code in todo_map.items():
+    filename = f'{script_path}/qlib_index/{index_name}.txt'
+    weight_df = all_weight_df[all_weight_df["index_code"] == index_code]
+    if weight_df.empty:
+      continue
     print("Dumping to file: ", filename)
-    change_date_sql = """
-      select min(trade_date) as change_date from
-      (
-        select trade_date, MD5(GROUP_CONCAT(stock_code)) as signature
-        from ts_index_weight 
-        where index_code = '{}'
-        group by trade_date
-      ) date_sig_table
-      group by signature
-      order by change_date
-    """.format(index_code)
-    change_date_pd = pd.read_sql_query(change_date_sql, dbConnection)["change_date"]
-    result_df_list = []
-    for i in range(len(change_date_pd)):
-      start_date = change_date_pd[i].strftime("%Y-%m-%d")
-      if i == len(change_date_pd) - 1:
-        end_date = datetime.datetime.today().strftime("%Y-%m-%d")
-      else:
-        end_date = (change_date_pd[i+1] - datetime.timedelta(days=1)).strftime("%Y-%m-%d")
-
-      sql = f"select concat(substr(stock_code, 8, 2), substr(stock_code, 1, 6)), '{start_date}' as start_date, '{end_date}' as end_date FROM ts_index_weight WHERE index_code = '{index_code}' AND trade_date = '{start_date}'"
-      stock_df = pd.read_sql_query(sql, dbConnection)
-      if stock_df.empty:
-        raise Exception(f"No data for {sql}")
-      result_df_list.append(stock_df)
-    if len(result_df_list) > 0:
-      pd.concat(result_df_list).to_csv(filename, index=False, header=False, sep='\t')
+    _build_index_intervals(weight_df, end_date).to_csv(filename, index=False, header=False, sep='\t')
 
 if __name__ == "__main__":
   fire.Fire(dump_all_to_sqlib_source)
@@ -0,0 +1,121 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import fire
+import glob
+import os
+import shutil
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "tushare"))
+from db_utils import stream_sql
+
+PRICE_SCHEMA = pa.schema([
+  ("tradedate", pa.date32()),
+  ("symbol", pa.dictionary(pa.int32(), pa.string())),
+  ("high", pa.float64()),
+  ("low", pa.float64()),
+  ("open", pa.float64()),
+  ("close", pa.float64()),
+  ("volume", pa.float64()),
+  ("adjclose", pa.float64()),
+  ("amount", pa.float64()),
+])
+WRITE_OPTIONS = {"compression": "zstd", "use_dictionary": ["symbol"], "write_statistics": True}
+
+class _YearPartitionWriter:
+  """
+  Append (symbol, tradedate) ordered rows into <output_dir>/prices/year=YYYY/part-0.parquet.
+  Rows are buffered per year so every row group holds about row_group_size rows.
+  """
+  def __init__(self, output_dir, row_group_size):
+    self.output_dir = output_dir
+    self.row_group_size = row_group_size
+    self.writers = {}
+    self.buffers = {}
+    self.row_count = 0
+
+  def write(self, df):
+    for year, year_df in df.groupby(df["tradedate"].dt.year, sort=False):
+      buffer = self.buffers.setdefault(year, [])
+      buffer.append(year_df)
+      if sum(len(x) for x in buffer) >= self.row_group_size:
+        self._flush(year)
+
+  def _flush(self, year):
+    buffer = self.buffers.pop(year, [])
+    if not buffer:
+      return
+    df = pd.concat(buffer, ignore_index=True)
+    if year not in self.writers:
+      partition_dir = f"{self.output_dir}/prices/year={year}"
+      os.makedirs(partition_dir, exist_ok=True)
+      self.writers[year] = pq.ParquetWriter(f"{partition_dir}/part-0.parquet", PRICE_SCHEMA, **WRITE_OPTIONS)
+    table = pa.Table.from_pandas(df[PRICE_SCHEMA.names], schema=PRICE_SCHEMA, preserve_index=False)
+    self.writers[year].write_table(table, row_group_size=self.row_group_size)
+    self.row_count += len(df)
+
+  def close(self):
+    for year in list(self.buffers):
+      self._flush(year)
+    for writer in self.writers.values():
+      writer.close()
+
+def _dump_index_constituents(output_dir, index_dir):
+  frames = []
+  for filename in sorted(glob.glob(f"{index_dir}/*.txt")):
+    df = pd.read_csv(filename, sep="\t", header=None, names=["symbol", "start_date", "end_date"])
+    df.insert(0, "index_name", os.path.basename(filename)[:-len(".txt")])
+    frames.append(df)
+  if not frames:
+    print("No index constituent file found in", index_dir)
+    return 0
+  df = pd.concat(frames, ignore_index=True)
+  for name in ["start_date", "end_date"]:
+    df[name] = pd.to_datetime(df[name]).dt.date
+  df = df.sort_values(["index_name", "symbol", "start_date"])
+  table = pa.Table.from_pandas(df, preserve_index=False)
+  pq.write_table(table, f"{output_dir}/index_constituents.parquet", compression="zstd",
+                 use_dictionary=["index_name", "symbol"], write_statistics=True)
+  return len(df)
+
+def _dir_size_mb(path):
+  return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files) / 1024 / 1024
+
+def dump_parquet(output_dir, index_dir=None, chunk_size=500000, row_group_size=100000):
+  """
+  Export final_a_stock_eod_price, the index constituents and the trading calendar as a parquet dataset:
+    prices/year=YYYY/part-0.parquet    sorted by (symbol, tradedate), zstd, dictionary encoded symbol
+    index_constituents.parquet         index_name, symbol, start_date, end_date
+    calendar.parquet                   every tradedate that has a price
+  """
+  if index_dir is None:
+    script_path = os.path.dirname(os.path.realpath(__file__))
+    index_dir = f"{script_path}/qlib_index"
+  shutil.rmtree(f"{output_dir}/prices", ignore_errors=True)
+  os.makedirs(output_dir, exist_ok=True)
+
+  writer = _YearPartitionWriter(output_dir, row_group_size)
+  calendar = set()
+  read_count = 0
+  sql = f"select {', '.join(PRICE_SCHEMA.names)} from final_a_stock_eod_price order by symbol, tradedate"
+  try:
+    for chunk_df in stream_sql(sql, chunk_size):
+      chunk_df["tradedate"] = pd.to_datetime(chunk_df["tradedate"])
+      calendar.update(chunk_df["tradedate"].unique())
+      writer.write(chunk_df)
+      read_count += len(chunk_df)
+      print(f"Read {read_count} rows")
+  finally:
+    writer.close()
+
+  calendar_df = pd.DataFrame({"date": sorted(pd.to_datetime(list(calendar)).date)})
+  pq.write_table(pa.Table.from_pandas(calendar_df, preserve_index=False), f"{output_dir}/calendar.parquet", compression="zstd")
+  index_row_count = _dump_index_constituents(output_dir, index_dir)
+
+  print(f"prices: {writer.row_count} rows in {len(writer.writers)} year partitions, {_dir_size_mb(f'{output_dir}/prices'):.1f} MB")
+  print(f"index_constituents: {index_row_count} rows, calendar: {len(calendar_df)} days")
+  print(f"total: {_dir_size_mb(output_dir):.1f} MB")
+
+if __name__ == "__main__":
+  fire.Fire(dump_parquet)
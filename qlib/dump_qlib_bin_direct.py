@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import fire
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "tushare"))
+from dump_all_to_qlib_source import iter_symbol_df, PROGRESS_EVERY
+from db_utils import read_sql
+from normalize import normalize_arrays
+import qlib_bin_utils
+
+def _dump_symbol(qlib_dir, calendar, symbol, df):
+  # Align to the calendar between first and last day of the symbol, like dump_bin.py does
+  dates = pd.to_datetime(df["tradedate"]).values
+  start_index = np.searchsorted(calendar, dates[0])
+  end_index = np.searchsorted(calendar, dates[-1])
+  positions = np.searchsorted(calendar, dates) - start_index
+  columns = {}
+  for name in df.columns:
+    if name in ["tradedate", "symbol"]:
+      continue
+    values = np.full(end_index - start_index + 1, np.nan)
+    values[positions] = df[name].to_numpy(dtype=float, na_value=np.nan)
+    columns[name] = values
+
+  feature_dir = qlib_bin_utils.get_feature_dir(qlib_dir, symbol)
+  feature_dir.mkdir(parents=True, exist_ok=True)
+  for field, values in normalize_arrays(columns).items():
+    qlib_bin_utils.write_bin(qlib_bin_utils.get_bin_path(feature_dir, field), start_index, values)
+  return symbol, start_index, end_index
+
+def dump_qlib_bin_direct(qlib_dir, chunk_size=500000, max_workers=1):
+  """
+  Export final_a_stock_eod_price into qlib .bin format in one pass,
+  without the qlib_source and qlib_normalize csv round trips.
+  """
+  calendar_df = read_sql("select distinct tradedate from final_a_stock_eod_price order by tradedate")
+  calendar = pd.to_datetime(calendar_df["tradedate"]).values
+  qlib_bin_utils.write_calendar(qlib_dir, calendar)
+
+  instruments = {}
+  def _record(result):
+    symbol, start_index, end_index = result
+    instruments[symbol] = (pd.Timestamp(calendar[start_index]), pd.Timestamp(calendar[end_index]))
+    if len(instruments) % PROGRESS_EVERY == 0:
+      print(f"Dumped {len(instruments)} symbols")
+
+  sql = "select * from final_a_stock_eod_price order by symbol, tradedate"
+  if max_workers <= 1:
+    for symbol, df in iter_symbol_df(sql, chunk_size):
+      _record(_dump_symbol(qlib_dir, calendar, symbol, df))
+  else:
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+      futures = set()
+      for symbol, df in iter_symbol_df(sql, chunk_size):
+        if len(futures) >= max_workers * 4:
+          done, futures = wait(futures, return_when=FIRST_COMPLETED)
+          for future in done:
+            _record(future.result())
+        futures.add(executor.submit(_dump_symbol, qlib_dir, calendar, symbol, df))
+      for future in futures:
+        _record(future.result())
+
+  qlib_bin_utils.write_instruments(qlib_dir, instruments)
+  print(f"Dumped {len(instruments)} symbols to {qlib_dir}")
+
+if __name__ == "__main__":
+  fire.Fire(dump_qlib_bin_direct)
@@ -1,5 +1,9 @@
 import fire
+import glob
+import os
+import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 try:
   from data_collector.base import Normalize
@@ -20,6 +24,173 @@ class CrowdSourceNormalize(yahoo_collector.YahooNormalizeCN1d):
     result_df["amount"] = df["amount"]
     return result_df
 
+def _ffill(values: np.ndarray) -> np.ndarray:
+  # forward fill along the date axis, of one symbol or of a (dates x symbols) panel
+  positions = np.arange(values.shape[0]).reshape((-1,) + (1,) * (values.ndim - 1))
+  index = np.where(np.isnan(values), 0, positions)
+  np.maximum.accumulate(index, axis=0, out=index)
+  return np.take_along_axis(values, index, axis=0)
+
+def _calc_change(close: np.ndarray) -> np.ndarray:
+  close = _ffill(close)
+  change = np.full(close.shape, np.nan)
+  change[1:] = close[1:] / close[:-1] - 1
+  return change
+
+def _first_valid(values: np.ndarray) -> np.ndarray:
+  is_valid = ~np.isnan(values)
+  first = np.take_along_axis(values, np.expand_dims(np.argmax(is_valid, axis=0), 0), axis=0)[0]
+  return np.where(is_valid.any(axis=0), first, np.nan)
+
+def normalize_arrays(columns: dict) -> dict:
+  """
+  Same result as CrowdSourceNormalize.normalize, on float64 arrays of one symbol, or (dates x symbols) panels,
+  that are already aligned to the calendar (missing days as NaN). Returns the normalized arrays including "factor" and "change".
+  """
+  invalid = ~(columns["volume"] > 0)
+  data = {name: np.where(invalid, np.nan, values.astype(float)) for name, values in columns.items()}
+
+  # Same fix for abnormal x100 price jumps as YahooNormalize.normalize_yahoo, which gives up after 10 rounds
+  for _ in range(10):
+    change = _calc_change(data["close"])
+    mask = (change >= 89) & (change <= 111)
+    if not mask.any():
+      break
+    for name in ["high", "close", "low", "open", "adjclose"]:
+      if name in data:
+        data[name][mask] = data[name][mask] / 100
+  change = _calc_change(data["close"])
+  change[invalid] = np.nan
+
+  # YahooNormalize1d.adjusted_price
+  factor = _ffill(data["adjclose"] / data["close"])
+  for name in CrowdSourceNormalize.COLUMNS:
+    if name not in data:
+      continue
+    if name == "volume":
+      data[name] = data[name] / factor
+    else:
+      data[name] = data[name] * factor
+  data["factor"] = factor
+
+  # YahooNormalize1d._manual_adj_data, with amount kept as original value
+  first_close = _first_valid(data["close"])
+  for name in data:
+    if name in ["adjclose", "amount"]:
+      continue
+    if name == "volume":
+      data[name] = data[name] * first_close
+    else:
+      data[name] = data[name] / first_close
+  data["change"] = change
+  return data
+
+def _read_source_csv(file_path, symbol_field_name):
+  # Same parsing as data_collector.base.Normalize, symbols like "NA" are not NaN
+  default_na = pd._libs.parsers.STR_NA_VALUES
+  symbol_na = default_na.copy()
+  symbol_na.remove("NA")
+  columns = pd.read_csv(file_path, nrows=0).columns
+  return pd.read_csv(file_path, dtype={symbol_field_name: str}, keep_default_na=False,
+                     na_values={col: symbol_na if col == symbol_field_name else default_na for col in columns})
+
+def normalize_batch(frames: list, calendar: pd.DatetimeIndex, date_field_name="tradedate", symbol_field_name="symbol") -> list:
+  """
+  Normalize the source frames of many symbols at once on one (dates x symbols) panel per column.
+  Returns the normalized frames in the same order, identical to CrowdSourceNormalize.normalize of each frame.
+  """
+  symbols = []
+  for df in frames:
+    if df.empty:
+      symbols.append(None)
+      continue
+    dates = pd.to_datetime(df[date_field_name])
+    if dates.dt.tz is not None:
+      dates = dates.dt.tz_localize(None)
+    keep = ~dates.duplicated(keep="first").values
+    # calendar days between the first and last day of the symbol, like YahooNormalize.normalize_yahoo
+    start = calendar.searchsorted(dates.min().normalize(), side="left")
+    end = calendar.searchsorted(dates.max().normalize() + pd.Timedelta(hours=23, minutes=59), side="right")
+    symbols.append({
+      "symbol": df.loc[df[symbol_field_name].first_valid_index(), symbol_field_name],
+      "df": df[keep], "dates": dates[keep], "start": start, "end": end,
+    })
+
+  present = [item for item in symbols if item is not None]
+  if not present:
+    return [df for df in frames]
+  panel_start = min(item["start"] for item in present)
+  panel_end = max(item["end"] for item in present)
+  panel_calendar = calendar[panel_start:panel_end]
+  value_columns = [c for c in present[0]["df"].columns if c not in [date_field_name, symbol_field_name]]
+  panel = {c: np.full((len(panel_calendar), len(present)), np.nan) for c in value_columns}
+  for j, item in enumerate(present):
+    positions = panel_calendar.get_indexer(item["dates"])
+    in_calendar = positions >= 0
+    for c in value_columns:
+      panel[c][positions[in_calendar], j] = item["df"][c].to_numpy(dtype=float, na_value=np.nan)[in_calendar]
+  panel = normalize_arrays(panel)
+
+  results = []
+  j = 0
+  for df, item in zip(frames, symbols):
+    if item is None:
+      results.append(df)
+      continue
+    rows = slice(item["start"] - panel_start, item["end"] - panel_start)
+    result = {date_field_name: panel_calendar[rows]}
+    for c in df.columns:
+      if c == date_field_name:
+        continue
+      result[c] = item["symbol"] if c == symbol_field_name else panel[c][rows, j]
+    result["change"] = panel["change"][rows, j]
+    result["factor"] = panel["factor"][rows, j]
+    results.append(pd.DataFrame(result))
+    j += 1
+  return results
+
+def _normalize_files(source_paths, normalize_dir, calendar, date_field_name, symbol_field_name):
+  frames = [_read_source_csv(path, symbol_field_name) for path in source_paths]
+  for path, df in zip(source_paths, normalize_batch(frames, calendar, date_field_name, symbol_field_name)):
+    if df is not None and not df.empty:
+      df.to_csv(os.path.join(normalize_dir, os.path.basename(path)), index=False)
+  return len(source_paths)
+
+def _get_calendar(date_field_name, symbol_field_name):
+  # The calendar of the per-symbol path, so both produce the same rows
+  normalizer = CrowdSourceNormalize(date_field_name=date_field_name, symbol_field_name=symbol_field_name)
+  return pd.DatetimeIndex(normalizer._calendar_list)
+
+def normalize_batch_data(source_dir=None, normalize_dir=None, max_workers=1, batch_size=200, date_field_name="tradedate", symbol_field_name="symbol"):
+  """Vectorized replacement of normalize_crowd_source_data, batch_size symbols per panel."""
+  os.makedirs(normalize_dir, exist_ok=True)
+  calendar = _get_calendar(date_field_name, symbol_field_name)
+  source_paths = sorted(glob.glob(os.path.join(source_dir, "*.csv")))
+  batches = [source_paths[i:i + batch_size] for i in range(0, len(source_paths), batch_size)]
+  done = 0
+  with ProcessPoolExecutor(max_workers=max_workers) as executor:
+    futures = [executor.submit(_normalize_files, batch, normalize_dir, calendar, date_field_name, symbol_field_name) for batch in batches]
+    for future in as_completed(futures):
+      done += future.result()
+      print(f"Normalized {done} of {len(source_paths)} symbols")
+
+def verify(source_dir, sample_size=50, date_field_name="tradedate", symbol_field_name="symbol"):
+  """Check that normalize_batch writes the same csv as CrowdSourceNormalize for a sample of source files."""
+  normalizer = CrowdSourceNormalize(date_field_name=date_field_name, symbol_field_name=symbol_field_name)
+  source_paths = sorted(glob.glob(os.path.join(source_dir, "*.csv")))
+  source_paths = source_paths[::max(1, len(source_paths) // sample_size)][:sample_size]
+  frames = [_read_source_csv(path, symbol_field_name) for path in source_paths]
+  batch_frames = normalize_batch(frames, pd.DatetimeIndex(normalizer._calendar_list), date_field_name, symbol_field_name)
+  mismatch = []
+  for path, df, batch_df in zip(source_paths, frames, batch_frames):
+    expected = normalizer.normalize(df)
+    if expected.to_csv(index=False) != batch_df.to_csv(index=False):
+      mismatch.append(os.path.basename(path))
+  for name in mismatch[:20]:
+    print("mismatch:", name)
+  print(f"{len(source_paths) - len(mismatch)} of {len(source_paths)} symbols are identical")
+  return len(mismatch) == 0
+
 def normalize_crowd_source_data(source_dir=None, normalize_dir=None, max_workers=1, interval="1d", date_field_name="tradedate", symbol_field_name="symbol"):
     yc = Normalize(
         source_dir=source_dir,
@@ -32,4 +203,8 @@ def normalize_crowd_source_data(source_dir=None, normalize_dir=None, max_workers
     yc.normalize()
 
 if __name__ == "__main__":
-    fire.Fire(normalize_crowd_source_data)
\ No newline at end of file
+  fire.Fire({
+    "normalize_data": normalize_batch_data,
+    "normalize_data_per_symbol": normalize_crowd_source_data,
+    "verify": verify,
+  })
\ No newline at end of file
@@ -0,0 +1,89 @@
+import gzip
+import os
+import shutil
+import subprocess
+import tarfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import fire
+
+try:
+  import zstandard
+except Exception:
+  zstandard = None
+
+def release_sort_key(rel_path):
+  """
+  calendars and instruments first, then features grouped by field and ordered by symbol,
+  so the same feature of different symbols sits next to each other in the compressed stream.
+  """
+  parts = Path(rel_path).parts
+  if len(parts) == 3 and parts[0] == "features":
+    return (1, parts[2], parts[1])
+  return (0, rel_path, "")
+
+def list_release_files(root_dir):
+  root_dir = Path(root_dir)
+  rel_paths = [p.relative_to(root_dir).as_posix() for p in root_dir.rglob("*") if p.is_file()]
+  return sorted(rel_paths, key=release_sort_key)
+
+@contextmanager
+def _compressed_stream(output_file, compression, level, threads):
+  if compression == "zstd":
+    cctx = zstandard.ZstdCompressor(level=level or 10, threads=threads or -1)
+    with cctx.stream_writer(output_file, closefd=False) as stream:
+      yield stream
+  elif compression == "gzip" and shutil.which("pigz"):
+    # pigz writes the same gzip format with one thread per core
+    cmd = ["pigz", f"-{level or 6}"] + (["-p", str(threads)] if threads else [])
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=output_file)
+    try:
+      yield proc.stdin
+    finally:
+      proc.stdin.close()
+      if proc.wait() != 0:
+        raise RuntimeError(f"pigz failed with exit code {proc.returncode}")
+  elif compression == "gzip":
+    with gzip.GzipFile(fileobj=output_file, mode="wb", compresslevel=level or 6) as stream:
+      yield stream
+  elif compression == "none":
+    yield output_file
+  else:
+    raise ValueError(f"Unknown compression: {compression}")
+
+def write_archive(output, members, compression="gzip", level=None, threads=0):
+  """
+  Stream (path, arcname) members into a tar archive compressed on the fly.
+  Returns (input bytes, output bytes, seconds).
+  """
+  if compression == "zstd" and zstandard is None:
+    raise ImportError("zstd compression needs the zstandard package")
+  start = time.perf_counter()
+  input_bytes = 0
+  with open(f"{output}.tmp", "wb") as output_file:
+    with _compressed_stream(output_file, compression, level, threads) as stream:
+      with tarfile.open(fileobj=stream, mode="w|") as tar:
+        for path, arcname in members:
+          tar.add(path, arcname=arcname, recursive=False)
+          input_bytes += os.path.getsize(path)
+  os.replace(f"{output}.tmp", output)
+  return input_bytes, os.path.getsize(output), time.perf_counter() - start
+
+def pack_release(root_dir, output, compression="auto", level=None, threads=0, arcname_root=None):
+  """
+  Pack root_dir into output as <arcname_root>/... (default: the name of root_dir).
+  compression: zstd (multi-threaded), gzip (multi-threaded through pigz when installed), none, or auto (zstd when available).
+  """
+  if compression == "auto":
+    compression = "zstd" if zstandard is not None else "gzip"
+  arcname_root = arcname_root or Path(root_dir).resolve().name
+  members = [(os.path.join(root_dir, rel_path), f"{arcname_root}/{rel_path}") for rel_path in list_release_files(root_dir)]
+  input_bytes, output_bytes, seconds = write_archive(output, members, compression, level, threads)
+  print(f"{output}: {len(members)} files, {input_bytes / 1024 / 1024:.1f} MB -> {output_bytes / 1024 / 1024:.1f} MB "
+        f"({compression}, ratio {input_bytes / max(output_bytes, 1):.2f}) in {seconds:.1f}s, "
+        f"{input_bytes / 1024 / 1024 / max(seconds, 1e-9):.1f} MB/s")
+
+if __name__ == "__main__":
+  fire.Fire(pack_release)
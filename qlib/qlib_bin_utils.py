@@ -0,0 +1,54 @@
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+# Layout written by qlib's scripts/dump_bin.py:
+#   calendars/day.txt              one date per line
+#   instruments/all.txt            symbol \t start_date \t end_date
+#   features/<symbol>/<field>.day.bin
+# Each .bin file is little-endian float32: the calendar index of the first value, followed by one value per calendar day.
+FREQ = "day"
+DATE_FORMAT = "%Y-%m-%d"
+
+def read_calendar(qlib_dir, freq=FREQ):
+  calendar_df = pd.read_csv(Path(qlib_dir) / f"calendars/{freq}.txt", header=None)
+  return pd.to_datetime(calendar_df[0]).tolist()
+
+def write_calendar(qlib_dir, calendar, freq=FREQ):
+  calendar_path = Path(qlib_dir) / f"calendars/{freq}.txt"
+  calendar_path.parent.mkdir(parents=True, exist_ok=True)
+  pd.Series(pd.to_datetime(calendar)).dt.strftime(DATE_FORMAT).to_csv(calendar_path, index=False, header=False)
+
+def read_instruments(qlib_dir, name="all"):
+  instruments_path = Path(qlib_dir) / f"instruments/{name}.txt"
+  if not instruments_path.exists():
+    return {}
+  instruments_df = pd.read_csv(instruments_path, sep="\t", header=None, names=["symbol", "start", "end"], dtype=str)
+  return {row.symbol: (pd.Timestamp(row.start), pd.Timestamp(row.end)) for row in instruments_df.itertuples()}
+
+def write_instruments(qlib_dir, instruments, name="all"):
+  instruments_path = Path(qlib_dir) / f"instruments/{name}.txt"
+  instruments_path.parent.mkdir(parents=True, exist_ok=True)
+  rows = [(symbol, start.strftime(DATE_FORMAT), end.strftime(DATE_FORMAT)) for symbol, (start, end) in sorted(instruments.items())]
+  pd.DataFrame(rows).to_csv(instruments_path, sep="\t", index=False, header=False)
+
+def get_feature_dir(qlib_dir, symbol):
+  return Path(qlib_dir) / "features" / symbol.lower()
+
+def list_feature_fields(feature_dir, freq=FREQ):
+  suffix = f".{freq}.bin"
+  return sorted(p.name[:-len(suffix)] for p in Path(feature_dir).glob(f"*{suffix}"))
+
+def get_bin_path(feature_dir, field, freq=FREQ):
+  return Path(feature_dir) / f"{field.lower()}.{freq}.bin"
+
+def read_bin(bin_path):
+  data = np.fromfile(bin_path, dtype="<f")
+  return int(data[0]), data[1:]
+
+def write_bin(bin_path, start_index, values):
+  np.hstack([start_index, values]).astype("<f").tofile(str(bin_path))
+
+def append_bin(bin_path, values):
+  with open(bin_path, "ab") as fp:
+    np.asarray(values).astype("<f").tofile(fp)
@@ -0,0 +1,190 @@
+import numpy as np
+import pandas as pd
+import fire
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "tushare"))
+from dump_all_to_qlib_source import add_vwap
+from db_utils import get_connection, read_sql
+from normalize import CrowdSourceNormalize
+import qlib_bin_utils
+
+class CalendarCrowdSourceNormalize(CrowdSourceNormalize):
+  # Normalize against the calendar of the existing qlib_bin instead of downloading a new one
+  def __init__(self, calendar_list, **kwargs):
+    self._fixed_calendar_list = calendar_list
+    super().__init__(**kwargs)
+
+  def _get_calendar_list(self):
+    return self._fixed_calendar_list
+
+def _load_append_state(feature_dir):
+  """
+  Recover what CrowdSourceNormalize needs to continue a symbol from its existing bins:
+  the first valid adjusted close used as base (normalized close is 1.0 there), the last raw close for `change`,
+  and the last normalized factor for forward filling. Returns None if the symbol has to be fully re-normalized.
+  """
+  fields = qlib_bin_utils.list_feature_fields(feature_dir)
+  if not {"close", "adjclose", "factor"}.issubset(fields):
+    return None
+  start_index, close = qlib_bin_utils.read_bin(qlib_bin_utils.get_bin_path(feature_dir, "close"))
+  _, adjclose = qlib_bin_utils.read_bin(qlib_bin_utils.get_bin_path(feature_dir, "adjclose"))
+  _, factor = qlib_bin_utils.read_bin(qlib_bin_utils.get_bin_path(feature_dir, "factor"))
+  for field in fields:
+    if qlib_bin_utils.get_bin_path(feature_dir, field).stat().st_size != (len(close) + 1) * 4:
+      return None
+  valid_index = np.flatnonzero(~np.isnan(close))
+  if len(valid_index) == 0:
+    return None
+  first, last = valid_index[0], valid_index[-1]
+  return {
+    "fields": fields,
+    "start_index": start_index,
+    "length": len(close),
+    "base_close": float(adjclose[first]) / float(close[first]),
+    "last_close": float(close[last]) / float(factor[last]),
+    "last_factor": float(factor[-1]),
+    "check_index": start_index + last,
+    "check_adjclose": float(adjclose[last]),
+  }
+
+def _find_changed_symbols(dbConnection, append_states, calendar):
+  # If adjclose at the last exported date no longer matches the database, the adjustment factor
+  # history of that symbol was rewritten and the existing bins can not be extended.
+  check_df = pd.DataFrame(
+    [(symbol, calendar[state["check_index"]], state["check_adjclose"]) for symbol, state in append_states.items()],
+    columns=["symbol", "tradedate", "bin_adjclose"])
+  if check_df.empty:
+    return []
+  date_list = ",".join(f"'{d.strftime('%Y-%m-%d')}'" for d in check_df["tradedate"].unique())
+  db_df = read_sql(f"select symbol, tradedate, adjclose from final_a_stock_eod_price where tradedate in ({date_list})", dbConnection)
+  db_df["tradedate"] = pd.to_datetime(db_df["tradedate"])
+  check_df = check_df.merge(db_df, on=["symbol", "tradedate"], how="left")
+  diff = (check_df["adjclose"].astype(float) / check_df["bin_adjclose"] - 1).abs()
+  return check_df.loc[~(diff <= 1e-6), "symbol"].tolist()
+
+def _append_symbol(feature_dir, state, symbol_df, calendar, calendar_index):
+  """
+  Append the new rows of one symbol to its bins, using the same formulas as CrowdSourceNormalize.
+  Returns False if the symbol needs a full re-normalization instead.
+  """
+  begin_index = state["start_index"] + state["length"]
+  end_index = calendar_index[symbol_df["tradedate"].iloc[-1]]
+  if end_index < begin_index:
+    return True
+
+  # Days between the last exported day and the new rows (e.g. suspension) become NaN, as in a full dump
+  df = symbol_df.drop(columns=["symbol"]).set_index("tradedate").reindex(calendar[begin_index:end_index + 1]).astype(float)
+  invalid = ((df["volume"] <= 0) | df["volume"].isna()).values
+  df.loc[invalid, :] = np.nan
+
+  close_ffill = pd.Series(np.append(state["last_close"], df["close"].values)).ffill().values
+  change = close_ffill[1:] / close_ffill[:-1] - 1
+  change[invalid] = np.nan
+  if ((change >= 89) & (change <= 111)).any():
+    # Abnormal price jump is fixed by qlib's normalize_yahoo, which needs the full history
+    return False
+
+  base_close = state["base_close"]
+  # Like adjusted_price, the factor is forward filled (from the last exported day) before it adjusts the prices
+  factor = pd.Series(np.append(state["last_factor"] * base_close, (df["adjclose"] / df["close"]).values)).ffill().values[1:]
+  normalized = {
+    "change": change,
+    "factor": factor / base_close,
+  }
+  for column in df.columns:
+    if column in ["adjclose", "amount"]:
+      normalized[column] = df[column].values
+    elif column == "volume":
+      normalized[column] = df[column].values / factor * base_close
+    elif column in CrowdSourceNormalize.COLUMNS:
+      normalized[column] = df[column].values * factor / base_close
+    else:
+      normalized[column] = (df[column] / base_close).values
+
+  if set(normalized) != set(state["fields"]):
+    return False
+  for field in state["fields"]:
+    qlib_bin_utils.append_bin(qlib_bin_utils.get_bin_path(feature_dir, field), normalized[field])
+  return True
+
+def _dump_full_symbol(feature_dir, normalizer, symbol_df, calendar, calendar_index):
+  df = normalizer.normalize(symbol_df)
+  if df is None or df.empty:
+    return None
+  df["tradedate"] = pd.to_datetime(df["tradedate"])
+  start_index = calendar_index[df["tradedate"].iloc[0]]
+  end_index = calendar_index[df["tradedate"].iloc[-1]]
+  df = df.drop(columns=["symbol"]).set_index("tradedate").reindex(calendar[start_index:end_index + 1])
+  feature_dir.mkdir(parents=True, exist_ok=True)
+  for field in df.columns:
+    qlib_bin_utils.write_bin(qlib_bin_utils.get_bin_path(feature_dir, field), start_index, df[field].values)
+  return calendar[start_index], calendar[end_index]
+
+def update_qlib_bin(qlib_dir, symbol_batch_size=500):
+  dbConnection = get_connection()
+
+  old_calendar = qlib_bin_utils.read_calendar(qlib_dir)
+  last_date = old_calendar[-1].strftime('%Y-%m-%d')
+  new_df = read_sql(f"select * from final_a_stock_eod_price where tradedate > '{last_date}' order by symbol, tradedate", dbConnection)
+  if new_df.empty:
+    print(f"qlib bin is up to date at {last_date}")
+    dbConnection.close()
+    return
+  new_df["tradedate"] = pd.to_datetime(new_df["tradedate"])
+  new_df = add_vwap(new_df)
+
+  calendar = old_calendar + sorted(pd.to_datetime(new_df["tradedate"].unique()))
+  calendar_index = {date: i for i, date in enumerate(calendar)}
+  instruments = qlib_bin_utils.read_instruments(qlib_dir)
+  print(f"Updating {new_df['symbol'].nunique()} symbols for {len(calendar) - len(old_calendar)} new days after {last_date}")
+
+  append_states = {}
+  full_symbols = []
+  for symbol in new_df["symbol"].unique():
+    feature_dir = qlib_bin_utils.get_feature_dir(qlib_dir, symbol)
+    state = _load_append_state(feature_dir) if symbol in instruments and feature_dir.exists() else None
+    if state is None:
+      full_symbols.append(symbol)
+    else:
+      append_states[symbol] = state
+  for symbol in _find_changed_symbols(dbConnection, append_states, calendar):
+    del append_states[symbol]
+    full_symbols.append(symbol)
+
+  append_count = 0
+  for symbol, symbol_df in new_df.groupby("symbol"):
+    if symbol not in append_states:
+      continue
+    feature_dir = qlib_bin_utils.get_feature_dir(qlib_dir, symbol)
+    if _append_symbol(feature_dir, append_states[symbol], symbol_df, calendar, calendar_index):
+      instruments[symbol] = (instruments[symbol][0], symbol_df["tradedate"].iloc[-1])
+      append_count += 1
+    else:
+      full_symbols.append(symbol)
+
+  # New symbols and symbols with a changed adjustment history are re-normalized from their full history
+  print(f"Appended {append_count} symbols, re-normalizing {len(full_symbols)} symbols")
+  normalizer = CalendarCrowdSourceNormalize(calendar_list=calendar, date_field_name="tradedate", symbol_field_name="symbol")
+  renormalized_count = 0
+  for i in range(0, len(full_symbols), symbol_batch_size):
+    symbol_list = ",".join(f"'{symbol}'" for symbol in full_symbols[i:i+symbol_batch_size])
+    history_df = read_sql(f"select * from final_a_stock_eod_price where symbol in ({symbol_list}) order by symbol, tradedate", dbConnection)
+    history_df["tradedate"] = pd.to_datetime(history_df["tradedate"])
+    history_df = add_vwap(history_df)
+    for symbol, symbol_df in history_df.groupby("symbol"):
+      date_range = _dump_full_symbol(qlib_bin_utils.get_feature_dir(qlib_dir, symbol), normalizer, symbol_df, calendar, calendar_index)
+      if date_range is not None:
+        instruments[symbol] = date_range
+        renormalized_count += 1
+    print(f"Re-normalized {renormalized_count} of {len(full_symbols)} symbols")
+
+  dbConnection.close()
+
+  # Calendar is written last, so an interrupted run is picked up again from the same start date
+  qlib_bin_utils.write_instruments(qlib_dir, instruments)
+  qlib_bin_utils.write_calendar(qlib_dir, calendar)
+
+if __name__ == "__main__":
+  fire.Fire(update_qlib_bin)
@@ -0,0 +1,55 @@
+"""
+normalize_batch must write byte for byte the same csv as qlib's per-symbol CrowdSourceNormalize.
+
+Needs qlib's scripts directory on PYTHONPATH (for data_collector), e.g.
+    PYTHONPATH=~/qlib/scripts python3 -m pytest tests
+The calendar is fixed by tests/data/calendar.txt, so nothing is downloaded.
+"""
+import glob
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+DATA_DIR = os.path.join(TEST_DIR, "data")
+sys.path.append(os.path.join(TEST_DIR, "..", "qlib"))
+
+normalize = pytest.importorskip("normalize", reason="needs qlib/scripts on PYTHONPATH")
+
+SOURCE_PATHS = sorted(glob.glob(os.path.join(DATA_DIR, "qlib_source", "*.csv")))
+
+
+def _calendar():
+    return pd.to_datetime(pd.read_csv(os.path.join(DATA_DIR, "calendar.txt"), header=None)[0]).tolist()
+
+
+class FixedCalendarNormalize(normalize.CrowdSourceNormalize):
+    def _get_calendar_list(self):
+        return _calendar()
+
+
+@pytest.fixture(scope="module")
+def per_symbol_normalizer():
+    return FixedCalendarNormalize(date_field_name="tradedate", symbol_field_name="symbol")
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, len(SOURCE_PATHS)])
+def test_normalize_batch_matches_per_symbol(per_symbol_normalizer, batch_size):
+    frames = [normalize._read_source_csv(path, "symbol") for path in SOURCE_PATHS]
+    calendar = pd.DatetimeIndex(_calendar())
+    batch_frames = []
+    for i in range(0, len(frames), batch_size):
+        batch_frames += normalize.normalize_batch(frames[i:i + batch_size], calendar, "tradedate", "symbol")
+
+    assert len(batch_frames) == len(SOURCE_PATHS)
+    for path, df, batch_df in zip(SOURCE_PATHS, frames, batch_frames):
+        expected = per_symbol_normalizer.normalize(df.copy())
+        assert batch_df.to_csv(index=False) == expected.to_csv(index=False), os.path.basename(path)
+
+
+def test_symbol_na_is_kept():
+    df = normalize._read_source_csv(os.path.join(DATA_DIR, "qlib_source", "NA.csv"), "symbol")
+    result = normalize.normalize_batch([df], pd.DatetimeIndex(_calendar()))[0]
+    assert (result["symbol"] == "NA").all()
@@ -0,0 +1,245 @@
+import atexit
+import collections
+import datetime
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+import pandas
+
+try:
+    import pyarrow  # noqa: F401
+except Exception:
+    pyarrow = None
+
+# 无日期参数的接口（股票列表、指数列表、实时快照等）的缓存时间，单位秒
+ENDPOINT_TTL_SEC = {
+    "tushare.stock_basic": 24 * 3600,
+    "tushare.index_basic": 24 * 3600,
+}
+DATE_PARAM_NAMES = {"trade_date", "cal_date", "start_date", "end_date", "date", "start", "end"}
+
+
+class CacheMiss(Exception):
+    """Raised in offline replay mode when a request is not in the cache."""
+
+
+def is_cache_enabled() -> bool:
+    return os.environ.get("TS_CACHE", "1") != "0"
+
+
+def is_offline() -> bool:
+    return os.environ.get("TS_CACHE_OFFLINE", "0") == "1"
+
+
+def get_cache_dir() -> str:
+    return os.environ.get("TS_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "investment_data", "api"))
+
+
+def get_today_ttl_seconds() -> int:
+    # 当天（未收盘确认）的数据很快过期
+    try:
+        return int(os.environ.get("TS_CACHE_TODAY_TTL_SEC", "600"))
+    except Exception:
+        return 600
+
+
+def get_max_bytes() -> int:
+    try:
+        return int(os.environ.get("TS_CACHE_MAX_MB", "2048")) * 1024 * 1024
+    except Exception:
+        return 2048 * 1024 * 1024
+
+
+def _normalize_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.strftime("%Y%m%d")
+    if isinstance(value, (list, tuple, set)):
+        return [_normalize_value(x) for x in value]
+    return str(value)
+
+
+def normalize_params(params: dict) -> dict:
+    """Drop unset params and turn the rest into strings, so equal requests get equal keys."""
+    return {k: _normalize_value(v) for k, v in sorted(params.items()) if v is not None}
+
+
+def make_key(method: str, params: dict) -> str:
+    payload = json.dumps({"method": method, "params": normalize_params(params)}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _latest_date(params: dict):
+    dates = []
+    for name, value in normalize_params(params).items():
+        if name not in DATE_PARAM_NAMES or not isinstance(value, str):
+            continue
+        value = value.replace("-", "")[:8]
+        if len(value) == 8 and value.isdigit():
+            dates.append(value)
+    return max(dates) if dates else None
+
+
+def get_expires_at(method: str, params: dict, now: float = None):
+    """None means never expire: every date the request covers is already closed."""
+    now = now if now is not None else time.time()
+    latest_date = _latest_date(params)
+    if latest_date is not None:
+        if latest_date < datetime.datetime.fromtimestamp(now).strftime("%Y%m%d"):
+            return None
+        return now + get_today_ttl_seconds()
+    return now + ENDPOINT_TTL_SEC.get(method, get_today_ttl_seconds())
+
+
+class ResponseCache:
+    """
+    Content addressed cache of API responses. DataFrames are stored as parquet when pyarrow is available,
+    pickle otherwise; a sqlite index keeps expiry and last access time for LRU eviction.
+    """
+
+    def __init__(self, cache_dir: str = None, max_bytes: int = None):
+        self.cache_dir = cache_dir or get_cache_dir()
+        self.max_bytes = max_bytes if max_bytes is not None else get_max_bytes()
+        self._lock = threading.Lock()
+        self._db = None
+        self.stats = collections.defaultdict(lambda: {"hits": 0, "misses": 0, "expired": 0})
+
+    def _get_db(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._db = sqlite3.connect(os.path.join(self.cache_dir, "index.sqlite"), timeout=30, check_same_thread=False)
+            self._db.execute("""
+                create table if not exists entries (
+                    key text primary key, method text, path text, size integer,
+                    created_at real, expires_at real, last_access real)""")
+            self._db.commit()
+        return self._db
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + suffix)
+
+    def get(self, method: str, params: dict):
+        key = make_key(method, params)
+        now = time.time()
+        with self._lock:
+            db = self._get_db()
+            row = db.execute("select path, expires_at from entries where key = ?", (key,)).fetchone()
+            if row is not None and row[1] is not None and row[1] < now and not is_offline():
+                self.stats[method]["expired"] += 1
+                row = None
+            if row is None or not os.path.exists(row[0]):
+                self.stats[method]["misses"] += 1
+                return None
+            db.execute("update entries set last_access = ? where key = ?", (now, key))
+            db.commit()
+            self.stats[method]["hits"] += 1
+            path = row[0]
+        if path.endswith(".parquet"):
+            return pandas.read_parquet(path)
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def put(self, method: str, params: dict, df: pandas.DataFrame):
+        key = make_key(method, params)
+        tmp_suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        path = None
+        if pyarrow is not None:
+            path = self._path(key, ".parquet")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                df.to_parquet(path + tmp_suffix, index=True)
+            except Exception:
+                # 混合类型的 object 列无法写 parquet，退回 pickle
+                if os.path.exists(path + tmp_suffix):
+                    os.remove(path + tmp_suffix)
+                path = None
+        if path is None:
+            path = self._path(key, ".pkl")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + tmp_suffix, "wb") as f:
+                pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + tmp_suffix, path)
+
+        now = time.time()
+        with self._lock:
+            db = self._get_db()
+            old = db.execute("select path from entries where key = ?", (key,)).fetchone()
+            if old is not None and old[0] != path and os.path.exists(old[0]):
+                os.remove(old[0])
+            db.execute("insert or replace into entries values (?, ?, ?, ?, ?, ?, ?)",
+                       (key, method, path, os.path.getsize(path), now, get_expires_at(method, params, now), now))
+            db.commit()
+            self._evict(db)
+
+    def _evict(self, db: sqlite3.Connection):
+        total = db.execute("select coalesce(sum(size), 0) from entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # 按最近访问时间淘汰，直到低于上限的 90%
+        target = self.max_bytes * 0.9
+        for key, path, size in db.execute("select key, path, size from entries order by last_access").fetchall():
+            if total <= target:
+                break
+            if os.path.exists(path):
+                os.remove(path)
+            db.execute("delete from entries where key = ?", (key,))
+            total -= size
+        db.commit()
+
+    def format_stats(self) -> str:
+        lines = [f"{'method':<36}{'hits':>8}{'misses':>8}{'expired':>9}{'hit rate':>10}"]
+        for method, stat in sorted(self.stats.items()):
+            total = stat["hits"] + stat["misses"]
+            lines.append(f"{method:<36}{stat['hits']:>8}{stat['misses']:>8}{stat['expired']:>9}"
+                         f"{stat['hits'] / max(total, 1):>10.1%}")
+        return "\n".join(lines)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> ResponseCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
+
+
+def cached_call(method: str, params: dict, fetch):
+    """
+    Return the cached response of method(params), or call fetch() and cache its result.
+    Only non-empty DataFrames are cached, an empty answer is often a transient failure.
+    With TS_CACHE_OFFLINE=1 the network is never used and a miss raises CacheMiss.
+    """
+    if not is_cache_enabled():
+        return fetch()
+    cache = get_cache()
+    try:
+        df = cache.get(method, params)
+    except Exception as e:
+        print(f"[WARN] cache read failed for {method}: {e}")
+        df = None
+    if df is not None:
+        return df
+    if is_offline():
+        raise CacheMiss(f"{method} {normalize_params(params)} is not cached")
+    df = fetch()
+    if isinstance(df, pandas.DataFrame) and not df.empty:
+        try:
+            cache.put(method, params, df)
+        except Exception as e:
+            print(f"[WARN] cache write failed for {method}: {e}")
+    return df
+
+
+@atexit.register
+def _print_cache_stats():
+    if _cache is not None and _cache.stats and os.environ.get("TS_CALL_METRICS", "1") != "0":
+        print("[METRICS] API cache")
+        print(_cache.format_stats())
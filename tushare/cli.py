@@ -0,0 +1,54 @@
+import importlib
+import os
+import sys
+import time
+
+import fire
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# 命令名 -> (模块, 函数)，模块在首次执行该命令时才导入
+COMMANDS = {
+    "index_weight": ("dump_index_weight", "dump_index_data"),
+    "index_price": ("dump_index_eod_price", "dump_index_data"),
+    "stock_price": ("update_a_stock_eod_price_to_latest", "dump_astock_data"),
+    "stock_price_history": ("dump_a_stock_eod_price", "dump_astock_data"),
+    "day_calendar": ("dump_day_calendar", "dump_calendar_to_qlib_dir"),
+    "link_ratio": ("update_link_ratio", "update_link_ratio"),
+    "merge_final_price": ("merge_final_price", "merge_final_price"),
+    "stock_limit": ("update_final_stock_limit", "update_final_stock_limit"),
+    "cross_source_validation": ("cross_source_validation", "cross_source_validation"),
+    "daily_update": ("daily_update", "daily_update"),
+}
+
+
+def get_command(name):
+    if name not in COMMANDS:
+        raise ValueError(f"Unknown command {name}, available: {', '.join(COMMANDS)}")
+    module_name, func_name = COMMANDS[name]
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+def run_command(name, *args, **kwargs):
+    """Run one command in this process; modules, the Tushare client and the database pool are reused by later commands."""
+    start = time.perf_counter()
+    result = get_command(name)(*args, **kwargs)
+    print(f"[CLI] {name} finished in {time.perf_counter() - start:.1f}s")
+    return result
+
+
+def run(*names):
+    """Run several commands without arguments one after another, e.g. `cli.py run index_price stock_price merge_final_price`."""
+    for name in names:
+        run_command(name)
+
+
+def _make_command(name):
+    def command(*args, **kwargs):
+        return run_command(name, *args, **kwargs)
+    command.__doc__ = f"{COMMANDS[name][0]}.{COMMANDS[name][1]}, see that module for its arguments."
+    return command
+
+
+if __name__ == "__main__":
+    fire.Fire({"run": run, **{name: _make_command(name) for name in COMMANDS}})
@@ -0,0 +1,216 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import fire
+import numpy as np
+import pandas
+
+try:
+    from .db_utils import get_connection, read_sql
+except Exception:
+    import sys
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from db_utils import get_connection, read_sql
+
+# 每个数据源的价格表、链接表以及股票代码格式（ts: 000001.SZ，w: SZ000001）
+SOURCES = {
+    "ts": {"table": "ts_a_stock_eod_price", "link_table": "ts_link_table",
+           "link_key": "w_symbol", "link_symbol": "link_symbol", "symbol_style": "ts"},
+    "yahoo": {"table": "yahoo_a_stock_eod_price", "link_table": "yahoo_link_table",
+              "link_key": "symbol", "link_symbol": "symbol", "symbol_style": "w"},
+    "c": {"table": "c_a_stock_eod_price", "link_table": "c_link_table",
+          "link_key": "symbol", "link_symbol": "symbol", "symbol_style": "w"},
+}
+PRICE_FIELDS = ["high", "low", "open", "close", "volume"]
+CHECK_FIELDS = PRICE_FIELDS + ["adjclose"]
+# 相对误差分桶边界
+BUCKET_EDGES = [0, 1e-4, 1e-3, 1e-2, 5e-2, np.inf]
+BUCKET_NAMES = ["<0.01%", "<0.1%", "<1%", "<5%", ">=5%"]
+
+# 状态文件与报告默认写在源码目录之外
+DEFAULT_OUTPUT_DIR = os.path.join(os.path.expanduser("~"), ".cache", "investment_data", "validation")
+
+
+def _to_source_symbols(source, symbols):
+    if SOURCES[source]["symbol_style"] == "ts":
+        return [f"{s[2:]}.{s[:2]}" for s in symbols]
+    return list(symbols)
+
+
+def _to_w_symbol(source, symbol: pandas.Series) -> pandas.Series:
+    if SOURCES[source]["symbol_style"] == "ts":
+        return symbol.str[7:9] + symbol.str[0:6]
+    return symbol.str.upper()
+
+
+def _read_prices(dbConnection, table, symbols, since):
+    placeholders = ", ".join(["%s"] * len(symbols))
+    sql = f"select tradedate, symbol, {', '.join(PRICE_FIELDS)}, adjclose from {table} where symbol in ({placeholders})"
+    params = list(symbols)
+    if since is not None:
+        sql += " and tradedate > %s"
+        params.append(since)
+    return read_sql(sql + " order by symbol, tradedate", dbConnection, params=params)
+
+
+def _read_link_check(dbConnection, source, symbols):
+    """Stored adj_ratio next to the ratio recomputed from both adjclose at link_date."""
+    config = SOURCES[source]
+    placeholders = ", ".join(["%s"] * len(symbols))
+    sql = f"""
+    select l.{config['link_key']} as symbol, l.link_date, l.adj_ratio,
+        s.adjclose as source_adjclose, f.adjclose as final_adjclose
+    from {config['link_table']} l
+    join {config['table']} s on s.symbol = l.{config['link_symbol']} and s.tradedate = l.link_date
+    join final_a_stock_eod_price f on f.symbol = l.{config['link_key']} and f.tradedate = l.link_date
+    where l.{config['link_key']} in ({placeholders})
+    """
+    link_df = read_sql(sql, dbConnection, params=list(symbols))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        recomputed = link_df["source_adjclose"].to_numpy(float) / link_df["final_adjclose"].to_numpy(float)
+        link_df["ratio_diff"] = np.abs(recomputed / link_df["adj_ratio"].to_numpy(float) - 1)
+    return link_df
+
+
+def _relative_diff(source_values, final_values):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.abs(source_values / final_values - 1)
+
+
+def validate_shard(source, symbols, since=None, tolerance=0.01, adjclose_tolerance=0.05):
+    """
+    Compare one shard of symbols between source and final_a_stock_eod_price.
+    Returns per symbol statistics, tolerance bucket counts per field and the last validated date.
+    """
+    # 每个工作进程使用自己的连接池
+    dbConnection = get_connection()
+    try:
+        source_df = _read_prices(dbConnection, SOURCES[source]["table"], _to_source_symbols(source, symbols), since)
+        final_df = _read_prices(dbConnection, "final_a_stock_eod_price", symbols, since)
+        link_df = _read_link_check(dbConnection, source, symbols)
+    finally:
+        dbConnection.close()
+
+    source_df["symbol"] = _to_w_symbol(source, source_df["symbol"])
+    # 两边都已按 (symbol, tradedate) 排序
+    df = pandas.merge(source_df, final_df, on=["symbol", "tradedate"], suffixes=("_source", "_final"), sort=False)
+    df = df[df["close_source"] != 0]
+    df = df.merge(link_df[["symbol", "adj_ratio"]], on="symbol", how="left")
+
+    violation = pandas.DataFrame({"symbol": df["symbol"]})
+    buckets = {}
+    for field in CHECK_FIELDS:
+        source_values = df[f"{field}_source"].to_numpy(float)
+        final_values = df[f"{field}_final"].to_numpy(float)
+        if field == "adjclose":
+            # adjclose 需先按链接日比例换算，允许 5 分的四舍五入误差
+            adj_ratio = df["adj_ratio"].to_numpy(float)
+            # 没有 adj_ratio 的行无法换算，单独计为 unlinked，而不是当作通过
+            violation["adjclose_unlinked"] = np.isnan(adj_ratio)
+            source_values = source_values / adj_ratio
+            violation[field] = np.abs(source_values - final_values) > adjclose_tolerance
+        diff = _relative_diff(source_values, final_values)
+        if field != "adjclose":
+            violation[field] = diff > tolerance
+        buckets[field] = np.histogram(diff[np.isfinite(diff)], bins=BUCKET_EDGES)[0]
+        violation[f"{field}_max_diff"] = diff
+
+    summary = violation.groupby("symbol").agg(
+        rows=("symbol", "size"),
+        **{f"{field}_violations": (field, "sum") for field in CHECK_FIELDS},
+        **{f"{field}_max_diff": (f"{field}_max_diff", "max") for field in CHECK_FIELDS},
+        adjclose_unlinked=("adjclose_unlinked", "sum"),
+    )
+    summary = summary.join(link_df.set_index("symbol")[["link_date", "adj_ratio", "ratio_diff"]], how="outer")
+    last_date = None if df.empty else str(pandas.to_datetime(df["tradedate"]).max().date())
+    return summary, buckets, last_date
+
+
+def _load_state(state_file):
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file) as f:
+        return json.load(f)
+
+
+def _save_state(state_file, state):
+    with open(state_file + ".tmp", "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(state_file + ".tmp", state_file)
+
+
+def _print_report(source, summary, buckets, tolerance):
+    print(f"[REPORT] {source} vs final_a_stock_eod_price, relative diff buckets")
+    print(f"{'field':<12}" + "".join(f"{name:>12}" for name in BUCKET_NAMES))
+    for field in CHECK_FIELDS:
+        print(f"{field:<12}" + "".join(f"{count:>12}" for count in buckets[field]))
+
+    violation_columns = [f"{field}_violations" for field in CHECK_FIELDS]
+    summary["violations"] = summary[violation_columns].fillna(0).sum(axis=1).astype(int)
+    bad_df = summary[summary["violations"] > 0].sort_values("violations", ascending=False)
+    bad_link_df = summary[summary["ratio_diff"] > tolerance]
+    unlinked_df = summary[summary["adjclose_unlinked"].fillna(0) > 0]
+    print(f"[REPORT] {len(bad_df)} of {len(summary)} symbols have violations, "
+          f"{int(summary['violations'].sum())} violations in {int(summary['rows'].fillna(0).sum())} rows")
+    if not bad_df.empty:
+        print(bad_df[["rows"] + violation_columns].head(20).to_string())
+    print(f"[REPORT] {len(unlinked_df)} symbols without adj_ratio, adjclose of "
+          f"{int(unlinked_df['adjclose_unlinked'].sum())} rows not checked")
+    if not unlinked_df.empty:
+        print(unlinked_df[["rows", "adjclose_unlinked"]].head(20).to_string())
+    print(f"[REPORT] {len(bad_link_df)} symbols whose adj_ratio does not match at link_date")
+    if not bad_link_df.empty:
+        print(bad_link_df[["link_date", "adj_ratio", "ratio_diff"]].head(20).to_string())
+
+
+def cross_source_validation(source="ts", incremental=False, shard_size=200, max_workers=4,
+                            tolerance=0.01, adjclose_tolerance=0.05, output=None, state_file=None):
+    """
+    Validate source (ts, yahoo or c) against final_a_stock_eod_price in symbol shards.
+    With --incremental only dates after the last validated date of this source are compared.
+    state_file and output default to DEFAULT_OUTPUT_DIR; rows without adj_ratio are reported as unlinked.
+    """
+    if state_file is None or output is None:
+        os.makedirs(DEFAULT_OUTPUT_DIR, exist_ok=True)
+    state_file = state_file or os.path.join(DEFAULT_OUTPUT_DIR, "validation_state.json")
+    output = output or os.path.join(DEFAULT_OUTPUT_DIR, f"validation_{source}.csv")
+    state = _load_state(state_file)
+    since = state.get(source) if incremental else None
+    if since is not None:
+        print(f"[INFO] validating {source} after {since}")
+
+    config = SOURCES[source]
+    symbols = read_sql(
+        f"select distinct {config['link_key']} as symbol from {config['link_table']} order by symbol")["symbol"].tolist()
+
+    shards = [symbols[i:i + shard_size] for i in range(0, len(symbols), shard_size)]
+    summaries = []
+    buckets = {field: np.zeros(len(BUCKET_NAMES), dtype=int) for field in CHECK_FIELDS}
+    last_dates = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(validate_shard, source, shard, since, tolerance, adjclose_tolerance) for shard in shards]
+        for i, future in enumerate(as_completed(futures)):
+            summary, shard_buckets, last_date = future.result()
+            summaries.append(summary)
+            for field in CHECK_FIELDS:
+                buckets[field] += shard_buckets[field]
+            if last_date is not None:
+                last_dates.append(last_date)
+            print(f"[INFO] {i + 1}/{len(shards)} shards done")
+
+    summary = pandas.concat(summaries) if summaries else pandas.DataFrame()
+    if summary.empty:
+        print("[INFO] Nothing to validate")
+        return
+    _print_report(source, summary, buckets, tolerance)
+    summary.to_csv(output)
+    print(f"[INFO] per symbol report written to {output}")
+
+    if last_dates:
+        state[source] = max(last_dates)
+        _save_state(state_file, state)
+
+
+if __name__ == "__main__":
+    fire.Fire(cross_source_validation)
@@ -0,0 +1,206 @@
+import datetime
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import fire
+import pandas
+
+try:
+    from .db_utils import bulk_upsert, get_connection, read_sql
+    from .cli import run_command
+except Exception:
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from db_utils import bulk_upsert, get_connection, read_sql
+    from cli import run_command
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+
+
+class Stage:
+    """One node of the daily update graph. allow_failure stages only warn, their dependents still run."""
+
+    def __init__(self, name, func, deps=(), allow_failure=False):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.allow_failure = allow_failure
+
+
+def run_stages(stages, max_workers=4):
+    """
+    Run stages as soon as all their dependencies are finished, independent stages in parallel.
+    Returns a timing record per stage: status is ok, warn (failed but allowed), failed or skipped.
+    """
+    pending = {stage.name: stage for stage in stages}
+    records = {}
+    running = {}
+    run_start = time.perf_counter()
+
+    def _run(stage):
+        start = time.perf_counter()
+        print(f"[STAGE] {stage.name} started")
+        try:
+            stage.func()
+            status, error = "ok", None
+        except Exception as e:
+            status, error = ("warn" if stage.allow_failure else "failed"), repr(e)
+            print(f"[{'WARN' if stage.allow_failure else 'ERROR'}] {stage.name} failed: {e}")
+        seconds = time.perf_counter() - start
+        print(f"[STAGE] {stage.name} {status} in {seconds:.1f}s")
+        return {"stage": stage.name, "status": status, "start": start - run_start, "seconds": seconds, "error": error}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            for name, stage in list(pending.items()):
+                dep_status = [records[dep]["status"] if dep in records else None for dep in stage.deps]
+                if any(status in ("failed", "skipped") for status in dep_status):
+                    records[name] = {"stage": name, "status": "skipped", "start": None, "seconds": 0.0, "error": None}
+                    del pending[name]
+                elif all(status is not None for status in dep_status):
+                    running[executor.submit(_run, stage)] = name
+                    del pending[name]
+            if not running:
+                # 剩余阶段依赖不存在的阶段
+                for name in pending:
+                    records[name] = {"stage": name, "status": "skipped", "start": None, "seconds": 0.0, "error": None}
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                records[running.pop(future)] = future.result()
+    records["total"] = {"stage": "total", "status": "ok", "start": 0.0, "seconds": time.perf_counter() - run_start, "error": None}
+    return [records[stage.name] for stage in stages] + [records["total"]]
+
+
+def print_report(records):
+    print(f"{'stage':<24}{'status':>10}{'start s':>10}{'seconds':>10}")
+    for record in records:
+        start = f"{record['start']:.1f}" if record["start"] is not None else "-"
+        print(f"{record['stage']:<24}{record['status']:>10}{start:>10}{record['seconds']:>10.1f}")
+
+
+def run_script(script, *args):
+    cmd = [sys.executable, os.path.join(script_path, script), *args]
+    print("[RUN]", " ".join(cmd))
+    subprocess.run(cmd, check=True)
+
+
+def run_step(command, in_process=True, **kwargs):
+    """Run a cli.py command in this process, or in a fresh python process with --in_process=False."""
+    if in_process:
+        run_command(command, **kwargs)
+    else:
+        run_script("cli.py", command, *[f"--{key}={value}" for key, value in kwargs.items()])
+
+
+def wait_for_sql_server(proc, timeout=60.0, interval=0.2):
+    """Poll the server with a trivial query instead of sleeping a fixed time."""
+    deadline = time.monotonic() + timeout
+    while True:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"dolt sql-server exited with code {proc.returncode}")
+        try:
+            connection = get_connection()
+            try:
+                cursor = connection.cursor()
+                cursor.execute("select 1")
+                cursor.close()
+            finally:
+                connection.close()
+            return
+        except Exception as e:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"SQL server not ready after {timeout}s: {e}")
+            time.sleep(interval)
+
+
+def stop_sql_server(proc, timeout=30):
+    if proc is None or proc.poll() is not None:
+        return
+    proc.terminate()
+    try:
+        proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def import_csv_dir(table, csv_dir):
+    """
+    Upsert every csv of csv_dir into table in one transaction, replacing one `dolt table import -u` per file.
+    Columns that the table does not have are dropped, like dolt import does.
+    """
+    files = sorted(glob.glob(f"{csv_dir}/*.csv"))
+    frames = [pandas.read_csv(f, dtype=str) for f in files]
+    frames = [df for df in frames if not df.empty]
+    if len(frames) == 0:
+        print(f"[INFO] no csv to import into {table}")
+        return 0
+    table_columns = read_sql(f"show columns from `{table}`")["Field"].tolist()
+    df = pandas.concat(frames, ignore_index=True)
+    df = df[[c for c in df.columns if c in table_columns]]
+    record_num = bulk_upsert(None, table, df)
+    print(f"[INFO] imported {record_num} rows from {len(files)} files into {table}")
+    return record_num
+
+
+def daily_update(dolt_dir="/dolt/investment_data", start_date=None, max_workers=4,
+                 server_timeout=None, report=None, in_process=True):
+    """
+    Run the daily update as a dependency graph:
+      sql_server ─┬─> index_weight ──> import_index_weight
+                  ├─> index_price ───> import_index_price ─┬─> merge_final_price ─> stock_limit
+                  └─> stock_price ───> link_ratio ─────────┘
+    The fetch stages read what is already in the database, so they start once the server is ready,
+    then run in parallel.
+    The server is stopped at the end, the dolt commit is left to the caller.
+    Stages share this process by default, so tushare, akshare and the database pool are loaded once.
+    The stage report defaults to daily_update_report.json next to dolt_dir, outside both repositories.
+    """
+    start_date = start_date or (datetime.datetime.now() - datetime.timedelta(days=14)).strftime("%Y%m%d")
+    server_timeout = server_timeout or float(os.environ.get("SQL_SERVER_TIMEOUT_SEC", "60"))
+    report = report or os.path.join(os.path.dirname(os.path.abspath(dolt_dir)), "daily_update_report.json")
+    server = {}
+
+    def start_sql_server():
+        server["proc"] = subprocess.Popen(["dolt", "sql-server"], cwd=dolt_dir)
+        wait_for_sql_server(server["proc"], server_timeout)
+
+    stages = [
+        Stage("sql_server", start_sql_server),
+        # 抓取失败时与 daily_update.sh 一致，仅告警并导入已有文件
+        # 指数权重先查询库中已有月份，只抓取缺口
+        Stage("index_weight", lambda: run_step("index_weight", in_process, start_date=start_date),
+              deps=["sql_server"], allow_failure=True),
+        # 指数价格只输出库中最新交易日之后的数据
+        Stage("index_price", lambda: run_step("index_price", in_process), deps=["sql_server"], allow_failure=True),
+        Stage("import_index_weight", lambda: import_csv_dir("ts_index_weight", f"{script_path}/index_weight"),
+              deps=["sql_server", "index_weight"]),
+        Stage("import_index_price", lambda: import_csv_dir("ts_a_stock_eod_price", f"{script_path}/index"),
+              deps=["sql_server", "index_price"]),
+        Stage("stock_price", lambda: run_step("stock_price", in_process), deps=["sql_server"]),
+        # 复权因子被重算的股票先改写 adj_ratio，可手动重跑，失败不阻塞合并
+        Stage("link_ratio", lambda: run_step("link_ratio", in_process), deps=["stock_price"], allow_failure=True),
+        Stage("merge_final_price", lambda: run_step("merge_final_price", in_process), deps=["import_index_price", "link_ratio"]),
+        # 价格已提交，涨跌停失败只告警，次日从水位线继续
+        Stage("stock_limit", lambda: run_step("stock_limit", in_process), deps=["merge_final_price"], allow_failure=True),
+    ]
+    try:
+        records = run_stages(stages, max_workers)
+    finally:
+        stop_sql_server(server.get("proc"))
+
+    print_report(records)
+    with open(report, "w") as f:
+        json.dump(records, f, indent=1)
+    failed = [record["stage"] for record in records if record["status"] in ("failed", "skipped")]
+    if failed:
+        raise RuntimeError(f"daily update failed: {failed}")
+
+
+if __name__ == "__main__":
+    fire.Fire(daily_update)
@@ -0,0 +1,217 @@
+import datetime
+import json
+import os
+import threading
+import time
+
+import pandas
+import pymysql
+import pymysql.cursors
+from sqlalchemy import create_engine
+
+DEFAULT_DSN = "mysql+pymysql://root:@127.0.0.1/investment_data"
+
+_engines = {}
+_engines_lock = threading.Lock()
+_state_lock = threading.Lock()
+
+
+def get_dsn() -> str:
+    return os.environ.get("INVESTMENT_DATA_DSN", DEFAULT_DSN)
+
+
+def get_state_path() -> str:
+    # 水位线只保存在本地，不写入发布到 DoltHub 的数据库
+    return os.environ.get("INVESTMENT_DATA_STATE",
+                          os.path.join(os.path.expanduser("~"), ".cache", "investment_data", "watermarks.json"))
+
+
+def get_slow_query_seconds() -> float:
+    try:
+        return float(os.environ.get("DB_SLOW_QUERY_SEC", "5"))
+    except Exception:
+        return 5.0
+
+
+def get_engine(streaming: bool = False):
+    """
+    Process wide pooled engine for INVESTMENT_DATA_DSN. streaming=True uses server side cursors (SSCursor),
+    so large results are fetched in chunks instead of being buffered by pymysql.
+    Engines are keyed by pid as pooled connections must not be shared with forked workers.
+    """
+    key = (get_dsn(), streaming, os.getpid())
+    with _engines_lock:
+        if key not in _engines:
+            connect_args = {"cursorclass": pymysql.cursors.SSCursor} if streaming else {}
+            _engines[key] = create_engine(key[0], pool_recycle=3600, pool_pre_ping=True, connect_args=connect_args)
+        return _engines[key]
+
+
+def get_connection(streaming: bool = False):
+    """Raw DBAPI connection from the shared pool, close() returns it to the pool."""
+    return get_engine(streaming).raw_connection()
+
+
+def _log_query(sql, seconds, row_count):
+    text = " ".join(str(sql).split())
+    text = text if len(text) <= 160 else text[:157] + "..."
+    if seconds >= get_slow_query_seconds():
+        print(f"[SLOW SQL] {seconds:.2f}s {row_count} rows: {text}")
+    elif os.environ.get("DB_LOG_SQL", "0") == "1":
+        print(f"[SQL] {seconds:.2f}s {row_count} rows: {text}")
+
+
+def read_sql(sql, connection=None, params=None, **kwargs) -> pandas.DataFrame:
+    """pandas.read_sql on the shared pool (or the given connection), logging slow queries with their row count."""
+    own_connection = connection is None
+    connection = connection or get_connection()
+    start = time.perf_counter()
+    try:
+        df = pandas.read_sql(sql, connection, params=params, **kwargs)
+    finally:
+        if own_connection:
+            connection.close()
+    _log_query(sql, time.perf_counter() - start, len(df))
+    return df
+
+
+def stream_sql(sql, chunk_size=500000, params=None):
+    """Yield DataFrame chunks of a large query through a server side cursor."""
+    connection = get_connection(streaming=True)
+    start = time.perf_counter()
+    row_count = 0
+    try:
+        for chunk_df in pandas.read_sql(sql, connection, params=params, chunksize=chunk_size):
+            row_count += len(chunk_df)
+            yield chunk_df
+    finally:
+        connection.close()
+        _log_query(sql, time.perf_counter() - start, row_count)
+
+
+def get_bulk_chunk_rows() -> int:
+    # 每条 INSERT 语句包含的行数，过大可能超过 max_allowed_packet
+    try:
+        return int(os.environ.get("DB_BULK_CHUNK_ROWS", "5000"))
+    except Exception:
+        return 5000
+
+
+def _to_db_rows(df):
+    # NaN -> NULL，numpy 标量转为 python 原生类型
+    return df.astype(object).where(df.notna(), None).values.tolist()
+
+
+def upsert_rows(cursor, table, df, chunk_rows=None, ignore=False) -> int:
+    """
+    Multi-row INSERT ... ON DUPLICATE KEY UPDATE of df on an open cursor, the caller owns the transaction.
+    ignore=True writes INSERT IGNORE instead and keeps the rows that already exist.
+    """
+    if df is None or df.empty:
+        return 0
+    chunk_rows = chunk_rows or get_bulk_chunk_rows()
+    columns = list(df.columns)
+    column_sql = ", ".join(f"`{c}`" for c in columns)
+    update_sql = ", ".join(f"`{c}` = VALUES(`{c}`)" for c in columns)
+    row_sql = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    rows = _to_db_rows(df)
+    for start in range(0, len(rows), chunk_rows):
+        chunk = rows[start:start + chunk_rows]
+        if ignore:
+            sql = f"INSERT IGNORE INTO `{table}` ({column_sql}) VALUES {', '.join([row_sql] * len(chunk))}"
+        else:
+            sql = f"INSERT INTO `{table}` ({column_sql}) VALUES {', '.join([row_sql] * len(chunk))} ON DUPLICATE KEY UPDATE {update_sql}"
+        cursor.execute(sql, [value for row in chunk for value in row])
+    return len(rows)
+
+
+def bulk_upsert(sqlEngine, table, df, chunk_rows=None, watermarks=None) -> int:
+    """
+    Write df into table with multi-row INSERT ... ON DUPLICATE KEY UPDATE statements.
+    All chunks run in one transaction, so a failed run leaves the table untouched and a rerun is idempotent.
+    watermarks ({source: date}) are advanced once the transaction is committed.
+    Returns the number of rows written.
+    """
+    if df is None or df.empty:
+        return 0
+    connection = (sqlEngine or get_engine()).raw_connection()
+    start = time.perf_counter()
+    try:
+        cursor = connection.cursor()
+        row_count = upsert_rows(cursor, table, df, chunk_rows)
+        cursor.close()
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+    if watermarks:
+        set_watermarks(watermarks)
+    _log_query(f"INSERT INTO {table} ... ON DUPLICATE KEY UPDATE", time.perf_counter() - start, row_count)
+    return row_count
+
+
+def _state_key() -> str:
+    # 以库地址区分，不保存用户名与密码
+    return get_dsn().rsplit("@", 1)[-1]
+
+
+def _read_state() -> dict:
+    try:
+        with open(get_state_path()) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def set_watermarks(watermarks: dict):
+    """
+    Record that each source ({source: date}) is fully processed up to its date, in the local state file.
+    Call it only after the rows are committed: a watermark lost after the commit just re-reads a few rows,
+    the writes are idempotent.
+    """
+    path = get_state_path()
+    with _state_lock:
+        state = _read_state()
+        sources = state.setdefault(_state_key(), {})
+        for source, watermark in watermarks.items():
+            sources[source] = {
+                "watermark": pandas.Timestamp(watermark).strftime("%Y-%m-%d"),
+                "updated_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            }
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+
+
+def set_watermark(source, watermark):
+    set_watermarks({source: watermark})
+
+
+def get_watermark(sqlEngine, source, bootstrap_sql=None):
+    """
+    High-watermark date of source from the local state file. When it was never recorded,
+    bootstrap_sql (a query returning one date) computes it from the target tables and the result is stored.
+    """
+    with _state_lock:
+        record = _read_state().get(_state_key(), {}).get(source)
+    if record is not None:
+        return pandas.Timestamp(record["watermark"])
+    if bootstrap_sql is None:
+        return None
+    connection = (sqlEngine or get_engine()).raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(bootstrap_sql)
+        row = cursor.fetchone()
+        cursor.close()
+    finally:
+        connection.close()
+    if row is None or row[0] is None:
+        return None
+    print(f"[INFO] bootstrap watermark of {source}: {row[0]}")
+    set_watermark(source, row[0])
+    return pandas.Timestamp(row[0])
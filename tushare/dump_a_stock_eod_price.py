@@ -1,32 +1,25 @@
-import tushare as ts
 import os
 import datetime
 import pandas
 import fire
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Optional
 
 try:
-    import akshare as ak
-except Exception:
-    ak = None
-
-try:
-    from yahooquery import Ticker as YqTicker
-except Exception:
-    YqTicker = None
-try:
-    from .timeout_utils import get_timeout_seconds, pro_call_with_timeout
+    from .timeout_utils import get_timeout_seconds, pro_call_with_timeout, retry_with_backoff, cached_call, get_pro, lazy_import
 except Exception:
     try:
-        from timeout_utils import get_timeout_seconds, pro_call_with_timeout
+        from timeout_utils import get_timeout_seconds, pro_call_with_timeout, retry_with_backoff, cached_call, get_pro, lazy_import
     except Exception:
         import sys, os
         sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-        from timeout_utils import get_timeout_seconds, pro_call_with_timeout
+        from timeout_utils import get_timeout_seconds, pro_call_with_timeout, retry_with_backoff, cached_call, get_pro, lazy_import
 
-ts.set_token(os.environ["TUSHARE"])
-pro=ts.pro_api()
+pro = get_pro()
+# 备用数据源仅在 Tushare 失败时使用，首次调用时才导入
+ak = lazy_import("akshare")
+YqTicker = lazy_import("yahooquery", "Ticker")
 file_path = os.path.dirname(os.path.realpath(__file__))
 
 
@@ -47,21 +40,22 @@ def get_trade_cal(start_date, end_date):
         cal_df = pandas.DataFrame({"cal_date": rng.strftime('%Y%m%d')})
         return cal_df
 
+def _get_tushare_daily(trade_date):
+    price_df = pro_call_with_timeout(pro, 'daily', get_timeout_seconds(), trade_date=trade_date)
+    adj_factor = pro_call_with_timeout(pro, 'adj_factor', get_timeout_seconds(), trade_date=trade_date)
+    df = pandas.merge(price_df, adj_factor, on="ts_code", how="inner")
+    df["adj_close"] = df["close"] * df["adj_factor"]
+    return df
+
 def get_daily(trade_date=''):
-    for _ in range(3):
-        try:
-            price_df = pro_call_with_timeout(pro, 'daily', get_timeout_seconds(), trade_date=trade_date)
-            adj_factor = pro_call_with_timeout(pro, 'adj_factor', get_timeout_seconds(), trade_date=trade_date)
-            df = pandas.merge(price_df, adj_factor, on="ts_code", how="inner")
-            df["adj_close"] = df["close"] * df["adj_factor"]
-            return df
-        except Exception as e:
-            print(e)
-            time.sleep(1)
+    try:
+        return retry_with_backoff(_get_tushare_daily, trade_date)
+    except Exception as e:
+        print(e)
     # 回退到 AKShare
     try:
         if ak is not None:
-            df_ak = ak.stock_zh_a_daily(symbol="all", adjust="")
+            df_ak = cached_call("akshare.stock_zh_a_daily", {"symbol": "all", "adjust": ""}, lambda: ak.stock_zh_a_daily(symbol="all", adjust=""))
             # ak 接口可能返回多表，统一整理
             if isinstance(df_ak, pandas.DataFrame) and not df_ak.empty:
                 df_ak = df_ak.copy()
@@ -98,20 +92,59 @@ def get_daily(trade_date=''):
     except Exception:
         return None
 
-def dump_astock_data(start_date, end_date, skip_exists=True):
+def _fetch_date(trade_date):
+    start = time.perf_counter()
+    data = get_daily(trade_date)
+    return data, time.perf_counter() - start
+
+def dump_astock_data(start_date, end_date, skip_exists=True, max_workers=4):
     trade_date_df = get_trade_cal(start_date, end_date)
+    if not os.path.exists(f"{file_path}/astock_daily/"):
+        os.makedirs(f"{file_path}/astock_daily/")
+
+    todo_dates = []
     for row in trade_date_df.values.tolist():
         trade_date = row[0]
         filename = f'{file_path}/astock_daily/{trade_date}.csv'
-        print(filename)
         if skip_exists and os.path.isfile(filename):
             continue
-        data = get_daily(trade_date)
-        if data is None:
-            continue
-        if data.empty:
-            continue
-        data.to_csv(filename, index=False)
+        todo_dates.append(trade_date)
+    print(f"{len(todo_dates)} trade dates to download")
+
+    # 多个交易日并发拉取，Tushare 调用由 timeout_utils 中共享的令牌桶限速
+    run_start = time.perf_counter()
+    latencies = []
+    row_count = 0
+    failed_dates = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_fetch_date, trade_date): trade_date for trade_date in todo_dates}
+        for future in as_completed(futures):
+            trade_date = futures[future]
+            try:
+                data, latency = future.result()
+            except Exception as e:
+                print(f"[WARN] {trade_date} failed: {e}")
+                failed_dates.append(trade_date)
+                continue
+            latencies.append(latency)
+            if data is None or data.empty:
+                failed_dates.append(trade_date)
+                continue
+            filename = f'{file_path}/astock_daily/{trade_date}.csv'
+            data.to_csv(f'{filename}.tmp', index=False)
+            os.replace(f'{filename}.tmp', filename)
+            row_count += len(data)
+            print(filename)
+
+    elapsed = time.perf_counter() - run_start
+    done_count = len(todo_dates) - len(failed_dates)
+    print(f"[SUMMARY] {done_count}/{len(todo_dates)} dates, {row_count} rows in {elapsed:.1f}s "
+          f"({done_count / elapsed if elapsed > 0 else 0:.2f} dates/s)")
+    if latencies:
+        latency_series = pandas.Series(latencies)
+        print(f"[SUMMARY] latency per date p50={latency_series.quantile(0.5):.2f}s p95={latency_series.quantile(0.95):.2f}s max={latency_series.max():.2f}s")
+    if failed_dates:
+        print(f"[SUMMARY] failed dates: {sorted(failed_dates)}")
 
 if __name__ == '__main__':
     fire.Fire(dump_astock_data)
@@ -1,4 +1,3 @@
-import tushare as ts
 import os
 import datetime
 import pandas
@@ -7,26 +6,23 @@ import time
 from typing import Optional
 
 try:
-    import akshare as ak
-except Exception:
-    ak = None
-
-try:
-    from yahooquery import Ticker as YqTicker
-except Exception:
-    YqTicker = None
-try:
-    from .timeout_utils import get_timeout_seconds, pro_call_with_timeout
+    from .timeout_utils import get_timeout_seconds, pro_call_with_timeout, cached_call, get_pro, lazy_import
 except Exception:
     try:
-        from timeout_utils import get_timeout_seconds, pro_call_with_timeout
+        from timeout_utils import get_timeout_seconds, pro_call_with_timeout, cached_call, get_pro, lazy_import
     except Exception:
         import sys, os
         sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-        from timeout_utils import get_timeout_seconds, pro_call_with_timeout
+        from timeout_utils import get_timeout_seconds, pro_call_with_timeout, cached_call, get_pro, lazy_import
+try:
+    from .db_utils import read_sql
+except Exception:
+    from db_utils import read_sql
 
-ts.set_token(os.environ["TUSHARE"])
-pro=ts.pro_api()
+pro = get_pro()
+# 备用数据源仅在 Tushare 失败时使用，首次调用时才导入
+ak = lazy_import("akshare")
+YqTicker = lazy_import("yahooquery", "Ticker")
 file_path = os.path.dirname(os.path.realpath(__file__))
 
 def get_trade_cal(start_date, end_date):
@@ -55,18 +51,54 @@ def _ts_code_to_ak_index_symbol(ts_code: str) -> str:
     prefix = 'sh' if exch == 'SH' else 'sz'
     return f"{prefix}{code}"
 
+# 本次运行内已下载的完整历史：同一指数、同一数据源只下载一次，各时间片从中切取
+# 跨运行的磁盘缓存由 cached_call 提供（TS_CACHE=0 关闭）
+_history_memo = {}
+
+def _get_ak_history(ak_sym: str) -> Optional[pandas.DataFrame]:
+    key = ("akshare", ak_sym)
+    if key not in _history_memo:
+        df = cached_call("akshare.stock_zh_index_daily", {"symbol": ak_sym}, lambda: ak.stock_zh_index_daily(symbol=ak_sym))
+        if df is not None and not df.empty:
+            if 'date' in df.columns:
+                df = df.rename(columns={'date': 'trade_date'})
+            df['trade_date'] = pandas.to_datetime(df['trade_date']).dt.strftime('%Y%m%d')
+        _history_memo[key] = df
+    return _history_memo[key]
+
+def _to_yahoo_symbol(ts_code: str) -> str:
+    code, exch = ts_code.split('.')
+    y_ex = 'SS' if exch == 'SH' else 'SZ'
+    return f"{code}.{y_ex}"
+
+def _get_yahoo_history(start_date: str, end_date: str) -> Optional[pandas.DataFrame]:
+    """One batched Ticker request for every index of index_list over the whole run range."""
+    key = ("yahoo", start_date, end_date)
+    if key not in _history_memo:
+        y_syms = [_to_yahoo_symbol(ts_code) for ts_code in index_list]
+        start_dt = datetime.datetime.strptime(start_date, '%Y%m%d')
+        end_dt = datetime.datetime.strptime(end_date, '%Y%m%d') + datetime.timedelta(days=1)
+        hist = cached_call("yahoo.history", dict(symbols=y_syms, start=start_dt, end=end_dt, interval='1d'),
+                           lambda: YqTicker(y_syms).history(start=start_dt, end=end_dt, interval='1d'))
+        if hist is not None and len(hist) > 0 and isinstance(hist, pandas.DataFrame):
+            if isinstance(hist.index, pandas.MultiIndex):
+                hist = hist.reset_index()
+            if 'date' in hist.columns:
+                hist = hist.rename(columns={'date': 'trade_date'})
+            hist['trade_date'] = pandas.to_datetime(hist['trade_date']).dt.strftime('%Y%m%d')
+        else:
+            hist = None
+        _history_memo[key] = hist
+    return _history_memo[key]
+
 def _fetch_index_via_ak(ts_code: str, start_date: str, end_date: str) -> Optional[pandas.DataFrame]:
     if ak is None:
         return None
     try:
-        ak_sym = _ts_code_to_ak_index_symbol(ts_code)
-        df = ak.stock_zh_index_daily(symbol=ak_sym)
+        df = _get_ak_history(_ts_code_to_ak_index_symbol(ts_code))
         if df is None or df.empty:
             return None
-        if 'date' in df.columns:
-            df = df.rename(columns={'date': 'trade_date'})
-        df['trade_date'] = pandas.to_datetime(df['trade_date']).dt.strftime('%Y%m%d')
-        df = df[(df['trade_date'] >= start_date) & (df['trade_date'] <= end_date)]
+        df = df[(df['trade_date'] >= start_date) & (df['trade_date'] <= end_date)].copy()
         if df.empty:
             return None
         if 'vol' not in df.columns and 'volume' in df.columns:
@@ -81,26 +113,20 @@ def _fetch_index_via_ak(ts_code: str, start_date: str, end_date: str) -> Optiona
     except Exception:
         return None
 
-def _fetch_index_via_yahoo(ts_code: str, start_date: str, end_date: str) -> Optional[pandas.DataFrame]:
+def _fetch_index_via_yahoo(ts_code: str, start_date: str, end_date: str, batch_range=None) -> Optional[pandas.DataFrame]:
+    """batch_range: (start_date, end_date) of the batched request, defaults to this slice."""
     if YqTicker is None:
         return None
     try:
-        code, exch = ts_code.split('.')
-        y_ex = 'SS' if exch == 'SH' else 'SZ'
-        y_sym = f"{code}.{y_ex}"
-        tk = YqTicker(y_sym)
-        hist = tk.history(start=datetime.datetime.strptime(start_date, '%Y%m%d'),
-                          end=datetime.datetime.strptime(end_date, '%Y%m%d') + datetime.timedelta(days=1),
-                          interval='1d')
-        if hist is None or len(hist) == 0:
+        hist = _get_yahoo_history(*(batch_range or (start_date, end_date)))
+        if hist is None:
+            return None
+        hist = hist[(hist['symbol'] == _to_yahoo_symbol(ts_code))
+                    & (hist['trade_date'] >= start_date) & (hist['trade_date'] <= end_date)].copy()
+        if hist.empty:
             return None
-        if isinstance(hist.index, pandas.MultiIndex):
-            hist = hist.reset_index()
-        if 'date' in hist.columns:
-            hist = hist.rename(columns={'date': 'trade_date'})
         if 'volume' in hist.columns and 'vol' not in hist.columns:
             hist = hist.rename(columns={'volume': 'vol'})
-        hist['trade_date'] = pandas.to_datetime(hist['trade_date']).dt.strftime('%Y%m%d')
         hist['ts_code'] = ts_code
         if 'adjclose' not in hist.columns and 'close' in hist.columns:
             hist['adjclose'] = hist['close']
@@ -111,13 +137,26 @@ def _fetch_index_via_yahoo(ts_code: str, start_date: str, end_date: str) -> Opti
     except Exception:
         return None
 
+def _load_latest_dates() -> dict:
+    """ts_a_stock_eod_price 中各指数已有的最新交易日（YYYYMMDD）；数据库不可用时返回空，输出全部行"""
+    placeholders = ", ".join(["%s"] * len(index_list))
+    try:
+        df = read_sql(f"select symbol, max(tradedate) as tradedate from ts_a_stock_eod_price "
+                      f"where symbol in ({placeholders}) group by symbol", params=index_list)
+    except Exception as e:
+        print("[WARN] Cannot read latest index dates from ts_a_stock_eod_price, writing full range:", e)
+        return {}
+    return {row.symbol: pandas.Timestamp(row.tradedate).strftime('%Y%m%d') for row in df.itertuples() if row.tradedate is not None}
+
 def dump_index_data(start_date=None, end_date=None, skip_exists=True):
     now_dt = datetime.datetime.now()
     if start_date is None:
         start_date = (now_dt - datetime.timedelta(days=14)).strftime('%Y%m%d')
     if end_date is None:
         end_date = now_dt.strftime('%Y%m%d')
-    trade_date_df = get_trade_cal(start_date, end_date)
+    run_start_date, run_end_date = str(start_date), str(end_date)
+    trade_date_df = get_trade_cal(run_start_date, run_end_date)
+    latest_dates = _load_latest_dates()
 
     if not os.path.exists(f"{file_path}/index/"):
         os.makedirs(f"{file_path}/index/")
@@ -125,11 +164,13 @@ def dump_index_data(start_date=None, end_date=None, skip_exists=True):
     for index_name in index_list:
         print(f"Processing {index_name}")
         filename = f'{file_path}/index/{index_name}.csv'
+        # 只请求并输出库中最新交易日之后的数据
+        index_trade_date_df = trade_date_df[trade_date_df["cal_date"] > latest_dates.get(index_name, "")].reset_index(drop=True)
         result_df_list = []
-        for time_slice in range(int(len(trade_date_df)/4000) + 1):
-            start_date = trade_date_df["cal_date"][time_slice * 4000]
-            end_index = min((time_slice+1) * 4000 - 1, len(trade_date_df) - 1)
-            end_date = trade_date_df["cal_date"][end_index]
+        for time_slice in range(int((len(index_trade_date_df) - 1) / 4000) + 1 if len(index_trade_date_df) else 0):
+            start_date = index_trade_date_df["cal_date"][time_slice * 4000]
+            end_index = min((time_slice+1) * 4000 - 1, len(index_trade_date_df) - 1)
+            end_date = index_trade_date_df["cal_date"][end_index]
             try:
                 df = pro_call_with_timeout(
                     pro,
@@ -148,10 +189,14 @@ def dump_index_data(start_date=None, end_date=None, skip_exists=True):
             if df_ak is not None and not df_ak.empty:
                 result_df_list.append(df_ak)
                 continue
-            df_y = _fetch_index_via_yahoo(index_name, start_date, end_date)
+            df_y = _fetch_index_via_yahoo(index_name, start_date, end_date, (run_start_date, run_end_date))
             if df_y is not None and not df_y.empty:
                 result_df_list.append(df_y)
         if len(result_df_list) == 0:
+            # 删除旧文件，避免重复导入
+            if os.path.exists(filename):
+                os.remove(filename)
+            print(f"{index_name}: no new rows")
             continue
         result_df = pandas.concat(result_df_list, ignore_index=True)
         if 'trade_date' not in result_df.columns and 'tradedate' in result_df.columns:
@@ -166,6 +211,8 @@ def dump_index_data(start_date=None, end_date=None, skip_exists=True):
         result_df["volume"] = result_df["vol"]
         result_df["symbol"] = result_df["ts_code"]
         result_df = result_df.drop_duplicates(subset=['tradedate', 'symbol']).sort_values(['tradedate', 'symbol'])
+        result_df = result_df[result_df['tradedate'].astype(str) > latest_dates.get(index_name, "")]
+        print(f"Dump {len(result_df)} new rows to: ", filename)
         result_df.to_csv(filename, index=False)
 
 if __name__ == '__main__':
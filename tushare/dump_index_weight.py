@@ -1,28 +1,26 @@
-import tushare as ts
 import os
-import datetime
 import pandas
 import fire
-import time
-import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Optional
 
 try:
-    import akshare as ak
-except Exception:
-    ak = None
-try:
-    from .timeout_utils import get_timeout_seconds, pro_call_with_timeout
+    from .timeout_utils import get_timeout_seconds, pro_call_with_timeout, cached_call, get_pro, lazy_import
 except Exception:
     try:
-        from timeout_utils import get_timeout_seconds, pro_call_with_timeout
+        from timeout_utils import get_timeout_seconds, pro_call_with_timeout, cached_call, get_pro, lazy_import
     except Exception:
         import sys, os
         sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-        from timeout_utils import get_timeout_seconds, pro_call_with_timeout
+        from timeout_utils import get_timeout_seconds, pro_call_with_timeout, cached_call, get_pro, lazy_import
+try:
+    from .db_utils import read_sql
+except Exception:
+    from db_utils import read_sql
 
-ts.set_token(os.environ["TUSHARE"])
-pro=ts.pro_api()
+pro = get_pro()
+# 备用数据源仅在 Tushare 失败时使用，首次调用时才导入
+ak = lazy_import("akshare")
 file_path = os.path.dirname(os.path.realpath(__file__))
 
 index_list = [
@@ -33,77 +31,173 @@ index_list = [
     '000985.SH', # csiall
     ]
 
-def dump_index_data(start_date=None, end_date=None, skip_exists=True):
+# Tushare index_weight 单次最多返回的行数
+TS_ROW_LIMIT = 6000
+# 数据库中没有记录时，各指数单期成分股数量的估计值
+DEFAULT_CONSTITUENT_COUNT = {
+    '000905.SH': 500,
+    '399300.SZ': 300,
+    '000906.SH': 800,
+    '000852.SH': 1000,
+    '000985.SH': 5500,
+    }
+# 成分股快照可能在月内晚些时候才发布，最近已结束的月份即使已有记录也重新抓取且不读缓存
+RECHECK_CLOSED_MONTHS = 2
+
+def _load_existing(index_name, start_dt):
+    """已入库的成分股记录；数据库不可用时返回 None，按无记录处理"""
+    try:
+        df = read_sql("select stock_code, trade_date from ts_index_weight where index_code = %s and trade_date >= %s",
+                      params=[index_name, start_dt.strftime('%Y-%m-%d')])
+    except Exception as e:
+        print(f"[WARN] Cannot read ts_index_weight for {index_name}, fetching the whole range:", e)
+        return None
+    df['trade_date'] = pandas.to_datetime(df['trade_date'])
+    return df
+
+def _find_gaps(existing_df, start_dt, end_dt, now_dt):
+    """
+    Month ranges without data in ts_index_weight. Weights are published as monthly snapshots,
+    so a month with rows is complete once RECHECK_CLOSED_MONTHS later months have closed;
+    the current month and the last closed months are always fetched again.
+    """
+    done_months = set()
+    if existing_df is not None and not existing_df.empty:
+        done_months = set(existing_df['trade_date'].dt.to_period('M'))
+    recheck_month = pandas.Period(now_dt, 'M') - RECHECK_CLOSED_MONTHS
+    gaps = []
+    for month in pandas.period_range(start_dt, end_dt, freq='M'):
+        if month in done_months and month < recheck_month:
+            continue
+        if gaps and gaps[-1][1] + 1 == month:
+            gaps[-1][1] = month
+        else:
+            gaps.append([month, month])
+    return [(max(first.start_time, start_dt), min(last.end_time.normalize(), end_dt)) for first, last in gaps]
+
+def _split_windows(gaps, rows_per_snapshot):
+    """按行数上限切分缺口：每个窗口预计不超过 TS_ROW_LIMIT 的 80%"""
+    months_per_window = max(1, int(TS_ROW_LIMIT * 0.8) // max(rows_per_snapshot, 1))
+    windows = []
+    for gap_start, gap_end in gaps:
+        window_start = gap_start
+        while window_start <= gap_end:
+            window_end = min((window_start + pandas.DateOffset(months=months_per_window)).normalize() - pandas.Timedelta(days=1), gap_end)
+            windows.append((window_start, window_end))
+            window_start = window_end + pandas.Timedelta(days=1)
+    return windows
+
+def _fetch_via_ak(index_name, trade_date):
+    # akshare 未提供历史权重全量接口，只能获取当期成分及权重
+    if ak is None:
+        return None
+    try:
+        code, exch = index_name.split('.')
+        # 使用 stock_zh_index_weight_csindex 获取中证指数（需要指数代码，如 000905）
+        ak_df = cached_call("akshare.stock_zh_index_weight_csindex", {"symbol": code}, lambda: ak.stock_zh_index_weight_csindex(symbol=code))
+        if ak_df is None or ak_df.empty:
+            return None
+        # 标准化为 ts 字段 superset
+        ak_df = ak_df.rename(columns={
+            '指数代码': 'index_code',
+            '证券代码': 'con_code',
+            '权重(%)': 'weight'
+        })
+        ak_df['index_code'] = index_name
+        # 近似赋值日期为窗口尾日
+        ak_df['trade_date'] = trade_date.strftime('%Y%m%d')
+        return ak_df[['index_code', 'con_code', 'weight', 'trade_date']]
+    except Exception:
+        return None
+
+def fetch_window(index_name, start_dt, end_dt, now_dt):
+    """Fetch one window, splitting it in half while the result hits the Tushare row limit."""
+    df = None
+    # 重新核对的月份不能用缓存中当时缺少晚发布快照的结果
+    recheck_start = (pandas.Period(now_dt, 'M') - RECHECK_CLOSED_MONTHS).start_time
+    try:
+        df = pro_call_with_timeout(
+            pro,
+            'index_weight',
+            get_timeout_seconds(),
+            cache=end_dt < recheck_start,
+            index_code=index_name,
+            start_date=start_dt.strftime('%Y%m%d'),
+            end_date=end_dt.strftime('%Y%m%d')
+        )
+    except Exception as e:
+        print("[WARN] Tushare index_weight failed, will try AKShare fallback:", e)
+    if df is not None and len(df) >= TS_ROW_LIMIT and end_dt > start_dt:
+        middle_dt = start_dt + (end_dt - start_dt) / 2
+        middle_dt = middle_dt.normalize()
+        print(f"[INFO] {index_name} {start_dt.date()} - {end_dt.date()} truncated at {len(df)} rows, splitting")
+        parts = [fetch_window(index_name, start_dt, middle_dt, now_dt),
+                 fetch_window(index_name, middle_dt + pandas.Timedelta(days=1), end_dt, now_dt)]
+        parts = [part for part in parts if part is not None]
+        return pandas.concat(parts, ignore_index=True) if parts else None
+    if (df is None or df.empty) and end_dt >= now_dt.normalize() - pandas.Timedelta(days=31):
+        # AKShare 只有当期权重，仅用于包含最近日期的窗口
+        return _fetch_via_ak(index_name, end_dt)
+    return df
+
+def dump_index_data(start_date=None, end_date=None, skip_exists=True, max_workers=4):
+    """
+    Fetch the index weights missing from ts_index_weight and write only new rows to index_weight/<index>.csv.
+    Windows of all indexes are fetched concurrently, paced by the shared Tushare rate limiter.
+    """
     if not os.path.exists(f"{file_path}/index_weight/"):
         os.makedirs(f"{file_path}/index_weight/")
+    now_dt = pandas.Timestamp.now().normalize()
+    end_dt = min(pandas.Timestamp(str(end_date)), now_dt) if end_date is not None else now_dt
 
+    existing = {}
+    windows = []
     for index_name in index_list:
-        time_step = datetime.timedelta(days=15)
-        now_dt = datetime.datetime.now()
         if start_date is None:
             index_info = pro_call_with_timeout(pro, 'index_basic', get_timeout_seconds(), ts_code=index_name)
-            list_date = index_info["list_date"][0]
-            list_date_obj = datetime.datetime.strptime(list_date, '%Y%m%d')
+            list_date_obj = pandas.Timestamp(index_info["list_date"][0])
             # 动态默认起始：max(上市日, 当前日期-14天)
-            dynamic_start = max(list_date_obj, now_dt - datetime.timedelta(days=14))
-            index_start_date = dynamic_start
+            index_start_date = max(list_date_obj, now_dt - pandas.Timedelta(days=14))
         else:
-            index_start_date = datetime.datetime.strptime(str(start_date), '%Y%m%d')
+            index_start_date = pandas.Timestamp(str(start_date))
+        existing_df = _load_existing(index_name, index_start_date)
+        existing[index_name] = existing_df
+        gaps = _find_gaps(existing_df, index_start_date, end_dt, now_dt)
+        rows_per_snapshot = DEFAULT_CONSTITUENT_COUNT.get(index_name, 1000)
+        if existing_df is not None and not existing_df.empty:
+            rows_per_snapshot = max(existing_df.groupby('trade_date').size().max(), 1)
+        index_windows = _split_windows(gaps, rows_per_snapshot)
+        print(f"{index_name}: {len(gaps)} gaps, {len(index_windows)} windows to fetch")
+        windows += [(index_name, window_start, window_end) for window_start, window_end in index_windows]
 
-        if end_date is None:
-            # 动态默认结束：不超过当前日期
-            index_end_date = min(index_start_date + time_step, now_dt)
-        else:
-            index_end_date = datetime.datetime.strptime(str(end_date), '%Y%m%d')
+    results = {index_name: [] for index_name in index_list}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(fetch_window, index_name, window_start, window_end, now_dt): index_name
+                   for index_name, window_start, window_end in windows}
+        for future in as_completed(futures):
+            df = future.result()
+            if df is not None and not df.empty:
+                results[futures[future]].append(df)
 
+    for index_name in index_list:
         filename = f'{file_path}/index_weight/{index_name}.csv'
-        print("Dump to: ", filename)
-        result_df_list = []
-        while index_end_date <= now_dt:
-            df = None
-            try:
-                df = pro_call_with_timeout(
-                    pro,
-                    'index_weight',
-                    get_timeout_seconds(),
-                    index_code=index_name,
-                    start_date=index_start_date.strftime('%Y%m%d'),
-                    end_date=index_end_date.strftime('%Y%m%d')
-                )
-            except Exception as e:
-                print("[WARN] Tushare index_weight failed, will try AKShare fallback:", e)
-            if (df is None) or df.empty:
-                # AKShare 指数成分（若可用）
-                if ak is not None:
-                    try:
-                        # akshare 未提供历史权重全量接口；尽可能获取当前或近段时间的权重信息
-                        # 这里退化为获取当期成分及权重（若可用），否则跳过
-                        code, exch = index_name.split('.')
-                        # 使用 stock_zh_index_weight_csindex 获取中证指数（需要指数代码，如 000905）
-                        ak_code = code
-                        ak_df = ak.stock_zh_index_weight_csindex(symbol=ak_code)
-                        if ak_df is not None and not ak_df.empty:
-                            # 标准化为 ts 字段 superset
-                            ak_df = ak_df.rename(columns={
-                                '指数代码': 'index_code',
-                                '证券代码': 'con_code',
-                                '权重(%)': 'weight'
-                            })
-                            ak_df['index_code'] = index_name
-                            # 近似赋值日期范围为当前窗口尾日
-                            ak_df['trade_date'] = index_end_date.strftime('%Y%m%d')
-                            result_df_list.append(ak_df[['index_code','con_code','weight','trade_date']])
-                    except Exception:
-                        pass
-            else:
-                result_df_list.append(df)
-            index_start_date += time_step
-            index_end_date += time_step
-            time.sleep(0.5)
-        if len(result_df_list) == 0:
+        result_df = pandas.concat(results[index_name], ignore_index=True) if results[index_name] else None
+        if result_df is not None:
+            result_df["stock_code"] = result_df["con_code"]
+            result_df = result_df.drop_duplicates(["stock_code", "trade_date"], keep="last")
+            existing_df = existing[index_name]
+            if existing_df is not None and not existing_df.empty:
+                # 只写入数据库中没有的记录，减少后续导入的数据量
+                keys = pandas.MultiIndex.from_arrays([existing_df["stock_code"], existing_df["trade_date"]])
+                result_keys = pandas.MultiIndex.from_arrays([result_df["stock_code"], pandas.to_datetime(result_df["trade_date"].astype(str))])
+                result_df = result_df[~result_keys.isin(keys)]
+        if result_df is None or result_df.empty:
+            # 删除旧文件，避免重复导入
+            if os.path.exists(filename):
+                os.remove(filename)
+            print(f"{index_name}: no new rows")
             continue
-        result_df = pandas.concat(result_df_list)
-        result_df["stock_code"] = result_df["con_code"]
+        print(f"Dump {len(result_df)} new rows to: ", filename)
         result_df.to_csv(filename, index=False)
 
 if __name__ == '__main__':
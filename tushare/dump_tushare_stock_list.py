@@ -1,10 +1,7 @@
-import tushare as ts
-import os
 import datetime
 import pandas
-from .timeout_utils import get_timeout_seconds, pro_call_with_timeout
-ts.set_token(os.environ["TUSHARE"])
-pro=ts.pro_api()
+from .timeout_utils import get_timeout_seconds, pro_call_with_timeout, get_pro
+pro = get_pro()
 d_data = pro_call_with_timeout(pro, 'stock_basic', get_timeout_seconds(), list_status="D", fields=["ts_code","symbol","exchange","list_date","delist_date"])
 d_data["delist_date"] = pandas.to_datetime(d_data["delist_date"], format="%Y%m%d")
 d_data["delist_date"] = d_data["delist_date"].dt.strftime("%Y-%m-%d")
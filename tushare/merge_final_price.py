@@ -0,0 +1,151 @@
+import os
+import fire
+import numpy as np
+import pandas
+
+try:
+    from .db_utils import upsert_rows, get_watermark, set_watermarks, get_engine, read_sql
+except Exception:
+    import sys
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from db_utils import upsert_rows, get_watermark, set_watermarks, get_engine, read_sql
+
+PRICE_COLUMNS = ["tradedate", "symbol", "high", "low", "open", "close", "volume", "adjclose", "amount"]
+INDEX_WATERMARK = "final_a_stock_eod_price.index"
+STOCK_WATERMARK = "final_a_stock_eod_price.stock"
+# 用于判断指数数据是否已合并的基准指数（Tushare 代码）
+BENCHMARK_INDEX = "399300.SZ"
+# 超过该数量股票的交易日才视为股票数据已完整合并
+MIN_SYMBOL_COUNT = 1000
+# 指数在 ts_a_stock_eod_price 中的代码格式（上证 000xxx.SH，深证 399xxx.SZ）
+INDEX_SYMBOL_PATTERNS = ["000%.SH", "399%.SZ"]
+
+# 首次运行时由以下查询确定水位，与 regular_update.sql 的逻辑一致
+INDEX_BOOTSTRAP_SQL = """
+select max(tradedate) as tradedate
+FROM final_a_stock_eod_price
+where symbol = "SZ399300"
+"""
+STOCK_BOOTSTRAP_SQL = """
+select max(tradedate) as tradedate
+FROM
+    (select tradedate, count(tradedate) as symbol_count
+    FROM final_a_stock_eod_price
+    where tradedate > "2022-07-01"
+    group by tradedate) tradedate_record
+WHERE symbol_count > 1000
+"""
+
+
+def _to_w_symbol(ts_symbol: pandas.Series) -> pandas.Series:
+    # 000001.SZ -> SZ000001
+    return ts_symbol.str[7:9] + ts_symbol.str[0:6]
+
+
+def _read_ts_price(dbConnection, where_sql, params):
+    sql = f"select {', '.join(PRICE_COLUMNS)} from ts_a_stock_eod_price where {where_sql}"
+    df = read_sql(sql, dbConnection, params=params)
+    df["tradedate"] = pandas.to_datetime(df["tradedate"])
+    return df
+
+
+def _link_new_symbols(dbConnection, ts_df, link_df):
+    """
+    Symbols traded on the latest date without a usable link get adj_ratio = 1, their link_date is the latest date.
+    Returns the link rows to upsert and the full ts history of those symbols.
+    """
+    latest_date = ts_df["tradedate"].max()
+    latest_symbols = set(ts_df.loc[ts_df["tradedate"] == latest_date, "symbol"])
+    new_symbols = sorted(latest_symbols - set(link_df.dropna(subset=["adj_ratio"])["link_symbol"]))
+    if len(new_symbols) == 0:
+        return link_df.iloc[0:0], ts_df.iloc[0:0]
+
+    new_link_df = pandas.DataFrame({"link_symbol": new_symbols})
+    new_link_df["w_symbol"] = _to_w_symbol(new_link_df["link_symbol"])
+    # 已存在但 adj_ratio 为空的记录保留原 link_date
+    new_link_df = new_link_df.merge(link_df[["link_symbol", "link_date"]], on="link_symbol", how="left")
+    new_link_df["link_date"] = new_link_df["link_date"].fillna(latest_date.strftime("%Y-%m-%d"))
+    new_link_df["adj_ratio"] = 1.0
+    print(f"[INFO] {len(new_symbols)} new symbols: {', '.join(new_symbols[:20])}{' ...' if len(new_symbols) > 20 else ''}")
+
+    # 新股票回填全部历史
+    placeholders = ", ".join(["%s"] * len(new_symbols))
+    history_df = _read_ts_price(dbConnection, f"symbol in ({placeholders})", new_symbols)
+    return new_link_df[["w_symbol", "link_symbol", "link_date", "adj_ratio"]], history_df
+
+
+def _to_final_rows(ts_df, link_df):
+    df = ts_df.merge(link_df[["link_symbol", "w_symbol", "adj_ratio"]], left_on="symbol", right_on="link_symbol")
+    df["symbol"] = df["w_symbol"]
+    df["adjclose"] = np.round(df["adjclose"] / df["adj_ratio"], 2)
+    df["tradedate"] = df["tradedate"].dt.strftime("%Y-%m-%d")
+    return df[PRICE_COLUMNS]
+
+
+def _read_new_rows(dbConnection, index_watermark, stock_watermark):
+    """
+    Every row after the stock watermark, plus index rows after the index watermark.
+    Each source is bounded by its own watermark, so a stalled index feed only re-reads a few index rows.
+    """
+    index_sql = " or ".join(["symbol like %s"] * len(INDEX_SYMBOL_PATTERNS))
+    return _read_ts_price(dbConnection, f"tradedate > %s or (tradedate > %s and ({index_sql}))",
+                          [stock_watermark.strftime("%Y-%m-%d"), index_watermark.strftime("%Y-%m-%d")] + INDEX_SYMBOL_PATTERNS)
+
+
+def _next_watermarks(ts_df, final_df, index_watermark, stock_watermark):
+    watermarks = {}
+    index_dates = ts_df.loc[ts_df["symbol"] == BENCHMARK_INDEX, "tradedate"]
+    if len(index_dates) > 0 and index_dates.max() > index_watermark:
+        watermarks[INDEX_WATERMARK] = index_dates.max()
+    final_df = final_df[final_df["tradedate"] > stock_watermark.strftime("%Y-%m-%d")]
+    date_counts = final_df.groupby("tradedate").size()
+    complete_dates = pandas.to_datetime(date_counts.index[date_counts > MIN_SYMBOL_COUNT])
+    if len(complete_dates) > 0 and complete_dates.max() > stock_watermark:
+        watermarks[STOCK_WATERMARK] = complete_dates.max()
+    return watermarks
+
+
+def merge_final_price():
+    """
+    Merge ts_a_stock_eod_price rows newer than the recorded watermarks into final_a_stock_eod_price.
+    Only new source rows are read, so the run time does not grow with the history.
+    Rows are written with INSERT IGNORE like regular_update.sql, existing final rows (e.g. backfilled history) are kept.
+    """
+    sqlEngine = get_engine()
+    index_watermark = get_watermark(sqlEngine, INDEX_WATERMARK, INDEX_BOOTSTRAP_SQL)
+    stock_watermark = get_watermark(sqlEngine, STOCK_WATERMARK, STOCK_BOOTSTRAP_SQL)
+    print(f"[INFO] index watermark {index_watermark.date()}, stock watermark {stock_watermark.date()}")
+
+    dbConnection = sqlEngine.raw_connection()
+    ts_df = _read_new_rows(dbConnection, index_watermark, stock_watermark)
+    if ts_df.empty:
+        print("[INFO] No new rows to merge")
+        dbConnection.close()
+        return
+    link_df = read_sql("select w_symbol, link_symbol, link_date, adj_ratio from ts_link_table", dbConnection)
+    new_link_df, history_df = _link_new_symbols(dbConnection, ts_df, link_df)
+
+    link_df = pandas.concat([link_df.dropna(subset=["adj_ratio"]), new_link_df], ignore_index=True)
+    merge_df = pandas.concat([ts_df, history_df], ignore_index=True).drop_duplicates(["tradedate", "symbol"])
+    final_df = _to_final_rows(merge_df, link_df)
+    watermarks = _next_watermarks(ts_df, final_df, index_watermark, stock_watermark)
+
+    # 链接表与价格在同一个事务内写入，提交后再推进本地水位
+    try:
+        cursor = dbConnection.cursor()
+        upsert_rows(cursor, "ts_link_table", new_link_df)
+        record_num = upsert_rows(cursor, "final_a_stock_eod_price", final_df, ignore=True)
+        cursor.close()
+        dbConnection.commit()
+    except Exception:
+        dbConnection.rollback()
+        raise
+    finally:
+        dbConnection.close()
+    set_watermarks(watermarks)
+    print(f"[SUMMARY] merged {record_num} rows, new watermarks: "
+          f"{ {k: v.strftime('%Y-%m-%d') for k, v in watermarks.items()} }")
+
+
+if __name__ == "__main__":
+    fire.Fire(merge_final_price)
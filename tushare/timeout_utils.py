@@ -1,5 +1,69 @@
+import atexit
+import collections
+import importlib
+import importlib.util
 import os
-from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+import random
+import threading
+import time
+
+try:
+    from .cache_utils import cached_call
+except Exception:
+    from cache_utils import cached_call
+
+
+class LazyObject:
+    """Proxy that creates the wrapped object on first attribute access or call, so imports stay cheap."""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._obj = None
+        self._lock = threading.Lock()
+
+    def _get(self):
+        if self._obj is None:
+            with self._lock:
+                if self._obj is None:
+                    self._obj = self._factory()
+        return self._obj
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self._get()(*args, **kwargs)
+
+
+def lazy_import(module_name: str, attr: str = None):
+    """
+    Lazy replacement of `import module_name` / `from module_name import attr`.
+    Returns None when the package is not installed, like the try/except ImportError it replaces.
+    """
+    if importlib.util.find_spec(module_name) is None:
+        return None
+    if attr is None:
+        return LazyObject(lambda: importlib.import_module(module_name))
+    return LazyObject(lambda: getattr(importlib.import_module(module_name), attr))
+
+
+def _create_pro():
+    # TUSHARE_PRO_FACTORY=module:function 替换 Tushare 客户端，如离线基准测试使用的 benchmark/fake_pro.py
+    factory = os.environ.get("TUSHARE_PRO_FACTORY")
+    if factory:
+        module_name, func_name = factory.split(":")
+        return getattr(importlib.import_module(module_name), func_name)()
+    import tushare as ts
+    ts.set_token(os.environ["TUSHARE"])
+    return ts.pro_api()
+
+
+_pro = LazyObject(_create_pro)
+
+
+def get_pro():
+    """Process wide Tushare client, tushare is imported and the token read on the first API call."""
+    return _pro
 
 
 def get_timeout_seconds() -> int:
@@ -9,17 +73,177 @@ def get_timeout_seconds() -> int:
         return 60
 
 
-def call_with_timeout(func, timeout_sec: int, *args, **kwargs):
-    with ThreadPoolExecutor(max_workers=1) as executor:
-        future = executor.submit(func, *args, **kwargs)
+def get_rate_per_minute() -> int:
+    # Tushare 按积分限制每分钟调用次数，默认按 500 次/分钟
+    try:
+        return int(os.environ.get("TS_RATE_PER_MIN", "500"))
+    except Exception:
+        return 500
+
+
+class TokenBucket:
+    """Thread safe token bucket, refilled continuously at rate_per_minute up to capacity tokens."""
+
+    def __init__(self, rate_per_minute: float, capacity: float = None):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else max(1.0, self.rate_per_second)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0):
+        if self.rate_per_second <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate_per_second)
+                self._updated_at = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait_sec = (tokens - self._tokens) / self.rate_per_second
+            time.sleep(wait_sec)
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name: str = "tushare", rate_per_minute: float = None) -> TokenBucket:
+    """Process wide limiter shared by every caller using the same name."""
+    with _rate_limiters_lock:
+        if name not in _rate_limiters:
+            _rate_limiters[name] = TokenBucket(rate_per_minute if rate_per_minute is not None else get_rate_per_minute())
+        return _rate_limiters[name]
+
+
+def retry_with_backoff(func, *args, retries: int = 3, base_delay: float = 1.0, max_delay: float = 30.0, **kwargs):
+    """Call func, retrying failures with exponential backoff and full jitter."""
+    for attempt in range(retries):
         try:
-            return future.result(timeout=timeout_sec)
-        except FuturesTimeout as e:
-            raise TimeoutError(f"function call timed out after {timeout_sec}s") from e
+            return func(*args, **kwargs)
+        except Exception as e:
+            if attempt == retries - 1:
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+            print(f"[WARN] {getattr(func, '__name__', func)} failed ({e}), retry in {delay:.1f}s")
+            time.sleep(delay)
+
+
+class _CallThread(threading.Thread):
+    """
+    Runs one call on a daemon thread. A call that timed out is abandoned: nothing waits for it,
+    and the interpreter does not join it at exit, so a hung request cannot keep the process alive.
+    """
+
+    def __init__(self, func, args, kwargs):
+        super().__init__(name="timeout_utils", daemon=True)
+        self._func = func
+        self._args = args
+        self._kwargs = kwargs
+        self.result = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.result = self._func(*self._args, **self._kwargs)
+        except BaseException as e:
+            self.error = e
+
+
+class CallMetrics:
+    """Per method call count, error count, timeout count and recent latencies."""
+
+    def __init__(self, max_samples: int = 1000):
+        self._lock = threading.Lock()
+        self._max_samples = max_samples
+        self._stats = {}
+
+    def record(self, name: str, latency_sec: float, status: str = "ok"):
+        with self._lock:
+            stat = self._stats.get(name)
+            if stat is None:
+                stat = {"count": 0, "errors": 0, "timeouts": 0, "latencies": collections.deque(maxlen=self._max_samples)}
+                self._stats[name] = stat
+            stat["count"] += 1
+            if status == "error":
+                stat["errors"] += 1
+            elif status == "timeout":
+                stat["timeouts"] += 1
+            stat["latencies"].append(latency_sec)
+
+    def snapshot(self) -> dict:
+        def _percentile(sorted_values, q):
+            if not sorted_values:
+                return None
+            return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
 
+        with self._lock:
+            result = {}
+            for name, stat in self._stats.items():
+                latencies = sorted(stat["latencies"])
+                result[name] = {
+                    "count": stat["count"],
+                    "errors": stat["errors"],
+                    "timeouts": stat["timeouts"],
+                    "timeout_rate": stat["timeouts"] / stat["count"],
+                    "p50": _percentile(latencies, 0.5),
+                    "p95": _percentile(latencies, 0.95),
+                }
+            return result
+
+    def format(self) -> str:
+        lines = [f"{'method':<24}{'count':>8}{'errors':>8}{'timeouts':>10}{'p50(s)':>10}{'p95(s)':>10}"]
+        for name, stat in sorted(self.snapshot().items()):
+            lines.append(f"{name:<24}{stat['count']:>8}{stat['errors']:>8}{stat['timeouts']:>10}"
+                         f"{stat['p50']:>10.2f}{stat['p95']:>10.2f}")
+        return "\n".join(lines)
+
+
+call_metrics = CallMetrics()
+
+
+def get_call_metrics() -> dict:
+    return call_metrics.snapshot()
+
+
+@atexit.register
+def _print_call_metrics():
+    if os.environ.get("TS_CALL_METRICS", "1") != "0" and call_metrics.snapshot():
+        print("[METRICS] API calls")
+        print(call_metrics.format())
+
+
+def _call(name: str, func, timeout_sec: int, args, kwargs):
+    # 每个调用独占一个线程，超时从调用真正开始时计算，不会在队列中消耗
+    thread = _CallThread(func, args, kwargs)
+    start = time.perf_counter()
+    thread.start()
+    thread.join(timeout_sec)
+    if thread.is_alive():
+        # 不等待卡住的线程，调用方按时返回
+        call_metrics.record(name, time.perf_counter() - start, "timeout")
+        raise TimeoutError(f"{name} call timed out after {timeout_sec}s")
+    if thread.error is not None:
+        call_metrics.record(name, time.perf_counter() - start, "error")
+        raise thread.error
+    call_metrics.record(name, time.perf_counter() - start)
+    return thread.result
+
+
+def call_with_timeout(func, timeout_sec: int, *args, **kwargs):
+    return _call(getattr(func, "__name__", type(func).__name__), func, timeout_sec, args, kwargs)
 
-def pro_call_with_timeout(pro, method_name: str, timeout_sec: int, **kwargs):
-    method = getattr(pro, method_name)
-    return call_with_timeout(method, timeout_sec, **kwargs)
 
+def pro_call_with_timeout(pro, method_name: str, timeout_sec: int, cache: bool = True, **kwargs):
+    def _fetch():
+        method = getattr(pro, method_name)
+        get_rate_limiter("tushare").acquire()
+        return _call(method_name, method, timeout_sec, (), kwargs)
 
+    if not cache:
+        # 需要最新数据（如检测已发布数据的修订）时绕过缓存
+        return _fetch()
+    # 缓存命中时不占用限流额度
+    return cached_call(f"tushare.{method_name}", kwargs, _fetch)
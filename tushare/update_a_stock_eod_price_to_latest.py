@@ -1,33 +1,28 @@
-import tushare as ts
 import os
 import datetime
 import pandas
 import fire
-import time
-from sqlalchemy import create_engine
-import pymysql
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Optional
 
 try:
-    import akshare as ak
-except Exception:
-    ak = None
-try:
-    from yahooquery import Ticker as YqTicker
-except Exception:
-    YqTicker = None
-try:
-    from .timeout_utils import get_timeout_seconds, pro_call_with_timeout
+    from .timeout_utils import get_timeout_seconds, pro_call_with_timeout, retry_with_backoff, get_rate_limiter, cached_call, get_pro, lazy_import
 except Exception:
     try:
-        from timeout_utils import get_timeout_seconds, pro_call_with_timeout
+        from timeout_utils import get_timeout_seconds, pro_call_with_timeout, retry_with_backoff, get_rate_limiter, cached_call, get_pro, lazy_import
     except Exception:
         import sys, os
         sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-        from timeout_utils import get_timeout_seconds, pro_call_with_timeout
+        from timeout_utils import get_timeout_seconds, pro_call_with_timeout, retry_with_backoff, get_rate_limiter, cached_call, get_pro, lazy_import
+try:
+    from .db_utils import bulk_upsert, get_watermark, get_engine, read_sql
+except Exception:
+    from db_utils import bulk_upsert, get_watermark, get_engine, read_sql
 
-ts.set_token(os.environ["TUSHARE"])
-pro=ts.pro_api()
+pro = get_pro()
+# 备用数据源仅在 Tushare 失败时使用，首次调用时才导入
+ak = lazy_import("akshare")
+YqTicker = lazy_import("yahooquery", "Ticker")
 
 def get_trade_cal(start_date, end_date):
     try:
@@ -46,140 +41,225 @@ def get_trade_cal(start_date, end_date):
         cal_df = pandas.DataFrame({"cal_date": rng.strftime('%Y%m%d')})
         return cal_df
 
-def get_daily(trade_date):
-    for _ in range(3):
+KEEP_COLS = ['ts_code','trade_date_x','open','high','low','close','vol','amount','adj_close']
+WATERMARK_SOURCE = "ts_a_stock_eod_price"
+# 超过该数量股票的交易日才视为已完整下载
+MIN_SYMBOL_COUNT = 1000
+
+def _get_env_int(name, default):
+    try:
+        return int(os.environ.get(name, str(default)))
+    except Exception:
+        return default
+
+def _fetch_concurrently(source, items, fetch_one, max_workers):
+    """Run fetch_one over items with at most max_workers requests in flight, returning the non-empty results."""
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(fetch_one, item) for item in items]
+        for done_count, future in enumerate(as_completed(futures), 1):
+            try:
+                result = future.result()
+            except Exception:
+                result = None
+            if result is not None and not result.empty:
+                results.append(result)
+            if done_count % 500 == 0 or done_count == len(futures):
+                print(f"[INFO] {source}: {done_count}/{len(futures)} requests done")
+    return results
+
+def _report_coverage(source, df, ts_codes, trade_dates):
+    covered = 0 if df is None else len(df[['ts_code', 'trade_date_x']].drop_duplicates())
+    expected = max(len(ts_codes) * len(trade_dates), 1)
+    print(f"[INFO] {source} covered {covered}/{expected} symbol days ({covered / expected:.1%})")
+
+def _missing_codes(ts_codes, trade_dates, rows):
+    """Symbols that still miss at least one of trade_dates after the sources tried so far."""
+    if not rows:
+        return list(ts_codes)
+    covered_df = pandas.concat(rows, ignore_index=True)
+    covered_count = covered_df[covered_df['trade_date_x'].isin(trade_dates)].groupby('ts_code')['trade_date_x'].nunique()
+    return [x for x in ts_codes if covered_count.get(x, 0) < len(trade_dates)]
+
+def _get_tushare_daily(trade_date):
+    price_df = pro_call_with_timeout(pro, 'daily', get_timeout_seconds(), trade_date=trade_date)
+    adj_factor = pro_call_with_timeout(pro, 'adj_factor', get_timeout_seconds(), trade_date=trade_date)
+    df = pandas.merge(price_df, adj_factor, on="ts_code", how="inner")
+    df["adj_close"] = df["close"] * df["adj_factor"]
+    return df
+
+def _get_ak_spot_daily(trade_date, ts_codes):
+    """全市场快照：一次请求覆盖所有股票，但只代表当天收盘后的行情"""
+    now_dt = datetime.datetime.now()
+    if trade_date != now_dt.strftime('%Y%m%d') or now_dt.hour < 16:
+        return None
+    def _fetch():
+        get_rate_limiter("akshare", _get_env_int("AK_RATE_PER_MIN", 300)).acquire()
+        return ak.stock_zh_a_spot_em()
+    spot_df = cached_call("akshare.stock_zh_a_spot_em", {"trade_date": trade_date}, _fetch)
+    if spot_df is None or spot_df.empty:
+        return None
+    code_to_ts = {ts_code.split('.')[0]: ts_code for ts_code in ts_codes}
+    df = pandas.DataFrame({
+        'ts_code': spot_df['代码'].astype(str).map(code_to_ts),
+        'trade_date_x': trade_date,
+        'open': spot_df['今开'],
+        'high': spot_df['最高'],
+        'low': spot_df['最低'],
+        'close': spot_df['最新价'],
+        'vol': spot_df['成交量'],
+        'amount': spot_df['成交额'],
+    })
+    df['adj_close'] = df['close']
+    # 停牌股票快照中无成交
+    return df.dropna(subset=['ts_code', 'close'])[KEEP_COLS]
+
+def _get_ak_hist_range(start_date, end_date, ts_code):
+    params = dict(symbol=ts_code.split('.')[0], period="daily", start_date=start_date, end_date=end_date, adjust="")
+    def _fetch():
+        get_rate_limiter("akshare", _get_env_int("AK_RATE_PER_MIN", 300)).acquire()
+        return ak.stock_zh_a_hist(**params)
+    df_hist = cached_call("akshare.stock_zh_a_hist", params, _fetch)
+    if df_hist is None or df_hist.empty:
+        return None
+    # 统一列
+    if '日期' in df_hist.columns:
+        df_hist['trade_date_x'] = pandas.to_datetime(df_hist['日期']).dt.strftime('%Y%m%d')
+    elif 'date' in df_hist.columns:
+        df_hist['trade_date_x'] = pandas.to_datetime(df_hist['date']).dt.strftime('%Y%m%d')
+    else:
+        return None
+    if '开盘' in df_hist.columns:
+        df_hist['open'] = df_hist['开盘']
+    if '收盘' in df_hist.columns:
+        df_hist['close'] = df_hist['收盘']
+    if '最高' in df_hist.columns:
+        df_hist['high'] = df_hist['最高']
+    if '最低' in df_hist.columns:
+        df_hist['low'] = df_hist['最低']
+    if '成交量' in df_hist.columns and 'vol' not in df_hist.columns:
+        df_hist['vol'] = df_hist['成交量']
+    if '成交额' in df_hist.columns and 'amount' not in df_hist.columns:
+        df_hist['amount'] = df_hist['成交额']
+    df_hist['ts_code'] = ts_code
+    df_hist['adj_close'] = df_hist.get('close')
+    return df_hist[KEEP_COLS]
+
+def _ts_to_yahoo_sym(ts_code: str) -> str:
+    code, exch = ts_code.split('.')
+    y_ex = 'SS' if exch == 'SH' else 'SZ'
+    return f"{code}.{y_ex}"
+
+def _get_yahoo_range(start_date, end_date, sub_ts):
+    y_syms = [_ts_to_yahoo_sym(x) for x in sub_ts]
+    y2ts = {y: t for y, t in zip(y_syms, sub_ts)}
+    start_dt = datetime.datetime.strptime(start_date, '%Y%m%d')
+    end_dt = datetime.datetime.strptime(end_date, '%Y%m%d') + datetime.timedelta(days=1)
+    def _fetch():
+        get_rate_limiter("yahoo", _get_env_int("YAHOO_RATE_PER_MIN", 60)).acquire()
+        return YqTicker(y_syms).history(start=start_dt, end=end_dt, interval='1d')
+    hist = cached_call("yahoo.history", dict(symbols=y_syms, start=start_dt, end=end_dt, interval='1d'), _fetch)
+    if hist is None or len(hist) == 0 or not isinstance(hist, pandas.DataFrame):
+        return None
+    if isinstance(hist.index, pandas.MultiIndex):
+        hist = hist.reset_index()
+    # 统一列
+    if 'date' in hist.columns:
+        hist['trade_date_x'] = pandas.to_datetime(hist['date']).dt.strftime('%Y%m%d')
+    elif 'asOfDate' in hist.columns:
+        hist['trade_date_x'] = pandas.to_datetime(hist['asOfDate']).dt.strftime('%Y%m%d')
+    else:
+        return None
+    if 'symbol' not in hist.columns and 'ticker' in hist.columns:
+        hist['symbol'] = hist['ticker']
+    # 字段映射
+    rename_map = {
+        'open': 'open', 'high': 'high', 'low': 'low', 'close': 'close',
+        'volume': 'vol', 'adjclose': 'adj_close'
+    }
+    for c_from, c_to in list(rename_map.items()):
+        if c_from in hist.columns and c_to not in hist.columns:
+            hist[c_to] = hist[c_from]
+    # 映射回 ts_code
+    hist['ts_code'] = hist['symbol'].map(y2ts)
+    hist['amount'] = None
+    return hist.dropna(subset=['ts_code'])[KEEP_COLS]
+
+def _get_fallback_range(trade_dates, ts_codes):
+    """
+    AKShare / Yahoo 回退：每只股票（Yahoo 为每批股票）只请求一次，覆盖整个缺失区间，再在本地按日期拆分
+    """
+    start_date, end_date = min(trade_dates), max(trade_dates)
+    rows = []
+    # 回退: AKShare（质量高于 Yahoo）。单日时优先使用全市场快照，其余股票限速并发逐只拉取
+    if ak is not None:
+        if len(trade_dates) == 1:
+            try:
+                spot_df = _get_ak_spot_daily(trade_dates[0], ts_codes)
+            except Exception as e:
+                print("[WARN] AKShare spot snapshot failed:", e)
+                spot_df = None
+            if spot_df is not None and not spot_df.empty:
+                _report_coverage("akshare spot", spot_df, ts_codes, trade_dates)
+                rows.append(spot_df)
+        missing_codes = _missing_codes(ts_codes, trade_dates, rows)
+        if missing_codes:
+            hist_rows = _fetch_concurrently(
+                "akshare hist", missing_codes, lambda ts_code: _get_ak_hist_range(start_date, end_date, ts_code),
+                _get_env_int("AK_MAX_WORKERS", 8))
+            hist_df = pandas.concat(hist_rows, ignore_index=True) if hist_rows else None
+            if hist_df is not None:
+                hist_df = hist_df[hist_df['trade_date_x'].isin(trade_dates)]
+                rows.append(hist_df)
+            _report_coverage("akshare hist", hist_df, ts_codes, trade_dates)
+
+    # 最后兜底：Yahoo 分批补齐 AKShare 未覆盖的股票，确保不中断
+    missing_codes = _missing_codes(ts_codes, trade_dates, rows)
+    if YqTicker is not None and missing_codes:
+        batch_size = 200
+        batches = [missing_codes[i:i+batch_size] for i in range(0, len(missing_codes), batch_size)]
+        yahoo_rows = _fetch_concurrently(
+            "yahoo", batches, lambda sub_ts: _get_yahoo_range(start_date, end_date, sub_ts),
+            _get_env_int("YAHOO_MAX_WORKERS", 4))
+        yahoo_df = pandas.concat(yahoo_rows, ignore_index=True) if yahoo_rows else None
+        if yahoo_df is not None:
+            yahoo_df = yahoo_df[yahoo_df['trade_date_x'].isin(trade_dates)]
+            rows.append(yahoo_df)
+        _report_coverage("yahoo", yahoo_df, ts_codes, trade_dates)
+
+    if len(rows) == 0:
+        return None
+    # 同一股票同一日期以先拿到的数据源为准（AKShare 优先于 Yahoo）
+    return pandas.concat(rows, ignore_index=True).drop_duplicates(subset=['ts_code', 'trade_date_x'])
+
+def get_daily_range(trade_dates, ts_codes):
+    """
+    Tushare 按日期拉取；失败的日期合并为一个区间，由回退数据源一次性拉取
+    """
+    rows = []
+    failed_dates = []
+    for trade_date in trade_dates:
+        print("Downloading", trade_date)
         try:
-            price_df = pro_call_with_timeout(pro, 'daily', get_timeout_seconds(), trade_date=trade_date)
-            adj_factor = pro_call_with_timeout(pro, 'adj_factor', get_timeout_seconds(), trade_date=trade_date)
-            df = pandas.merge(price_df, adj_factor, on="ts_code", how="inner")
-            df["adj_close"] = df["close"] * df["adj_factor"]
-            return df
+            rows.append(retry_with_backoff(_get_tushare_daily, trade_date))
         except Exception as e:
             print(e)
-            time.sleep(1)
-    # 回退: AKShare（质量高于 Yahoo）。按 ts_code 列表逐只拉取，保持列名契合后续 rename 映射
-    try:
-        if ak is not None:
-            sqlEngine_local = create_engine('mysql+pymysql://root:@127.0.0.1/investment_data', pool_recycle=3600)
-            dbConn_local = sqlEngine_local.raw_connection()
-            ts_list_df = pandas.read_sql("select ts_code from ts_a_stock_list", dbConn_local)
-            dbConn_local.close()
-            sqlEngine_local.dispose()
-
-            def _ts_to_ak_sym(ts_code: str) -> str:
-                code, exch = ts_code.split('.')
-                prefix = 'sh' if exch == 'SH' else 'sz'
-                return f"{prefix}{code}"
-
-            rows = []
-            for ts_code in ts_list_df['ts_code'].tolist():
-                try:
-                    ak_sym = _ts_to_ak_sym(ts_code)
-                    df_hist = ak.stock_zh_a_hist(symbol=ak_sym, period="daily", start_date=trade_date, end_date=trade_date, adjust="")
-                    if df_hist is None or df_hist.empty:
-                        continue
-                    # 统一列
-                    if '日期' in df_hist.columns:
-                        df_hist['trade_date_x'] = pandas.to_datetime(df_hist['日期']).dt.strftime('%Y%m%d')
-                    elif 'date' in df_hist.columns:
-                        df_hist['trade_date_x'] = pandas.to_datetime(df_hist['date']).dt.strftime('%Y%m%d')
-                    else:
-                        continue
-                    if '开盘' in df_hist.columns:
-                        df_hist['open'] = df_hist['开盘']
-                    if '收盘' in df_hist.columns:
-                        df_hist['close'] = df_hist['收盘']
-                    if '最高' in df_hist.columns:
-                        df_hist['high'] = df_hist['最高']
-                    if '最低' in df_hist.columns:
-                        df_hist['low'] = df_hist['最低']
-                    if '成交量' in df_hist.columns and 'vol' not in df_hist.columns:
-                        df_hist['vol'] = df_hist['成交量']
-                    if '成交额' in df_hist.columns and 'amount' not in df_hist.columns:
-                        df_hist['amount'] = df_hist['成交额']
-                    df_hist['ts_code'] = ts_code
-                    df_hist['adj_close'] = df_hist.get('close')
-                    keep_cols = ['ts_code','trade_date_x','open','high','low','close','vol','amount','adj_close']
-                    row = df_hist[keep_cols].iloc[[0]]
-                    rows.append(row)
-                except Exception:
-                    continue
-            if len(rows) > 0:
-                return pandas.concat(rows, ignore_index=True)
-    except Exception:
-        pass
-    # 最后兜底：Yahoo 全量补齐（逐只股票，仅当 AKShare 不可用时），确保不中断
-    try:
-        if YqTicker is not None:
-            sqlEngine_local = create_engine('mysql+pymysql://root:@127.0.0.1/investment_data', pool_recycle=3600)
-            dbConn_local = sqlEngine_local.raw_connection()
-            ts_list_df = pandas.read_sql("select ts_code from ts_a_stock_list", dbConn_local)
-            dbConn_local.close()
-            sqlEngine_local.dispose()
-
-            def _ts_to_yahoo_sym(ts_code: str) -> str:
-                code, exch = ts_code.split('.')
-                y_ex = 'SS' if exch == 'SH' else 'SZ'
-                return f"{code}.{y_ex}"
-
-            # 分批请求，降低失败风险
-            ts_list = ts_list_df['ts_code'].tolist()
-            batch_size = 200
-            rows = []
-            for i in range(0, len(ts_list), batch_size):
-                sub_ts = ts_list[i:i+batch_size]
-                y_syms = [_ts_to_yahoo_sym(x) for x in sub_ts]
-                y2ts = {y: t for y, t in zip(y_syms, sub_ts)}
-                try:
-                    tk = YqTicker(y_syms)
-                    start_dt = datetime.datetime.strptime(trade_date, '%Y%m%d')
-                    end_dt = start_dt + datetime.timedelta(days=1)
-                    hist = tk.history(start=start_dt, end=end_dt, interval='1d')
-                    if hist is None or len(hist) == 0:
-                        continue
-                    if isinstance(hist.index, pandas.MultiIndex):
-                        hist = hist.reset_index()
-                    # 统一列
-                    if 'date' in hist.columns:
-                        hist['trade_date_x'] = pandas.to_datetime(hist['date']).dt.strftime('%Y%m%d')
-                    elif 'asOfDate' in hist.columns:
-                        hist['trade_date_x'] = pandas.to_datetime(hist['asOfDate']).dt.strftime('%Y%m%d')
-                    else:
-                        continue
-                    if 'symbol' not in hist.columns and 'ticker' in hist.columns:
-                        hist['symbol'] = hist['ticker']
-                    # 过滤当日
-                    hist = hist[hist['trade_date_x'] == trade_date]
-                    if hist.empty:
-                        continue
-                    # 字段映射
-                    rename_map = {
-                        'open': 'open', 'high': 'high', 'low': 'low', 'close': 'close',
-                        'volume': 'vol', 'adjclose': 'adj_close'
-                    }
-                    for c_from, c_to in list(rename_map.items()):
-                        if c_from in hist.columns and c_to not in hist.columns:
-                            hist[c_to] = hist[c_from]
-                    # 映射回 ts_code
-                    hist['ts_code'] = hist['symbol'].map(y2ts)
-                    hist['amount'] = None
-                    keep_cols = ['ts_code','trade_date_x','open','high','low','close','vol','amount','adj_close']
-                    sub_rows = hist.dropna(subset=['ts_code'])[keep_cols]
-                    if not sub_rows.empty:
-                        rows.append(sub_rows)
-                except Exception:
-                    continue
-            if len(rows) > 0:
-                return pandas.concat(rows, ignore_index=True)
-    except Exception:
-        pass
-    # 若所有来源均失败：返回 None（不中断主流程，跳过该日）
-    return None
+            failed_dates.append(trade_date)
+    if failed_dates:
+        rows.append(_get_fallback_range(failed_dates, ts_codes))
+    rows = [df for df in rows if df is not None and not df.empty]
+    if len(rows) == 0:
+        # 若所有来源均失败：返回 None（不中断主流程，跳过这些日期）
+        return None
+    return pandas.concat(rows, ignore_index=True)
+
+def get_daily(trade_date, ts_codes):
+    return get_daily_range([trade_date], ts_codes)
 
 def dump_astock_data():
-    sqlEngine = create_engine('mysql+pymysql://root:@127.0.0.1/investment_data', pool_recycle=3600)
-    dbConnection = sqlEngine.raw_connection()
+    sqlEngine = get_engine()
 
+    # 最后一个完整交易日记录在本地水位文件中，仅首次运行时扫描全表
     sql = """
     select max(tradedate) as tradedate
         FROM
@@ -189,36 +269,40 @@ def dump_astock_data():
         group by tradedate) tradedate_record
     WHERE symbol_count > 1000
     """
-    latest_trade_date = pandas.read_sql(sql, dbConnection)["tradedate"][0].strftime('%Y%m%d')
+    latest_trade_date = get_watermark(sqlEngine, WATERMARK_SOURCE, sql).strftime('%Y%m%d')
+    # 股票列表只加载一次，供所有回退数据源复用
+    ts_codes = read_sql("select ts_code from ts_a_stock_list")["ts_code"].tolist()
     end_date = datetime.datetime.now().strftime('%Y%m%d')
 
     trade_date_df = get_trade_cal(latest_trade_date, end_date)
     # Sort from small to big, so that we process earlier date first
     trade_date_df = trade_date_df.sort_values("cal_date")
-    for row in trade_date_df.values.tolist():
-        trade_date = row[0]
-        if trade_date == latest_trade_date:
-            continue
-        print("Downloading", trade_date)
-        ts_data = get_daily(trade_date)
-        if ts_data is None:
-            continue
-        if ts_data.empty:
-            continue
-        column_mapping = {
-            "trade_date_x": "tradedate",
-            "high": "high",
-            "low": "low",
-            "open": "open",
-            "close": "close",
-            "adj_close": "adjclose",
-            "vol": "volume",
-            "amount": "amount",
-            "ts_code": "symbol"
-        }
-        data = ts_data.rename(columns=column_mapping)[list(column_mapping.values())]      
-        record_num = data.to_sql("ts_a_stock_eod_price", sqlEngine, if_exists='append', index=False)
-        print(f"{trade_date} Updated: {record_num} records")
+    trade_dates = [row[0] for row in trade_date_df.values.tolist() if row[0] != latest_trade_date]
+    if len(trade_dates) == 0:
+        return
+    ts_data = get_daily_range(trade_dates, ts_codes)
+    if ts_data is None or ts_data.empty:
+        return
+    column_mapping = {
+        "trade_date_x": "tradedate",
+        "high": "high",
+        "low": "low",
+        "open": "open",
+        "close": "close",
+        "adj_close": "adjclose",
+        "vol": "volume",
+        "amount": "amount",
+        "ts_code": "symbol"
+    }
+    data = ts_data.rename(columns=column_mapping)[list(column_mapping.values())]
+    date_counts = data.groupby("tradedate").size()
+    for trade_date, count in date_counts.items():
+        print(f"{trade_date}: {count} records")
+    complete_dates = date_counts.index[date_counts > MIN_SYMBOL_COUNT]
+    watermarks = {WATERMARK_SOURCE: max(complete_dates)} if len(complete_dates) > 0 else None
+    # 所有缺失日期在一个事务内批量写入，重复运行不会因主键冲突失败
+    record_num = bulk_upsert(sqlEngine, "ts_a_stock_eod_price", data, watermarks=watermarks)
+    print(f"{trade_dates[0]} - {trade_dates[-1]} Updated: {record_num} records")
 
 if __name__ == '__main__':
     fire.Fire(dump_astock_data)
@@ -0,0 +1,234 @@
+import os
+import fire
+import numpy as np
+import pandas
+
+try:
+    from .db_utils import upsert_rows, get_watermark, set_watermark, get_connection, read_sql
+except Exception:
+    import sys
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from db_utils import upsert_rows, get_watermark, set_watermark, get_connection, read_sql
+
+LIMIT_TABLE = "final_a_stock_limit"
+LIMIT_COLUMNS = ["tradedate", "symbol", "pre_close", "up_limit", "down_limit"]
+WATERMARK_SOURCE = "final_a_stock_limit"
+# ST 状态来源（baostock 日线信息，symbol 形如 sh.600000 或 SH600000）
+ST_TABLE = "bao_a_stock_eod_info"
+ST_COLUMN = "isST"
+# 涨跌停制度自 1996-12-16 起实施
+LIMIT_START_DATE = pandas.Timestamp("1996-12-16")
+# 创业板注册制改革后涨跌幅调整为 20%
+CHINEXT_REFORM_DATE = pandas.Timestamp("2020-08-24")
+# 增量更新时向前读取的天数；停牌超过该天数的股票另取窗口前最后一行的收盘价与 ST 状态
+LOOKBACK_DAYS = 60
+# 最高价超过涨停价不足该比例时视为精度问题，以最高价作为涨停价；超过则视为当日无涨跌幅限制
+PRECISION_TOLERANCE = 0.01
+MIN_SYMBOL_COUNT = 1000
+
+BOOTSTRAP_SQL = f"select max(tradedate) as tradedate from {LIMIT_TABLE}"
+
+
+def _round_price(values: np.ndarray) -> np.ndarray:
+    # 交易所按四舍五入保留两位小数，加上极小值避免 x.xx5 的浮点误差
+    return np.floor(values * 100 + 0.5 + 1e-6) / 100
+
+
+def limit_ratios(symbol: pandas.Series, tradedate: pandas.Series, is_st: np.ndarray) -> np.ndarray:
+    """
+    Daily price limit ratio by board: BJ 30%, STAR 20%, ChiNext 20% after 2020-08-24,
+    otherwise 5% for ST stocks and 10% for the rest. NaN for index symbols.
+    """
+    exchange = symbol.str[:2].to_numpy()
+    code = symbol.str[2:5].to_numpy()
+    is_index = ((exchange == "SH") & (code == "000")) | ((exchange == "SZ") & (code == "399"))
+    is_star = (exchange == "SH") & ((code == "688") | (code == "689"))
+    is_chinext = (exchange == "SZ") & ((code == "300") | (code == "301")) & (tradedate >= CHINEXT_REFORM_DATE).to_numpy()
+    ratio = np.where(is_st, 0.05, 0.10)
+    ratio = np.where(is_star | is_chinext, 0.20, ratio)
+    ratio = np.where(exchange == "BJ", 0.30, ratio)
+    return np.where(is_index, np.nan, ratio)
+
+
+def compute_limits(price_df: pandas.DataFrame, st_df: pandas.DataFrame, since=None):
+    """
+    price_df: tradedate, symbol, high, close of complete symbol histories, or with a lookback before since.
+    st_df: tradedate, symbol, is_st.
+    Returns the limit rows after since, and the validation counts of the same pass.
+    """
+    df = price_df.sort_values(["symbol", "tradedate"], kind="stable").reset_index(drop=True)
+    symbol = df["symbol"].to_numpy()
+    close = df["close"].to_numpy(dtype=float)
+    # lag(close) over (partition by symbol order by tradedate)
+    pre_close = np.empty(len(df))
+    pre_close[:1] = np.nan
+    pre_close[1:] = np.where(symbol[1:] == symbol[:-1], close[:-1], np.nan)
+    df["pre_close"] = pre_close
+
+    # 最近一次已知的 ST 状态，缺失视为非 ST
+    if st_df is not None and not st_df.empty:
+        st_df = st_df.astype({"tradedate": df["tradedate"].dtype, "symbol": df["symbol"].dtype})
+        df = pandas.merge_asof(df.sort_values("tradedate", kind="stable"), st_df.sort_values("tradedate"),
+                               on="tradedate", by="symbol", direction="backward")
+        df = df.sort_values(["symbol", "tradedate"], kind="stable").reset_index(drop=True)
+        is_st = df["is_st"].fillna(0).to_numpy(dtype=float) > 0
+    else:
+        is_st = np.zeros(len(df), dtype=bool)
+
+    ratio = limit_ratios(df["symbol"], df["tradedate"], is_st)
+    pre_close = df["pre_close"].to_numpy()
+    high = df["high"].to_numpy(dtype=float)
+    up_limit = _round_price(pre_close * (1 + ratio))
+    down_limit = _round_price(pre_close * (1 - ratio))
+
+    # 精度修正：最高价略高于涨停价时以最高价为准，超过 1% 的视为当日无涨跌幅限制（如新股上市首日）
+    with np.errstate(invalid="ignore", divide="ignore"):
+        above = high > up_limit
+        diff = high / up_limit - 1
+    in_range = (df["tradedate"] >= LIMIT_START_DATE).to_numpy()
+    if since is not None:
+        in_range = in_range & (df["tradedate"] > since).to_numpy()
+    fix = above & (diff < PRECISION_TOLERANCE) & in_range
+    no_limit = above & ~fix & in_range
+    up_limit = np.where(fix, high, up_limit)
+
+    valid = ~np.isnan(ratio) & ~np.isnan(pre_close) & ~no_limit & in_range
+    result_df = pandas.DataFrame({
+        "tradedate": df["tradedate"],
+        "symbol": df["symbol"],
+        "pre_close": pre_close,
+        "up_limit": up_limit,
+        "down_limit": down_limit,
+    })[valid]
+    stats = {
+        "rows": int(valid.sum()),
+        "precision_fixed": int(fix.sum()),
+        "removed_no_limit": int(no_limit.sum()),
+        # high <= up_limit，修正后必须为 0
+        "high_above_up_limit": int((high[valid] > up_limit[valid]).sum()),
+        # high >= up_limit，即当日触及涨停
+        "limit_up_days": int((high[valid] >= up_limit[valid]).sum()),
+    }
+    return result_df, stats
+
+
+def _read_prices(dbConnection, where_sql, params):
+    df = read_sql(f"select tradedate, symbol, high, close from final_a_stock_eod_price where {where_sql}", dbConnection, params=params)
+    df["tradedate"] = pandas.to_datetime(df["tradedate"])
+    return df
+
+
+def _read_st(dbConnection, where_sql, params):
+    # 读取失败时直接报错，不能把所有股票当作非 ST 写入 10% 的涨跌停价
+    df = read_sql(f"select tradedate, symbol, {ST_COLUMN} as is_st from {ST_TABLE} where {where_sql}", dbConnection, params=params)
+    return _normalize_st(df)
+
+
+def _normalize_st(df):
+    df["tradedate"] = pandas.to_datetime(df["tradedate"])
+    # sh.600000 -> SH600000
+    df["symbol"] = df["symbol"].str.upper().str.replace(".", "", regex=False)
+    df["is_st"] = pandas.to_numeric(df["is_st"], errors="coerce")
+    return df
+
+
+def _last_row_sql(table, columns):
+    """Each symbol's last row on or before a date, for symbols suspended through the whole lookback."""
+    return (f"select t.tradedate, t.symbol, {columns} from {table} t "
+            f"join (select symbol, max(tradedate) as tradedate from {table} where tradedate <= %s group by symbol) l "
+            f"on t.symbol = l.symbol and t.tradedate = l.tradedate")
+
+
+def _read_lookback(dbConnection, lookback):
+    """Prices and ST status after lookback, plus the last known row of every symbol before it."""
+    price_df = pandas.concat([
+        read_sql(_last_row_sql("final_a_stock_eod_price", "t.high, t.close"), dbConnection, params=[lookback]),
+        read_sql("select tradedate, symbol, high, close from final_a_stock_eod_price where tradedate > %s",
+                 dbConnection, params=[lookback]),
+    ], ignore_index=True)
+    price_df["tradedate"] = pandas.to_datetime(price_df["tradedate"])
+    st_df = _normalize_st(pandas.concat([
+        read_sql(_last_row_sql(ST_TABLE, f"t.{ST_COLUMN} as is_st"), dbConnection, params=[lookback]),
+        read_sql(f"select tradedate, symbol, {ST_COLUMN} as is_st from {ST_TABLE} where tradedate > %s",
+                 dbConnection, params=[lookback]),
+    ], ignore_index=True))
+    return price_df, st_df
+
+
+def _print_validation(stats, result_df=None):
+    print(f"[VALIDATION] {stats}")
+    if stats["high_above_up_limit"] > 0:
+        print(f"[WARN] {stats['high_above_up_limit']} rows with high > up_limit")
+    if result_df is None:
+        return
+    # 每日记录数 > 1000
+    date_counts = result_df.groupby("tradedate").size()
+    low_dates = date_counts.index[date_counts <= MIN_SYMBOL_COUNT]
+    if len(low_dates) > 0:
+        print(f"[WARN] {len(low_dates)} dates with <= {MIN_SYMBOL_COUNT} symbols: "
+              f"{', '.join(d.strftime('%Y-%m-%d') for d in low_dates[:10])}")
+
+
+def _write(dbConnection, result_df, watermark=None):
+    """Limit rows in one transaction, then the watermark once they are committed."""
+    try:
+        cursor = dbConnection.cursor()
+        record_num = 0
+        if result_df is not None and not result_df.empty:
+            rows = result_df.assign(tradedate=result_df["tradedate"].dt.strftime("%Y-%m-%d"))[LIMIT_COLUMNS]
+            # 已有的行（如直接导入的 Tushare 涨跌停数据）优先，不被计算结果覆盖
+            record_num = upsert_rows(cursor, LIMIT_TABLE, rows, ignore=True)
+        cursor.close()
+        dbConnection.commit()
+    except Exception:
+        dbConnection.rollback()
+        raise
+    if watermark is not None:
+        set_watermark(WATERMARK_SOURCE, watermark)
+    return record_num
+
+
+def update_final_stock_limit(full=False, shard_size=500):
+    """
+    Compute pre_close, up_limit and down_limit of final_a_stock_limit from final_a_stock_eod_price.
+    Daily runs only compute the dates after the watermark; --full recomputes the history in symbol shards.
+    Rows already in final_a_stock_limit, e.g. imported from Tushare, are kept: --full only fills the missing
+    rows, delete the computed rows first to recompute them.
+    The high <= up_limit validation is counted in the same pass.
+    """
+    dbConnection = get_connection()
+    try:
+        if full:
+            symbols = read_sql("select distinct symbol from final_a_stock_eod_price order by symbol", dbConnection)["symbol"].tolist()
+            total = {}
+            for i in range(0, len(symbols), shard_size):
+                shard = symbols[i:i + shard_size]
+                placeholders = ", ".join(["%s"] * len(shard))
+                result_df, stats = compute_limits(_read_prices(dbConnection, f"symbol in ({placeholders})", shard),
+                                                  _read_st(dbConnection, f"upper(replace(symbol, '.', '')) in ({placeholders})", shard))
+                record_num = _write(dbConnection, result_df)
+                total = {k: total.get(k, 0) + v for k, v in stats.items()}
+                print(f"[INFO] {i + len(shard)} of {len(symbols)} symbols, {record_num} rows")
+            latest = read_sql("select max(tradedate) as tradedate from final_a_stock_eod_price", dbConnection)["tradedate"][0]
+            _write(dbConnection, None, pandas.Timestamp(latest))
+            _print_validation(total)
+            return
+
+        watermark = get_watermark(None, WATERMARK_SOURCE, BOOTSTRAP_SQL)
+        if watermark is None:
+            raise ValueError(f"{LIMIT_TABLE} is empty, run with --full first")
+        lookback = (watermark - pandas.Timedelta(days=LOOKBACK_DAYS)).strftime("%Y-%m-%d")
+        price_df, st_df = _read_lookback(dbConnection, lookback)
+        if price_df.empty or price_df["tradedate"].max() <= watermark:
+            print(f"[INFO] {LIMIT_TABLE} is up to date at {watermark.date()}")
+            return
+        result_df, stats = compute_limits(price_df, st_df, watermark)
+        _print_validation(stats, result_df)
+        record_num = _write(dbConnection, result_df, price_df["tradedate"].max())
+        print(f"[SUMMARY] {record_num} limit rows after {watermark.date()}")
+    finally:
+        dbConnection.close()
+
+
+if __name__ == "__main__":
+    fire.Fire(update_final_stock_limit)
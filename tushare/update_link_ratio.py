@@ -0,0 +1,157 @@
+import os
+import fire
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas
+
+try:
+    from .timeout_utils import get_timeout_seconds, pro_call_with_timeout, get_pro
+except Exception:
+    import sys
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from timeout_utils import get_timeout_seconds, pro_call_with_timeout, get_pro
+try:
+    from .db_utils import upsert_rows, get_watermark, get_connection, read_sql
+    from .merge_final_price import PRICE_COLUMNS, STOCK_WATERMARK, STOCK_BOOTSTRAP_SQL
+except Exception:
+    from db_utils import upsert_rows, get_watermark, get_connection, read_sql
+    from merge_final_price import PRICE_COLUMNS, STOCK_WATERMARK, STOCK_BOOTSTRAP_SQL
+
+pro = get_pro()
+
+# 已入库的复权因子（adjclose / close）与 Tushare 最新值的相对差超过该值时视为复权因子被重算
+FACTOR_TOLERANCE = 1e-4
+# 单日被判定为重算的股票超过该数量时多半是数据源异常，不自动改写，可用 --symbols 手动指定
+MAX_RELINK_SYMBOLS = 200
+LINK_COLUMNS = ["w_symbol", "link_symbol", "link_date", "adj_ratio"]
+
+
+def _placeholders(values):
+    return ", ".join(["%s"] * len(values))
+
+
+def find_rebased_symbols(dbConnection, check_date: pandas.Timestamp) -> list:
+    """
+    Compare the adj_factor stored on check_date (adjclose / close of ts_a_stock_eod_price)
+    with the one Tushare returns today; symbols whose factor changed had their history rebased.
+    Rows from the AKShare / Yahoo fallbacks store adjclose = close instead of a Tushare factor and are skipped.
+    """
+    stored_df = read_sql("select symbol, close, adjclose from ts_a_stock_eod_price where tradedate = %s",
+                         dbConnection, params=[check_date.strftime("%Y-%m-%d")])
+    factor_df = pro_call_with_timeout(pro, 'adj_factor', get_timeout_seconds(), cache=False,
+                                      trade_date=check_date.strftime("%Y%m%d"))
+    if factor_df is None or factor_df.empty or stored_df.empty:
+        print(f"[WARN] No adj_factor to compare on {check_date.date()}")
+        return []
+    df = stored_df.merge(factor_df[["ts_code", "adj_factor"]], left_on="symbol", right_on="ts_code")
+    df = df[(df["close"] > 0) & (df["adjclose"] != df["close"])]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        diff = np.abs(df["adj_factor"].to_numpy(float) / (df["adjclose"].to_numpy(float) / df["close"].to_numpy(float)) - 1)
+    symbols = sorted(df.loc[diff > FACTOR_TOLERANCE, "symbol"])
+    if len(symbols) > MAX_RELINK_SYMBOLS:
+        raise ValueError(f"{len(symbols)} symbols with a changed adj_factor on {check_date.date()}, over {MAX_RELINK_SYMBOLS}; "
+                         f"check the source data or relink with --symbols")
+    return symbols
+
+
+def _fetch_factor_history(ts_codes, max_workers=4) -> pandas.DataFrame:
+    # 并发请求，限流由 pro_call_with_timeout 共享的令牌桶保证
+    def _fetch(ts_code):
+        return pro_call_with_timeout(pro, 'adj_factor', get_timeout_seconds(), cache=False, ts_code=ts_code)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        frames = [df[["ts_code", "trade_date", "adj_factor"]] for df in executor.map(_fetch, ts_codes)
+                  if df is not None and not df.empty]
+    if len(frames) == 0:
+        return pandas.DataFrame(columns=["symbol", "tradedate", "adj_factor"])
+    df = pandas.concat(frames, ignore_index=True).rename(columns={"ts_code": "symbol", "trade_date": "tradedate"})
+    df["tradedate"] = pandas.to_datetime(df["tradedate"])
+    return df
+
+
+def relink_symbols(ts_df, factor_df, link_df, final_df):
+    """
+    ts_df: ts_a_stock_eod_price rows of the rebased symbols, factor_df: their new adj_factor history,
+    link_df: their ts_link_table rows, final_df: their final_a_stock_eod_price rows.
+    Returns the rewritten ts rows, link rows and final rows:
+      adjclose            = close * new adj_factor
+      adj_ratio_new       = adj_ratio * new_adj_factor(link_date) / old_adj_factor(link_date)
+      final adjclose      = round(new ts adjclose / adj_ratio_new, 2) from link_date on
+    """
+    ts_df = ts_df.merge(factor_df, on=["symbol", "tradedate"], how="left")
+    old_factor = ts_df["adjclose"] / ts_df["close"]
+    # 缺少新因子的日期按该股票新旧因子的比例缩放
+    scale = (ts_df["adj_factor"] / old_factor).groupby(ts_df["symbol"]).transform("median")
+    new_factor = ts_df["adj_factor"].fillna(old_factor * scale)
+    ts_df["adjclose"] = ts_df["close"] * new_factor
+    ts_df["old_factor"] = old_factor
+    ts_df["new_factor"] = new_factor
+
+    # 以 (symbol, link_date) 为索引查找链接日的新旧因子
+    factor_index = ts_df.set_index(["symbol", "tradedate"])[["old_factor", "new_factor"]]
+    link_keys = pandas.MultiIndex.from_arrays([link_df["link_symbol"], pandas.to_datetime(link_df["link_date"])])
+    link_factors = factor_index.reindex(link_keys)
+    symbol_scale = scale.groupby(ts_df["symbol"]).first().reindex(link_df["link_symbol"]).to_numpy()
+    link_scale = (link_factors["new_factor"] / link_factors["old_factor"]).to_numpy()
+    link_scale = np.where(np.isnan(link_scale), symbol_scale, link_scale)
+    link_df = link_df.assign(adj_ratio=link_df["adj_ratio"].to_numpy(float) * link_scale).dropna(subset=["adj_ratio"])
+
+    final_df = final_df.merge(link_df[["w_symbol", "link_symbol", "link_date", "adj_ratio"]], left_on="symbol", right_on="w_symbol")
+    final_df = final_df[final_df["tradedate"] >= pandas.to_datetime(final_df["link_date"])]
+    final_df = final_df.merge(ts_df[["symbol", "tradedate", "adjclose"]].rename(columns={"symbol": "link_symbol", "adjclose": "ts_adjclose"}),
+                              on=["link_symbol", "tradedate"])
+    final_df["adjclose"] = np.round(final_df["ts_adjclose"] / final_df["adj_ratio"], 2)
+    return ts_df[PRICE_COLUMNS], link_df[LINK_COLUMNS], final_df[PRICE_COLUMNS]
+
+
+def update_link_ratio(check_date=None, symbols=None, max_workers=4):
+    """
+    Detect Tushare adj_factor rebases on check_date (default: the last merged date of final_a_stock_eod_price)
+    and rewrite adjclose and adj_ratio of the affected symbols only, in one transaction.
+    --symbols=000001.SZ,600000.SH relinks the given symbols without detection.
+    """
+    dbConnection = get_connection()
+    try:
+        if symbols is None:
+            check_date = pandas.Timestamp(str(check_date)) if check_date is not None else get_watermark(None, STOCK_WATERMARK, STOCK_BOOTSTRAP_SQL)
+            symbols = find_rebased_symbols(dbConnection, check_date)
+            print(f"[INFO] {len(symbols)} symbols with a rebased adj_factor on {check_date.date()}")
+        elif isinstance(symbols, str):
+            symbols = symbols.split(",")
+        symbols = list(symbols)
+        if len(symbols) == 0:
+            return
+
+        ts_df = read_sql(f"select {', '.join(PRICE_COLUMNS)} from ts_a_stock_eod_price where symbol in ({_placeholders(symbols)})",
+                         dbConnection, params=symbols)
+        ts_df["tradedate"] = pandas.to_datetime(ts_df["tradedate"])
+        link_df = read_sql(f"select {', '.join(LINK_COLUMNS)} from ts_link_table where link_symbol in ({_placeholders(symbols)})",
+                           dbConnection, params=symbols)
+        w_symbols = link_df["w_symbol"].tolist()
+        final_df = read_sql(f"select {', '.join(PRICE_COLUMNS)} from final_a_stock_eod_price where symbol in ({_placeholders(w_symbols)})",
+                            dbConnection, params=w_symbols) if w_symbols else pandas.DataFrame(columns=PRICE_COLUMNS)
+        final_df["tradedate"] = pandas.to_datetime(final_df["tradedate"])
+
+        ts_df, link_df, final_df = relink_symbols(ts_df, _fetch_factor_history(symbols, max_workers), link_df, final_df)
+        for frame in [ts_df, final_df]:
+            frame["tradedate"] = frame["tradedate"].dt.strftime("%Y-%m-%d")
+        link_df["link_date"] = pandas.to_datetime(link_df["link_date"]).dt.strftime("%Y-%m-%d")
+
+        # 三张表在同一个事务内改写
+        try:
+            cursor = dbConnection.cursor()
+            ts_num = upsert_rows(cursor, "ts_a_stock_eod_price", ts_df)
+            link_num = upsert_rows(cursor, "ts_link_table", link_df)
+            final_num = upsert_rows(cursor, "final_a_stock_eod_price", final_df)
+            cursor.close()
+            dbConnection.commit()
+        except Exception:
+            dbConnection.rollback()
+            raise
+        print(f"[SUMMARY] relinked {len(link_df)} symbols: {ts_num} ts rows, {link_num} link rows, {final_num} final rows")
+    finally:
+        dbConnection.close()
+
+
+if __name__ == "__main__":
+    fire.Fire(update_link_ratio)
@@ -15,6 +15,10 @@ REPO="${REPO:-${GITHUB_REPOSITORY:-chenditc/investment_data}}"
 
 DATE=$(date +%F)
 ASSET_NAME="qlib_bin.tar.gz"
+ZSTD_ASSET_NAME="qlib_bin.tar.zst"
+DELTA_ASSET_NAME="qlib_bin_delta.tar.gz"
+MANIFEST_NAME="qlib_bin.manifest.json"
+PARQUET_ASSET_NAME="qlib_parquet.tar"
 BODY="Daily update release"
 
 # Ensure jq is available
@@ -23,18 +27,31 @@ if ! command -v jq >/dev/null 2>&1; then
   exit 1
 fi
 
-# Run dump script to generate the tarball
+API="https://api.github.com/repos/${REPO}"
+AUTH_HEADER="Authorization: token ${TOKEN}"
+
+export OUTPUT_DIR="${OUTPUT_DIR:-$(pwd)/release}"
+mkdir -p "${OUTPUT_DIR}"
+rm -f "${OUTPUT_DIR}/${ASSET_NAME}" "${OUTPUT_DIR}/${ZSTD_ASSET_NAME}" "${OUTPUT_DIR}/${DELTA_ASSET_NAME}" "${OUTPUT_DIR}/${PARQUET_ASSET_NAME}"
+
+# The delta is built against the manifest of the latest published release. A manifest left over from a
+# run whose upload failed is not trusted; without a published manifest a full snapshot is built.
+rm -f "${OUTPUT_DIR}/${MANIFEST_NAME}"
+MANIFEST_URL=$(curl -sSL -H "${AUTH_HEADER}" "${API}/releases/latest" | \
+  jq -r ".assets[]? | select(.name==\"${MANIFEST_NAME}\") | .url" 2>/dev/null || true)
+if [[ -n "${MANIFEST_URL}" ]]; then
+  curl -fsSL -H "${AUTH_HEADER}" -H "Accept: application/octet-stream" "${MANIFEST_URL}" \
+    -o "${OUTPUT_DIR}/${MANIFEST_NAME}" || rm -f "${OUTPUT_DIR}/${MANIFEST_NAME}"
+fi
+
+# Run dump script to generate the delta, and the full tarball on snapshot days
 bash dump_qlib_bin.sh
 
-FILE_PATH="$(pwd)/${ASSET_NAME}"
-if [[ ! -f "${FILE_PATH}" ]]; then
-  echo "Error: ${FILE_PATH} not found" >&2
+if [[ ! -f "${OUTPUT_DIR}/${DELTA_ASSET_NAME}" ]]; then
+  echo "Error: ${OUTPUT_DIR}/${DELTA_ASSET_NAME} not found" >&2
   exit 1
 fi
 
-API="https://api.github.com/repos/${REPO}"
-AUTH_HEADER="Authorization: token ${TOKEN}"
-
 # Get or create release
 RELEASE_ID=$(curl -sSL -H "${AUTH_HEADER}" "${API}/releases/tags/${DATE}" | jq -r '.id' 2>/dev/null || true)
 if [[ -z "${RELEASE_ID}" || "${RELEASE_ID}" == "null" ]]; then
@@ -48,17 +65,25 @@ if [[ -z "${RELEASE_ID}" || "${RELEASE_ID}" == "null" ]]; then
   exit 1
 fi
 
-# Delete existing asset if present
-ASSET_ID=$(curl -fsSL -H "${AUTH_HEADER}" "${API}/releases/${RELEASE_ID}/assets" | jq -r \
-  ".[] | select(.name==\"${ASSET_NAME}\") | .id")
-if [[ -n "${ASSET_ID}" ]]; then
-  curl -fsSL -X DELETE -H "${AUTH_HEADER}" "${API}/releases/assets/${ASSET_ID}" >/dev/null
-fi
+# Replace an existing asset with the same name, then upload the new one
+upload_asset() {
+  local asset_name="$1"
+  local content_type="$2"
+  local file_path="${OUTPUT_DIR}/${asset_name}"
+  local asset_id
+  asset_id=$(curl -fsSL -H "${AUTH_HEADER}" "${API}/releases/${RELEASE_ID}/assets" | jq -r \
+    ".[] | select(.name==\"${asset_name}\") | .id")
+  if [[ -n "${asset_id}" ]]; then
+    curl -fsSL -X DELETE -H "${AUTH_HEADER}" "${API}/releases/assets/${asset_id}" >/dev/null
+  fi
+  curl -fsSL -H "${AUTH_HEADER}" -H "Content-Type: ${content_type}" \
+    --data-binary "@${file_path}" "${UPLOAD_URL}?name=${asset_name}" >/dev/null
+}
 
-# Upload new asset
 UPLOAD_URL=$(curl -fsSL -H "${AUTH_HEADER}" "${API}/releases/${RELEASE_ID}" | jq -r '.upload_url' | sed 's/{?name,label}//')
-
-curl -fsSL -H "${AUTH_HEADER}" -H "Content-Type: application/gzip" \
-  --data-binary "@${FILE_PATH}" "${UPLOAD_URL}?name=${ASSET_NAME}" >/dev/null
-
-echo "Uploaded ${ASSET_NAME} to release ${DATE}"
+for asset in "${ASSET_NAME}" "${ZSTD_ASSET_NAME}" "${DELTA_ASSET_NAME}" "${MANIFEST_NAME}" "${PARQUET_ASSET_NAME}"; do
+  if [[ -f "${OUTPUT_DIR}/${asset}" ]]; then
+    upload_asset "${asset}" "application/octet-stream"
+    echo "Uploaded ${asset} to release ${DATE}"
+  fi
+done